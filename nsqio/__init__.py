@@ -1,6 +1,17 @@
 from nsqio.tcp.writer import create_writer
+from nsqio.tcp.writer_pool import create_writer_pool
+from nsqio.tcp.sharded_writer import create_sharded_writer_pool
 from nsqio.tcp.reader import create_reader
+from nsqio.tcp.multi_reader import create_multi_reader
 
 __version__ = "0.0.12"
 
-__all__ = ["create_writer", "create_reader", "tcp", "http"]
+__all__ = [
+    "create_writer",
+    "create_writer_pool",
+    "create_sharded_writer_pool",
+    "create_reader",
+    "create_multi_reader",
+    "tcp",
+    "http",
+]
@@ -1,4 +1,5 @@
 from .lookupd import NsqLookupd
 from .writer import NsqdHttpWriter
+from .discovery import LookupdTopology
 
-__all__ = ["NsqLookupd", "NsqdHttpWriter"]
+__all__ = ["NsqLookupd", "NsqdHttpWriter", "LookupdTopology"]
@@ -5,25 +5,75 @@ from nsqio.utils import _convert_to_str, get_logger
 
 logger = get_logger()
 
+# loop -> [session, number of users]
+_shared_sessions = {}
+
+
+def acquire_session(loop, keepalive_timeout=60, limit_per_host=10):
+    """Get the process wide aiohttp session of ``loop``.
+
+    the session and its keep-alive connection pool are shared by every
+    http client created with ``shared_session=True`` on the same loop.
+    connector options only apply when the session is created.
+    each call must be paired with :func:`release_session`.
+    """
+    entry = _shared_sessions.get(loop, None)
+    if entry is None or entry[0].closed:
+        connector = aiohttp.TCPConnector(
+            keepalive_timeout=keepalive_timeout, limit_per_host=limit_per_host
+        )
+        entry = [aiohttp.ClientSession(connector=connector, loop=loop), 0]
+        _shared_sessions[loop] = entry
+    entry[1] += 1
+    return entry[0]
+
+
+async def release_session(session):
+    """Release a session from :func:`acquire_session`, closed by the last user."""
+    for loop, entry in list(_shared_sessions.items()):
+        if entry[0] is session:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                _shared_sessions.pop(loop, None)
+                await session.close()
+            return
+
 
 class NsqHTTPConnection:
     """XXX"""
 
-    def __init__(self, host="127.0.0.1", port=4150, *, loop):
+    def __init__(
+        self, host="127.0.0.1", port=4150, *, loop, session=None, shared_session=False
+    ):
         self._loop = loop
         self._endpoint = (host, port)
         self._base_url = "http://{0}:{1}/".format(*self._endpoint)
 
-        self._session = aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(), loop=self._loop
-        )
+        self._shared_session = False
+        if session is not None:
+            # owned by the caller
+            self._session = session
+            self._own_session = False
+        elif shared_session:
+            self._session = acquire_session(self._loop)
+            self._shared_session = True
+            self._own_session = False
+        else:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(), loop=self._loop
+            )
+            self._own_session = True
 
     @property
     def endpoint(self):
         return "http://{0}:{1}".format(*self._endpoint)
 
     async def close(self):
-        return await self._session.close()
+        if self._shared_session:
+            self._shared_session = False
+            return await release_session(self._session)
+        if self._own_session:
+            return await self._session.close()
 
     async def perform_request(self, method, url, params, body):
         _body = _convert_to_str(body) if body else body
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from nsqio.http.lookupd import NsqLookupd
+from nsqio.utils import get_logger
+
+logger = get_logger()
+
+
+class LookupdTopology:
+    """
+    producers discovered from all lookupd, cached between polls
+
+    every poll queries all lookupd concurrently, merges their producers
+    deduplicated on ``broadcast_address:tcp_port`` and keeps the result
+    so it can be read without an http call. Topic None stands for all
+    the nsqd registered in lookupd.
+    """
+
+    def __init__(self, lookupd_http_addresses, *, loop, timeout=5.0, session=None):
+        self._lookupd_http_addresses = list(lookupd_http_addresses)
+        self._loop = loop
+        self._timeout = timeout
+        # lookupd clients live as long as the topology and share one
+        # keep-alive session, the process wide one unless given
+        self._session = session
+        self._clients = {}
+        # topic -> {"host:port": (host, port)}
+        self._producers = {}
+        self._updated_at = {}
+
+    @property
+    def lookupd_http_addresses(self):
+        return self._lookupd_http_addresses
+
+    @property
+    def topics(self):
+        return list(self._producers.keys())
+
+    def producers(self, topic):
+        """Cached ``(host, port)`` of the producers of ``topic``."""
+        return list(self._producers.get(topic, {}).values())
+
+    def updated_at(self, topic):
+        """Time of the last successful poll of ``topic``, None if never."""
+        return self._updated_at.get(topic, None)
+
+    def _client(self, host, port):
+        client = self._clients.get((host, port), None)
+        if client is None:
+            client = NsqLookupd(
+                host,
+                port,
+                loop=self._loop,
+                session=self._session,
+                shared_session=self._session is None,
+            )
+            self._clients[(host, port)] = client
+        return client
+
+    async def _lookup(self, host, port, topic):
+        client = self._client(host, port)
+        request = client.nodes() if topic is None else client.lookup(topic)
+        return await asyncio.wait_for(request, self._timeout, loop=self._loop)
+
+    async def close(self):
+        """Close the lookupd clients."""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error("close {} failed: {}".format(client, e))
+
+    async def poll(self, topic):
+        """Query all lookupd for ``topic`` and update the cache.
+
+        the previous producers are kept if no lookupd answered.
+
+        :param topic: None to poll all the nsqd known to lookupd
+        :return: list of ``(host, port)``
+        """
+        results = await asyncio.gather(
+            *[
+                self._lookup(host, port, topic)
+                for host, port in self._lookupd_http_addresses
+            ],
+            loop=self._loop,
+            return_exceptions=True,
+        )
+        producers, answered = {}, False
+        for (host, port), res in zip(self._lookupd_http_addresses, results):
+            if isinstance(res, Exception):
+                logger.error("lookupd {}:{} failed: {!r}".format(host, port, res))
+                continue
+            logger.debug("lookupd {}:{} response {}".format(host, port, res))
+            if not isinstance(res, dict) or "producers" not in res:
+                logger.debug("producers not found error")
+                continue
+            answered = True
+            for producer in res["producers"]:
+                p_host = producer["broadcast_address"]
+                p_port = producer["tcp_port"]
+                producers["{}:{}".format(p_host, p_port)] = (p_host, p_port)
+        if answered:
+            self._producers[topic] = producers
+            self._updated_at[topic] = time.time()
+        return self.producers(topic)
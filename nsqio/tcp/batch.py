@@ -0,0 +1,127 @@
+from nsqio.tcp.consts import FIN, REQ, MSG_ID_SIZE
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__all__ = ["MessageBatch"]
+
+
+class MessageBatch:
+    """
+    messages received in one read of a connection, stored by column
+
+    ``timestamps`` is an ``array('q')``, ``attempts`` an ``array('h')``,
+    ``ids`` the 16 bytes message ids back to back and ``bodies`` all the
+    bodies in one buffer, message ``i`` spanning
+    ``bodies[offsets[i]:offsets[i + 1]]``. Messages are finished or
+    requeued by index range with a single write.
+    """
+
+    def __init__(self, timestamps, attempts, ids, bodies, offsets, conn):
+        self.timestamps = timestamps
+        self.attempts = attempts
+        self.ids = ids
+        self.bodies = bodies
+        self.offsets = offsets
+        self.conn = conn
+        self._processed = bytearray(len(timestamps))
+        self._num_pending = len(timestamps)
+        self._processed_hook = None
+        self._received_at = None
+        self._topic = None
+        self._channel = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def topic(self):
+        """Topic the batch was received from, if known."""
+        return self._topic
+
+    @property
+    def channel(self):
+        """Channel the batch was received from, if known."""
+        return self._channel
+
+    @property
+    def pending(self):
+        """Number of messages neither finished nor requeued."""
+        return self._num_pending
+
+    @property
+    def processed(self):
+        """True if all messages have been finished or requeued."""
+        return self._num_pending == 0
+
+    def message_id(self, i):
+        return bytes(self.ids[i * MSG_ID_SIZE : (i + 1) * MSG_ID_SIZE])
+
+    def body(self, i):
+        """Body of message ``i`` as a memoryview of ``bodies``, no copy."""
+        return memoryview(self.bodies)[self.offsets[i] : self.offsets[i + 1]]
+
+    def is_processed(self, i):
+        return bool(self._processed[i])
+
+    def as_numpy(self):
+        """Zero copy NumPy views of the columns.
+
+        :return: dict of ``timestamps`` int64, ``attempts`` int16, ``ids``
+            S16, ``bodies`` uint8 and ``offsets`` int64 arrays
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is not installed")
+        return {
+            "timestamps": numpy.frombuffer(self.timestamps, dtype=numpy.int64),
+            "attempts": numpy.frombuffer(self.attempts, dtype=numpy.int16),
+            "ids": numpy.frombuffer(self.ids, dtype="S{}".format(MSG_ID_SIZE)),
+            "bodies": numpy.frombuffer(self.bodies, dtype=numpy.uint8),
+            "offsets": numpy.frombuffer(self.offsets, dtype=numpy.int64),
+        }
+
+    def _pending_indices(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return [i for i in range(start, stop) if not self._processed[i]]
+
+    def _process(self, command, args_list, indices, requeued):
+        if not indices:
+            return 0
+        self.conn.execute_many(command, args_list)
+        for i in indices:
+            self._processed[i] = 1
+        self._num_pending -= len(indices)
+        if self._processed_hook:
+            self._processed_hook(self, len(indices), requeued)
+        return len(indices)
+
+    async def fin(self, start=0, stop=None):
+        """Finish messages ``[start, stop)``, all by default.
+
+        :return: number of messages finished
+        """
+        indices = self._pending_indices(start, stop)
+        args_list = [(self.message_id(i),) for i in indices]
+        return self._process(FIN, args_list, indices, False)
+
+    async def req(self, start=0, stop=None, timeout=10):
+        """Re-queue messages ``[start, stop)``, all by default.
+
+        :param timeout: ``int`` configured max timeout  0 is a special case
+            that will not defer re-queueing.
+        :return: number of messages requeued
+        """
+        indices = self._pending_indices(start, stop)
+        args_list = [(self.message_id(i), timeout) for i in indices]
+        return self._process(REQ, args_list, indices, True)
+
+    def _requeue_pending(self):
+        """REQ every pending message without delay, used on drain"""
+        indices = self._pending_indices(0, None)
+        args_list = [(self.message_id(i), 0) for i in indices]
+        return self._process(REQ, args_list, indices, True)
+
+    def __repr__(self):
+        return "<MessageBatch{}@{}>".format(len(self), self.conn)
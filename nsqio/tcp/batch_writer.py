@@ -0,0 +1,118 @@
+from asyncio.events import AbstractEventLoop
+from typing import Optional
+
+import asyncio
+
+from nsqio.tcp.exceptions import make_error
+from nsqio.utils import _convert_to_bytes, get_logger
+
+__all__ = ["BatchingWriter"]
+
+logger = get_logger()
+
+
+class _Batch:
+    def __init__(self):
+        self.messages = []
+        self.futures = []
+        self.keys = []
+        # MPUB body: number of messages then size and data of each
+        self.size = 4
+        self.timer = None
+
+
+class BatchingWriter:
+    """
+    coalesce concurrent pub() into MPUB
+
+    Messages published to a topic are held until ``max_count`` messages or
+    ``max_bytes`` of MPUB body are collected, or ``linger`` seconds passed
+    since the first one, then sent as one MPUB. Every pub() resolves with
+    the MPUB response or raises its error.
+
+    :param writer: Writer or WriterPool, anything with ``mpub``
+    :param max_count: max messages in a MPUB
+    :param max_bytes: max MPUB body size, keep it under nsqd --max-body-size
+    :param linger: max seconds a message waits for others
+    """
+
+    def __init__(
+        self,
+        writer,
+        max_count: int = 100,
+        max_bytes: int = 1024 * 1024,
+        linger: float = 0.005,
+        loop: Optional[AbstractEventLoop] = None,
+    ):
+        assert max_count > 0, "max_count must be positive"
+        self._writer = writer
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._linger = linger
+        self._loop: AbstractEventLoop = loop or asyncio.get_event_loop()
+        # topic -> _Batch being filled
+        self._batches = {}
+        self._sending = set()
+
+    def publish(self, topic, message, key=None) -> asyncio.Future:
+        """Queue ``message``, the future resolves when its MPUB is acked.
+
+        :param key: routing key kept with the message in its batch
+        """
+        data = _convert_to_bytes(message)
+        size = 4 + len(data)
+        batch = self._batches.get(topic, None)
+        if batch is not None and batch.size + size > self._max_bytes:
+            self._flush(topic)
+            batch = None
+        if batch is None:
+            batch = self._batches[topic] = _Batch()
+            batch.timer = self._loop.call_later(self._linger, self._flush, topic)
+        fut = self._loop.create_future()
+        batch.messages.append(data)
+        batch.futures.append(fut)
+        batch.keys.append(key)
+        batch.size += size
+        if len(batch.messages) >= self._max_count or batch.size >= self._max_bytes:
+            self._flush(topic)
+        return fut
+
+    async def pub(self, topic, message, key=None):
+        return await self.publish(topic, message, key)
+
+    def _flush(self, topic):
+        batch = self._batches.pop(topic, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = self._loop.create_task(self._send(topic, batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, topic, batch: _Batch):
+        try:
+            resp = await self._writer.mpub(topic, *batch.messages)
+            if isinstance(resp, tuple):
+                raise make_error(*resp)
+        except Exception as e:
+            logger.warning(
+                "MPUB of {} messages to {} failed: {!r}".format(
+                    len(batch.messages), topic, e
+                )
+            )
+            for fut in batch.futures:
+                fut.done() or fut.set_exception(e)
+        else:
+            for fut in batch.futures:
+                fut.done() or fut.set_result(resp)
+
+    async def flush(self):
+        """Send every pending message now and wait for the responses."""
+        for topic in list(self._batches):
+            self._flush(topic)
+        if self._sending:
+            await asyncio.wait(list(self._sending), loop=self._loop)
+
+    async def close(self):
+        """Flush, the wrapped writer is left open."""
+        await self.flush()
@@ -14,15 +14,24 @@ from nsqio.tcp.consts import (
     FRAME_TYPE_RESPONSE,
     FRAME_TYPE_ERROR,
     FRAME_TYPE_MESSAGE,
+    MAX_RDY_COUNT,
+    MSG_TIMEOUT,
+    MAX_MSG_TIMEOUT,
+    MAX_MSG_SIZE,
+    MAX_BODY_SIZE,
 )
 
 from nsqio.tcp.messages import NsqMessage
+from nsqio.tcp.batch import MessageBatch
 from nsqio.utils import get_logger
 from nsqio.tcp.exceptions import ProtocolError  # , make_error
 from nsqio.tcp.protocol import Reader, DeflateReader, SnappyReader
 
 logger = get_logger()
 
+# read size in batch mode, big enough for runs of messages
+BATCH_READ_SIZE = 65536
+
 
 async def create_connection(
     host: str = "localhost", port: int = 4150, queue=None, loop=None
@@ -78,11 +87,23 @@ class TcpConnection:
         self._is_upgrading = False
         self._on_message = on_message
         self._on_rdy_changed_cb = on_rdy_changed
+        # called with the connection once it is closed
         self._on_close = None
         self._on_close_flag = asyncio.Event(loop=self._loop)
 
         # number of received but not acked or req messages
         self._in_flight = 0
+        # last RDY count sent to nsqd and how much of it is left
+        self._last_rdy = 0
+        self._rdy = 0
+        # time of the last received message
+        self._last_message = 0
+        # batch mode: runs of messages are queued as one MessageBatch
+        self._batch_size = 0
+        self._on_batch = None
+        self._read_size = 52
+        # IDENTIFY response, empty without feature_negotiation
+        self._identify_config = {}
         logger.info("new connection: {}:{}".format(self._host, self._port))
 
     def connect(self):
@@ -111,12 +132,94 @@ class TcpConnection:
         # track all processed and requeued messages
         if command in (b"FIN", b"REQ", "FIN", "REQ"):
             self._in_flight = max(0, self._in_flight - 1)
+        elif command in (b"RDY", "RDY"):
+            self._last_rdy = self._rdy = int(args[0])
         return fut
 
+    def execute_many(self, command: bytes, args_list):
+        """Write ``command`` once for every args tuple in a single write.
+
+        only for commands without response: FIN, REQ, TOUCH, RDY, NOP
+        """
+        assert (
+            self._reader and not self._reader.at_eof()
+        ), "Connection closed or corrupted"
+        if command not in (b"NOP", b"FIN", b"RDY", b"REQ", b"TOUCH"):
+            raise ValueError("{} has a response, use execute".format(command))
+        args_list = list(args_list)
+        if not args_list:
+            return
+        self._writer.write(
+            b"".join(self._parser.encode_command(command, *args) for args in args_list)
+        )
+        if command in (b"FIN", b"REQ"):
+            self._in_flight = max(0, self._in_flight - len(args_list))
+        elif command == b"RDY":
+            self._last_rdy = self._rdy = int(args_list[-1][0])
+
+    def execute_pipelined(self, command: bytes, calls):
+        """Write ``command`` once for every ``(args, data)`` in a single write.
+
+        :return: futures of the responses, in order
+        """
+        assert (
+            self._reader and not self._reader.at_eof()
+        ), "Connection closed or corrupted"
+        futures, raw = [], []
+        for args, data in calls:
+            fut = asyncio.Future(loop=self._loop)
+            self._cmd_waiters.append((fut, None))
+            futures.append(fut)
+            raw.append(self._parser.encode_command(command, *args, data=data))
+        if raw:
+            self._writer.write(b"".join(raw))
+        return futures
+
+    @property
+    def identify_config(self):
+        """config negotiated by IDENTIFY"""
+        return self._identify_config
+
+    @property
+    def max_rdy_count(self):
+        return self._identify_config.get("max_rdy_count", MAX_RDY_COUNT)
+
+    @property
+    def msg_timeout(self):
+        return self._identify_config.get("msg_timeout", MSG_TIMEOUT)
+
+    @property
+    def max_msg_timeout(self):
+        return self._identify_config.get("max_msg_timeout", MAX_MSG_TIMEOUT)
+
+    @property
+    def max_msg_size(self):
+        """nsqd --max-msg-size, its default unless IDENTIFY reports it"""
+        return self._identify_config.get("max_msg_size", MAX_MSG_SIZE)
+
+    @property
+    def max_body_size(self):
+        """nsqd --max-body-size, its default unless IDENTIFY reports it"""
+        return self._identify_config.get("max_body_size", MAX_BODY_SIZE)
+
     @property
     def in_flight(self):
         return self._in_flight
 
+    @property
+    def last_message(self):
+        return self._last_message
+
+    @property
+    def rdy(self):
+        """Number of messages nsqd may still send before RDY is refreshed."""
+        return self._rdy
+
+    @property
+    def last_rdy(self):
+        """Last RDY count sent to nsqd."""
+        return self._last_rdy
+
     @property
     def endpoint(self):
         return "tcp://{}:{}".format(self._host, self._port)
@@ -176,6 +279,7 @@ class TcpConnection:
             self._finish_upgrading()
             return resp
         resp_config = json.loads(resp.decode("utf-8"))
+        self._identify_config = resp_config
         fut = None
         if resp_config.get("tls_v1"):
             await self._upgrade_to_tls()
@@ -201,6 +305,18 @@ class TcpConnection:
         self._writer.transport.close()
         self._reader_task.cancel()
         self._on_close_flag.set()
+        # no response will come, fail the commands waiting for one
+        while self._cmd_waiters:
+            waiter, _ = self._cmd_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(
+                    ConnectionError("{} closed with command pending".format(self.id))
+                )
+        if self._on_close is not None:
+            try:
+                self._on_close(self)
+            except Exception as e:
+                logger.exception("{} on_close failed: {}".format(self, e))
 
     def _send_magic(self):
         self._writer.write(MAGIC_V2)
@@ -263,7 +379,7 @@ class TcpConnection:
         # logger.debug("{} starting _read_data".format(self))
         while not self._reader.at_eof():
             try:
-                data = await self._reader.read(52)
+                data = await self._reader.read(self._read_size)
             except asyncio.CancelledError:
                 is_canceled = True
                 logger.debug("Task is canceled {}".format(self))
@@ -318,6 +434,7 @@ class TcpConnection:
 
                 # track number in flight messages
                 self._in_flight += 1
+                self._rdy = max(0, self._rdy - 1)
 
                 ts, att, msg_id, body = resp
                 self._on_message_hook(ts, att, msg_id, body)
@@ -328,11 +445,38 @@ class TcpConnection:
         msg = NsqMessage(ts, att, msg_id, body, self)
         if self._on_message:
             msg = self._on_message(msg)
-        self._queue.put_nowait(msg)
+        # None if the hook has handled the message already
+        if msg is not None:
+            self._queue.put_nowait(msg)
+
+    def set_batch_mode(self, batch_size, on_batch=None):
+        """Queue up to ``batch_size`` messages read at once as a MessageBatch.
+
+        :param batch_size: max messages per batch, 0 to queue NsqMessage
+        :param on_batch: hook called with every batch before it is queued
+        """
+        self._batch_size = batch_size
+        self._on_batch = on_batch
+        self._read_size = BATCH_READ_SIZE if batch_size else 52
+
+    def _parse_batch(self):
+        columns = self._parser.gets_messages(self._batch_size)
+        if columns is None:
+            return False
+        batch = MessageBatch(*columns, self)
+        self._in_flight += len(batch)
+        self._rdy = max(0, self._rdy - len(batch))
+        if self._on_batch:
+            batch = self._on_batch(batch)
+        if batch is not None:
+            self._queue.put_nowait(batch)
+        return True
 
     def _read_buffer(self):
         is_continue = True
         while is_continue:
+            if self._batch_size and not self._is_upgrading and self._parse_batch():
+                continue
             is_continue = self._parse_data()
 
     def _start_upgrading(self, resp=None):
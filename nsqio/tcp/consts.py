@@ -31,6 +31,13 @@ SUB = b"SUB"
 PUB = b"PUB"
 DPUB = b"DPUB"
 
+# nsqd defaults of the limits IDENTIFY may not report
+MAX_RDY_COUNT = 2500
+MSG_TIMEOUT = 60000
+MAX_MSG_TIMEOUT = 15 * 60 * 1000
+MAX_MSG_SIZE = 1024 * 1024
+MAX_BODY_SIZE = 5 * 1024 * 1024
+
 # connection status
 CLOSED = 0
 INIT = 1
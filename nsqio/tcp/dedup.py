@@ -0,0 +1,84 @@
+import time
+
+from typing import Optional
+from collections import OrderedDict
+
+__all__ = ["DedupCache", "DEDUP_FIN", "DEDUP_FLAG"]
+
+# on a redelivery of a finished message: FIN it without handing it out,
+# or hand it out with ``message.duplicate`` set
+DEDUP_FIN = "fin"
+DEDUP_FLAG = "flag"
+
+_PENDING = 0
+_DONE = 1
+
+
+class DedupCache:
+    """
+    bounded record of message ids seen by a Reader
+
+    An id is pending from its delivery until the message is finished, then
+    done; a requeued id is forgotten so its redelivery is handled again.
+    The least recently seen ids are evicted above ``capacity`` entries, and
+    ids older than ``ttl`` seconds are expired when set.
+
+    :param capacity: max number of ids kept
+    :param ttl: seconds an id is kept, None to keep until evicted
+    """
+
+    def __init__(self, capacity: int = 100000, ttl: float = None, time_func=None):
+        assert capacity > 0, "capacity must be positive"
+        self.capacity = capacity
+        self.ttl = ttl
+        self._time = time_func or time.monotonic
+        # message_id -> (state, seen_at), oldest first
+        self._ids = OrderedDict()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, message_id):
+        return message_id in self._ids
+
+    def _expire(self, now):
+        if self.ttl is None:
+            return
+        ids = self._ids
+        while ids:
+            message_id, (_, seen_at) = next(iter(ids.items()))
+            if now - seen_at < self.ttl:
+                break
+            del ids[message_id]
+
+    def received(self, message_id) -> Optional[bool]:
+        """Record a delivery of ``message_id``.
+
+        :return: None for a first delivery, False if the id is still being
+            handled, True if it was already finished
+        """
+        now = self._time()
+        self._expire(now)
+        entry = self._ids.get(message_id, None)
+        if entry is None:
+            self._ids[message_id] = (_PENDING, now)
+            if len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+            return None
+        self.hits += 1
+        self._ids[message_id] = (entry[0], now)
+        self._ids.move_to_end(message_id)
+        return entry[0] == _DONE
+
+    def finished(self, message_id):
+        """Mark ``message_id`` as finished."""
+        if message_id in self._ids:
+            self._ids[message_id] = (_DONE, self._ids[message_id][1])
+
+    def forget(self, message_id):
+        """Drop ``message_id``, its next delivery is not a duplicate."""
+        self._ids.pop(message_id, None)
+
+    def clear(self):
+        self._ids.clear()
@@ -0,0 +1,173 @@
+from asyncio.events import AbstractEventLoop
+from typing import Optional
+
+import asyncio
+import heapq
+import itertools
+
+from nsqio.tcp.exceptions import make_error
+from nsqio.utils import _convert_to_bytes, get_logger
+
+__all__ = ["DelayedWriter"]
+
+logger = get_logger()
+
+
+class _Group:
+    def __init__(self, created):
+        # when the first message was queued, delays count from there
+        self.created = created
+        self.items = []
+
+
+class DelayedWriter:
+    """
+    batch delayed publishes into pipelined DPUB
+
+    Messages are grouped by delay and held until ``max_count`` messages are
+    pending or ``linger`` seconds passed, then every group is sent as DPUB
+    frames in one write, the delay shortened by the time waited.
+
+    Delays over ``hold_after`` milliseconds are kept client-side in a heap
+    and published once they are within ``hold_after`` of being due, so
+    nsqd only holds short delays; keep it under nsqd --max-req-timeout.
+    Held messages are lost if the process stops before they are sent.
+
+    :param writer: Writer, anything with ``dpub_many``
+    :param max_count: max DPUB in a write
+    :param linger: max seconds a message waits for others
+    :param hold_after: delay in millisecond over which messages are held
+        client-side, None to send every delay to nsqd
+    """
+
+    def __init__(
+        self,
+        writer,
+        max_count: int = 1000,
+        linger: float = 0.005,
+        hold_after: Optional[int] = None,
+        loop: Optional[AbstractEventLoop] = None,
+    ):
+        assert max_count > 0, "max_count must be positive"
+        self._writer = writer
+        self._max_count = max_count
+        self._linger = linger
+        self._hold_after = hold_after
+        self._loop: AbstractEventLoop = loop or asyncio.get_event_loop()
+        # delay -> _Group being filled
+        self._groups = {}
+        self._pending = 0
+        self._timer = None
+        self._sending = set()
+        # (due time, seq, topic, message, future) of held messages
+        self._held = []
+        self._seq = itertools.count()
+        self._held_timer = None
+
+    @property
+    def held(self):
+        """number of messages held client-side"""
+        return len(self._held)
+
+    def publish(self, topic, message, delay_time) -> asyncio.Future:
+        """Queue ``message``, the future resolves when its DPUB is acked.
+
+        :param delay_time: delay in millisecond
+        """
+        data = _convert_to_bytes(message)
+        delay_time = int(delay_time or 0)
+        fut = self._loop.create_future()
+        if self._hold_after is not None and delay_time > self._hold_after:
+            due = self._loop.time() + delay_time / 1000
+            heapq.heappush(self._held, (due, next(self._seq), topic, data, fut))
+            self._schedule_held()
+            return fut
+        self._queue(topic, data, delay_time, fut)
+        return fut
+
+    async def dpub(self, topic, delay_time, message):
+        return await self.publish(topic, message, delay_time)
+
+    def _queue(self, topic, data, delay_time, fut):
+        group = self._groups.get(delay_time, None)
+        if group is None:
+            group = self._groups[delay_time] = _Group(self._loop.time())
+        group.items.append((topic, data, fut))
+        self._pending += 1
+        if self._pending >= self._max_count:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self._linger, self._flush)
+
+    def _schedule_held(self):
+        if self._held_timer is not None:
+            self._held_timer.cancel()
+        due = self._held[0][0] - self._hold_after / 1000
+        self._held_timer = self._loop.call_at(due, self._release_held)
+
+    def _release_held(self):
+        self._held_timer = None
+        now = self._loop.time()
+        horizon = now + self._hold_after / 1000
+        while self._held and self._held[0][0] <= horizon:
+            due, _, topic, data, fut = heapq.heappop(self._held)
+            if fut.done():
+                continue
+            self._queue(topic, data, max(0, int((due - now) * 1000)), fut)
+        if self._held:
+            self._schedule_held()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._groups:
+            return
+        now = self._loop.time()
+        items, futures = [], []
+        for delay_time, group in self._groups.items():
+            waited = int((now - group.created) * 1000)
+            delay_time = max(0, delay_time - waited)
+            for topic, data, fut in group.items:
+                items.append((topic, delay_time, data))
+                futures.append(fut)
+        self._groups = {}
+        self._pending = 0
+        task = self._loop.create_task(self._send(items, futures))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, items, futures):
+        try:
+            responses = await self._writer.dpub_many(items)
+        except Exception as e:
+            logger.warning("DPUB of {} messages failed: {!r}".format(len(items), e))
+            for fut in futures:
+                fut.done() or fut.set_exception(e)
+            return
+        for fut, resp in zip(futures, responses):
+            if fut.done():
+                continue
+            if isinstance(resp, tuple):
+                fut.set_exception(make_error(*resp))
+            else:
+                fut.set_result(resp)
+
+    async def flush(self):
+        """Send every pending message now and wait for the responses,
+        held messages stay held."""
+        self._flush()
+        if self._sending:
+            await asyncio.wait(list(self._sending), loop=self._loop)
+
+    async def close(self):
+        """Flush and cancel held messages, the wrapped writer is left open."""
+        if self._held_timer is not None:
+            self._held_timer.cancel()
+            self._held_timer = None
+        if self._held:
+            logger.warning("{} held delayed messages dropped".format(len(self._held)))
+        for *_, fut in self._held:
+            fut.cancel()
+        self._held = []
+        await self.flush()
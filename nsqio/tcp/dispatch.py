@@ -0,0 +1,152 @@
+from collections import deque
+from typing import Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from nsqio.tcp.messages import NsqMessage
+    from nsqio.tcp.reader import Reader
+
+import asyncio
+import zlib
+
+from nsqio.utils import get_logger
+
+__all__ = ["KeyedDispatcher"]
+
+logger = get_logger()
+
+
+class _Lane:
+    def __init__(self, capacity, loop):
+        self.queue = asyncio.Queue(capacity, loop=loop)
+        # messages waiting for room in the queue, in order
+        self.parked = deque()
+
+
+class KeyedDispatcher:
+    """
+    run a handler on the messages of a Reader, in order per key
+
+    ``key_func(message)`` picks the key of every message, keys are hashed to
+    one of ``lanes`` serial lanes: messages of a key are handled one at a
+    time in arrival order, different lanes run concurrently. A message is
+    FIN once its handler returns and REQ if it raises.
+
+    A lane holds at most ``lane_capacity`` messages, by default its share of
+    max_in_flight. A message for a full lane is parked behind it, in order,
+    and the connection it came from is held at RDY 0 until its parked
+    messages entered their lane; messages of other lanes keep flowing.
+    """
+
+    def __init__(
+        self,
+        reader: "Reader",
+        handler: Callable,
+        key_func: Callable,
+        lanes: int = 8,
+        lane_capacity: int = None,
+        requeue_delay: int = 0,
+    ):
+        assert lanes > 0, "lanes must be positive"
+        self._reader = reader
+        self._handler = handler
+        self._key_func = key_func
+        self._lanes = lanes
+        self._lane_capacity = lane_capacity
+        self._requeue_delay = requeue_delay
+        self._lanes_state = []
+        # conn_id -> messages of the connection parked, held at RDY 0
+        self._parked_conns = {}
+        # messages parked behind a full lane
+        self.overflows = 0
+
+    @property
+    def lane_capacity(self):
+        if self._lane_capacity is not None:
+            return self._lane_capacity
+        return max(1, self._reader.max_in_flight // self._lanes)
+
+    def lane_depths(self):
+        return [lane.queue.qsize() + len(lane.parked) for lane in self._lanes_state]
+
+    def _lane_of(self, msg: "NsqMessage"):
+        key = self._key_func(msg)
+        if isinstance(key, str):
+            key = key.encode()
+        if isinstance(key, (bytes, bytearray, memoryview)):
+            # stable across processes, unlike hash()
+            return zlib.crc32(key) % self._lanes
+        return hash(key) % self._lanes
+
+    async def run(self):
+        """dispatch until the reader is unsubscribed, then finish the lanes"""
+        loop = self._reader._loop
+        capacity = self.lane_capacity
+        self._lanes_state = [_Lane(capacity, loop) for _ in range(self._lanes)]
+        workers = [loop.create_task(self._lane(lane)) for lane in self._lanes_state]
+        try:
+            async for msg in self._reader.messages():
+                try:
+                    lane = self._lanes_state[self._lane_of(msg)]
+                except Exception as e:
+                    logger.error("key of {} failed: {!r}".format(msg, e))
+                    await self._requeue(msg, self._requeue_delay)
+                    continue
+                self._put(lane, msg)
+        finally:
+            # behind the parked messages
+            for lane in self._lanes_state:
+                self._put(lane, None)
+            await asyncio.gather(*workers, loop=loop, return_exceptions=True)
+
+    def _put(self, lane: _Lane, msg):
+        if not lane.parked and not lane.queue.full():
+            lane.queue.put_nowait(msg)
+            return
+        lane.parked.append(msg)
+        if msg is None:
+            return
+        self.overflows += 1
+        conn_id = msg.conn.id
+        count = self._parked_conns.get(conn_id, 0)
+        if count == 0:
+            self._reader.hold_rdy(conn_id)
+        self._parked_conns[conn_id] = count + 1
+
+    def _unpark(self, lane: _Lane):
+        """move parked messages into the lane while it has room"""
+        while lane.parked and not lane.queue.full():
+            msg = lane.parked.popleft()
+            lane.queue.put_nowait(msg)
+            if msg is None:
+                continue
+            conn_id = msg.conn.id
+            self._parked_conns[conn_id] -= 1
+            if self._parked_conns[conn_id] == 0:
+                del self._parked_conns[conn_id]
+                self._reader.release_rdy(conn_id)
+
+    async def _lane(self, lane: _Lane):
+        while True:
+            msg = await lane.queue.get()
+            self._unpark(lane)
+            if msg is None:
+                return
+            try:
+                await self._handler(msg)
+            except Exception as e:
+                logger.error("handler of {} failed: {!r}".format(msg, e))
+                await self._requeue(msg, self._requeue_delay)
+                continue
+            if not msg.processed:
+                try:
+                    await msg.fin()
+                except Exception as e:
+                    logger.warning("FIN {} failed: {!r}".format(msg, e))
+
+    async def _requeue(self, msg: "NsqMessage", delay):
+        if msg.processed:
+            return
+        try:
+            await msg.req(delay)
+        except Exception as e:
+            logger.warning("REQ {} failed: {!r}".format(msg, e))
@@ -22,6 +22,14 @@ class NSQFrameError(NSQException):
     pass
 
 
+class NSQSpoolFull(NSQException):
+    """publish spool is over its size cap"""
+
+
+class NSQRetryBufferFull(NSQException):
+    """publish retry buffer is full, or the publish was dropped from it"""
+
+
 class NSQErrorCode(NSQException):
     fatal = True
 
@@ -70,6 +78,10 @@ class NSQMPubFailed(NSQErrorCode):
     """E_MPUB_FAILED"""
 
 
+class NSQDPubFailed(NSQErrorCode):
+    """E_DPUB_FAILED"""
+
+
 class NSQAuthDisabled(NSQErrorCode):
     """E_AUTH_DISABLED"""
 
@@ -109,6 +121,7 @@ ERROR_CODES = {
     b"E_PUT_FAILED": NSQPutFailed,
     b"E_PUB_FAILED": NSQPubFailed,
     b"E_MPUB_FAILED": NSQMPubFailed,
+    b"E_DPUB_FAILED": NSQDPubFailed,
     b"E_FINISH_FAILED": NSQFinishFailed,
     b"E_AUTH_DISABLED": NSQAuthDisabled,
     b"E_AUTH_FAILED": NSQAuthFailed,
@@ -16,7 +16,12 @@ class NsqMessage(BaseMessage):
     def __new__(cls, *args, **kwargs):
         self = super().__new__(cls, *args, **kwargs)
         self._is_processed = False
+        self._is_requeued = False
         self._processed_hook = None
+        self._received_at = None
+        self._topic = None
+        self._channel = None
+        self._is_duplicate = False
         return self
 
     @property
@@ -24,6 +29,30 @@ class NsqMessage(BaseMessage):
         """True if message has been processed: finished or re-queued."""
         return self._is_processed
 
+    @property
+    def topic(self):
+        """Topic the message was received from, if known."""
+        return self._topic
+
+    @property
+    def channel(self):
+        """Channel the message was received from, if known."""
+        return self._channel
+
+    @property
+    def duplicate(self):
+        """True if the message id was delivered before, see DedupCache."""
+        return self._is_duplicate
+
+    @property
+    def requeued(self):
+        """True if message has been re-queued."""
+        return self._is_requeued
+
+    def _mark_processed(self, requeued=False):
+        self._is_requeued = requeued
+        self._is_processed = True
+
     async def fin(self):
         """Finish a message (indicate successful processing)
 
@@ -48,6 +77,7 @@ class NsqMessage(BaseMessage):
             logger.warning("{} has already been processed".format(self))
             return None
         resp = await self.conn.execute(REQ, self.message_id, timeout)
+        self._is_requeued = True
         if self._processed_hook:
             self._processed_hook(self)
         self._is_processed = True
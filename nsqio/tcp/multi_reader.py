@@ -0,0 +1,247 @@
+from asyncio.events import AbstractEventLoop
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from nsqio.tcp.messages import NsqMessage
+
+import asyncio
+
+from nsqio.http import LookupdTopology
+from nsqio.tcp.reader import Reader
+from nsqio.utils import get_logger, get_host_and_port
+
+__all__ = ["MultiReader", "create_multi_reader"]
+
+logger = get_logger()
+
+
+async def create_multi_reader(
+    nsqd_tcp_addresses=None,
+    loop=None,
+    max_in_flight=42,
+    lookupd_http_addresses=None,
+    **kwargs,
+):
+    """
+    initial function to get a consumer of many topic/channel pairs
+    param: nsqd_tcp_addresses: tcp addrs with no protocol.
+        such as ['127.0.0.1:4150','182.168.1.1:4150']
+    param: max_in_flight: number of messages get but not finish or req,
+        shared by all subscriptions
+    param: lookupd_http_addresses: first priority.if provided nsqd will neglected
+    other params are passed to every Reader, see create_reader
+    """
+    loop = loop or asyncio.get_event_loop()
+    if not lookupd_http_addresses:
+        if nsqd_tcp_addresses is None:
+            nsqd_tcp_addresses = ["127.0.0.1:4150"]
+        nsqd_tcp_addresses = [get_host_and_port(i) for i in nsqd_tcp_addresses]
+    return MultiReader(
+        nsqd_tcp_addresses=nsqd_tcp_addresses,
+        lookupd_http_addresses=lookupd_http_addresses,
+        max_in_flight=max_in_flight,
+        loop=loop,
+        **kwargs,
+    )
+
+
+class _Subscription:
+    def __init__(self, reader: Reader, weight: float):
+        self.reader = reader
+        self.weight = weight
+        # virtual time of the stride scheduler
+        self.pass_ = 0.0
+        self.head = None
+
+    def wait(self, loop):
+        """future done once a message is received"""
+        if self.head is None:
+            self.head = asyncio.ensure_future(self.reader._queue.get(), loop=loop)
+        return self.head
+
+    def ready(self, loop):
+        if self.head is not None and self.head.done():
+            return True
+        queue = self.reader._queue
+        if queue.empty():
+            return False
+        # a message is queued but the waiting task has not run yet
+        if self.head is not None:
+            self.head.cancel()
+        self.head = loop.create_future()
+        self.head.set_result(queue.get_nowait())
+        return True
+
+    def take(self):
+        msg = self.head.result()
+        self.head = None
+        return msg
+
+    def disarm(self):
+        """stop waiting for messages, one already received is given back"""
+        head, self.head = self.head, None
+        if head is None:
+            return
+        if head.done():
+            if not head.cancelled() and head.result() is not None:
+                self.reader._queue.put_nowait(head.result())
+        else:
+            head.cancel()
+
+
+class MultiReader:
+    """
+    NSQ tcp reader of many topic/channel pairs
+
+    Every subscription is a Reader, NSQ binds a connection to a single
+    SUB, but they share the lookupd topology with its keep-alive session.
+    ``max_in_flight`` is split between subscriptions by weight, and
+    ``messages()`` interleaves their messages by weight (stride
+    scheduling) so a busy topic cannot starve the others.
+    """
+
+    def __init__(
+        self,
+        nsqd_tcp_addresses=None,
+        lookupd_http_addresses=None,
+        max_in_flight: int = 42,
+        loop: Optional[AbstractEventLoop] = None,
+        lookupd_timeout: float = 5,
+        **reader_kwargs,
+    ):
+        self._loop: AbstractEventLoop = loop or asyncio.get_event_loop()
+        self._nsqd_tcp_addresses = nsqd_tcp_addresses or []
+        self._max_in_flight = max_in_flight
+        self._reader_kwargs = reader_kwargs
+        self._topology = None
+        if lookupd_http_addresses:
+            self._topology = LookupdTopology(
+                lookupd_http_addresses, loop=self._loop, timeout=lookupd_timeout
+            )
+        # (topic, channel) -> _Subscription
+        self._subscriptions = {}
+        self._vtime = 0.0
+        self._wakeup = self._loop.create_future()
+        self._is_closed = False
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    @property
+    def readers(self):
+        return {key: sub.reader for key, sub in self._subscriptions.items()}
+
+    def _notify(self):
+        if not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def _rebalance(self):
+        """split max_in_flight between subscriptions by weight"""
+        total = sum(sub.weight for sub in self._subscriptions.values())
+        for sub in self._subscriptions.values():
+            share = max(1, int(self._max_in_flight * sub.weight / total))
+            sub.reader.update_max_in_flight(share)
+
+    def update_max_in_flight(self, max_in_flight: int):
+        self._max_in_flight = max_in_flight
+        if self._subscriptions:
+            self._rebalance()
+
+    async def subscribe(self, topic: str, channel: str, weight: float = 1):
+        """subscribe to topic/channel, or change the weight of a subscription"""
+        assert weight > 0, "weight must be positive"
+        if self._is_closed:
+            raise RuntimeError("{} is closed".format(self))
+        sub = self._subscriptions.get((topic, channel), None)
+        if sub is not None:
+            sub.weight = weight
+            self._rebalance()
+            return True
+        reader = Reader(
+            nsqd_tcp_addresses=self._nsqd_tcp_addresses,
+            max_in_flight=self._max_in_flight,
+            loop=self._loop,
+            topology=self._topology,
+            **self._reader_kwargs,
+        )
+        sub = _Subscription(reader, weight)
+        # start at the current virtual time, no catching up
+        sub.pass_ = self._vtime
+        self._subscriptions[(topic, channel)] = sub
+        self._rebalance()
+        try:
+            await reader.connect()
+            await reader.subscribe(topic, channel)
+        except Exception:
+            self._subscriptions.pop((topic, channel), None)
+            await reader.close()
+            if self._subscriptions:
+                self._rebalance()
+            raise
+        self._notify()
+        return True
+
+    async def unsubscribe(self, topic: str, channel: str, timeout=10):
+        """drain and close one subscription"""
+        sub = self._subscriptions.pop((topic, channel), None)
+        if sub is None:
+            logger.warning("{} not subscribed to {}/{}".format(self, topic, channel))
+            return
+        sub.disarm()
+        self._notify()
+        await sub.reader.close(timeout)
+        if self._subscriptions:
+            self._rebalance()
+
+    def _next_ready(self) -> "Optional[_Subscription]":
+        chosen, chosen_pass = None, None
+        for sub in self._subscriptions.values():
+            if not sub.ready(self._loop):
+                continue
+            # an idle subscription does not bank credit while idle
+            pass_ = max(sub.pass_, self._vtime)
+            if chosen is None or pass_ < chosen_pass:
+                chosen, chosen_pass = sub, pass_
+        if chosen is not None:
+            self._vtime = chosen_pass
+            chosen.pass_ = chosen_pass + 1.0 / chosen.weight
+        return chosen
+
+    async def messages(self):
+        """messages of all subscriptions, interleaved by weight"""
+        while not self._is_closed:
+            sub = self._next_ready()
+            if sub is not None:
+                msg: "NsqMessage" = sub.take()
+                if msg is not None:
+                    yield msg
+                continue
+            if self._wakeup.done():
+                self._wakeup = self._loop.create_future()
+            waiters = [s.wait(self._loop) for s in self._subscriptions.values()]
+            await asyncio.wait(
+                waiters + [self._wakeup],
+                return_when=asyncio.FIRST_COMPLETED,
+                loop=self._loop,
+            )
+
+    async def close(self, timeout=10):
+        """drain and close all subscriptions concurrently"""
+        self._is_closed = True
+        subscriptions, self._subscriptions = self._subscriptions, {}
+        for sub in subscriptions.values():
+            sub.disarm()
+        self._notify()
+        await asyncio.gather(
+            *[sub.reader.close(timeout) for sub in subscriptions.values()],
+            loop=self._loop,
+            return_exceptions=True,
+        )
+        if self._topology is not None:
+            await self._topology.close()
+
+    def __repr__(self):
+        return "<MultiReader{}>".format(
+            ",".join("{}/{}".format(*key) for key in self._subscriptions)
+        )
@@ -7,14 +7,19 @@ import struct
 import zlib
 import snappy
 
+from array import array
+
 from nsqio.tcp.consts import (
+    ATTEMPTS_SIZE,
     DATA_SIZE,
     FRAME_SIZE,
     FRAME_TYPE_RESPONSE,
     FRAME_TYPE_ERROR,
     FRAME_TYPE_MESSAGE,
     MSG_HEADER,
+    MSG_ID_SIZE,
     NL,
+    TIMESTAMP_SIZE,
 )
 
 from nsqio.tcp.exceptions import ProtocolError
@@ -75,6 +80,9 @@ class BaseCompressReader(BaseReader):
     def gets(self):
         return self._parser.gets()
 
+    def gets_messages(self, max_count=None):
+        return self._parser.gets_messages(max_count)
+
     def encode_command(self, cmd, *args, data=None):
         cmd = self._parser.encode_command(cmd, *args, data=data)
         # print(cmd)
@@ -113,6 +121,10 @@ class SnappyReader(BaseCompressReader):
         return self._decompressor.decompress(chunk)
 
 
+_FRAME_HEADER = struct.Struct(">ll")
+_MSG_HEADER = struct.Struct(">qh")
+
+
 def _encode_body(data):
     _data = _convert_to_bytes(data)
     result = struct.pack(">l", len(_data)) + _data
@@ -167,6 +179,48 @@ class Reader(BaseReader):
             return resp
         return False
 
+    def gets_messages(self, max_count=None):
+        """Decode the run of MESSAGE frames at the head of the buffer at once.
+
+        no object is created per message, the frames are copied into columns.
+
+        :param max_count: max number of messages decoded
+        :return: ``(timestamps, attempts, ids, bodies, offsets)``: timestamps
+            as ``array('q')``, attempts as ``array('h')``, the 16 bytes ids
+            back to back in one ``bytearray``, the bodies in one
+            ``bytearray`` with ``bodies[offsets[i]:offsets[i + 1]]`` the body
+            of message ``i``. None if the next frame is not a complete message.
+        """
+        buffer = self._buffer
+        size = len(buffer)
+        pos = 0
+        timestamps, attempts = array("q"), array("h")
+        ids, bodies, offsets = bytearray(), bytearray(), array("q", [0])
+        with memoryview(buffer) as view:
+            while max_count is None or len(timestamps) < max_count:
+                if size - pos < DATA_SIZE + FRAME_SIZE:
+                    break
+                payload_size, frame_type = _FRAME_HEADER.unpack_from(buffer, pos)
+                end = pos + DATA_SIZE + payload_size
+                if frame_type != FRAME_TYPE_MESSAGE or end > size:
+                    break
+                start = pos + DATA_SIZE + FRAME_SIZE
+                timestamp, attempt = _MSG_HEADER.unpack_from(buffer, start)
+                timestamps.append(timestamp)
+                attempts.append(attempt)
+                start += TIMESTAMP_SIZE + ATTEMPTS_SIZE
+                ids += view[start : start + MSG_ID_SIZE]
+                bodies += view[start + MSG_ID_SIZE : end]
+                offsets.append(len(bodies))
+                pos = end
+        if not timestamps:
+            return None
+        del buffer[:pos]
+        self._is_header = False
+        self._payload_size = None
+        self._frame_type = None
+        return timestamps, attempts, ids, bodies, offsets
+
     def _reset(self):
         start = DATA_SIZE + self._payload_size
         self._buffer = self._buffer[start:]
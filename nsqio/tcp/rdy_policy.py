@@ -0,0 +1,76 @@
+import math
+import time
+
+__all__ = ["RdyPolicy", "EvenRdyPolicy", "WeightedRdyPolicy"]
+
+
+class RdyPolicy:
+    """
+    decides how RdyControl splits max_in_flight across connections
+    """
+
+    def on_message(self, conn_id: str, count: int = 1):
+        """Called for every ``count`` messages delivered on ``conn_id``."""
+
+    def remove(self, conn_id: str):
+        """Forget any state kept for ``conn_id``."""
+
+    def conn_max_in_flight(self, conn_id: str, conn_ids, max_in_flight: int):
+        """Return the share of ``max_in_flight`` for ``conn_id``.
+
+        :param conn_id: connection to compute the share for
+        :param conn_ids: ids of all current connections
+        :param max_in_flight: configured max_in_flight of the reader
+        """
+        raise NotImplementedError
+
+
+class EvenRdyPolicy(RdyPolicy):
+    """
+    split max_in_flight even on connections
+    """
+
+    def conn_max_in_flight(self, conn_id, conn_ids, max_in_flight):
+        return max_in_flight / max(1, len(conn_ids))
+
+
+class WeightedRdyPolicy(RdyPolicy):
+    """
+    split max_in_flight by the recent message rate of each connection
+
+    The rate is an exponentially weighted moving average of deliveries.
+    Connections slower than ``idle_rate`` messages/sec keep an RDY of 1
+    and the rest of the budget is shared in proportion to the rates.
+    """
+
+    def __init__(self, half_life: float = 5.0, idle_rate: float = 0.1, time_func=None):
+        self._decay = math.log(2) / half_life
+        self._idle_rate = idle_rate
+        self._time = time_func or time.monotonic
+        # conn_id -> (rate, timestamp of the rate)
+        self._rates = {}
+
+    def rate(self, conn_id, now=None):
+        """Current message rate of ``conn_id`` in messages/sec."""
+        now = self._time() if now is None else now
+        rate, ts = self._rates.get(conn_id, (0.0, now))
+        return rate * math.exp(-self._decay * (now - ts))
+
+    def on_message(self, conn_id, count=1):
+        now = self._time()
+        self._rates[conn_id] = (self.rate(conn_id, now) + self._decay * count, now)
+
+    def remove(self, conn_id):
+        self._rates.pop(conn_id, None)
+
+    def conn_max_in_flight(self, conn_id, conn_ids, max_in_flight):
+        now = self._time()
+        rates = {i: self.rate(i, now) for i in conn_ids}
+        busy = {i: r for i, r in rates.items() if r >= self._idle_rate}
+        if not busy:
+            # nothing known yet, fall back to even split
+            return max_in_flight / max(1, len(rates))
+        if conn_id not in busy:
+            return 1
+        budget = max_in_flight - (len(rates) - len(busy))
+        return max(1, budget * busy[conn_id] / sum(busy.values()))
@@ -1,21 +1,28 @@
 from asyncio.events import AbstractEventLoop
-from typing import Dict, Optional, TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from nsqio.tcp.connection import TcpConnection
+    from nsqio.tcp.dedup import DedupCache
     from nsqio.tcp.messages import NsqMessage
+    from nsqio.tcp.rdy_policy import RdyPolicy
+    from nsqio.tcp.reader_aimd import AimdController
 
 import asyncio
 import random
 import logging
 import time
+import weakref
 
 from functools import partial
 
-from nsqio.http import NsqLookupd
+from nsqio.http import LookupdTopology
 from nsqio.tcp.reader_rdy import RdyControl
 from nsqio.tcp.connection import create_connection
-from nsqio.tcp.consts import SUB, RDY, CLS
+from nsqio.tcp.consts import SUB, RDY, CLS, REQ, FIN
+from nsqio.tcp.dedup import DEDUP_FIN, DEDUP_FLAG
+from nsqio.tcp.dispatch import KeyedDispatcher
+from nsqio.tcp.batch import MessageBatch
 from nsqio.utils import get_logger, get_host_and_port, retry_iterator, get_version
 
 
@@ -35,6 +42,27 @@ async def create_reader(
         such as ['127.0.0.1:4150','182.168.1.1:4150']
     param: max_in_flight: number of messages get but not finish or req
     param: lookupd_http_addresses: first priority.if provided nsqd will neglected
+    param: rdy_threshold: fraction of the last RDY count a connection may drop
+        to before RDY is refreshed
+    param: rdy_policy: RdyPolicy splitting max_in_flight across connections,
+        even split by default
+    param: max_in_flight_controller: AimdController tuning max_in_flight from
+        handler throughput and latency, disabled by default
+    param: lookupd_poll_interval: max seconds between lookupd polls
+    param: lookupd_poll_jitter: random +/- fraction applied to poll delays
+    param: lookupd_timeout: timeout in seconds of a single lookupd request
+    param: connect_concurrency: max nsqd connected, identified or subscribed
+        at the same time
+    param: connect_timeout: timeout in seconds to connect and set up one nsqd
+    param: topology: LookupdTopology shared with other readers, replaces
+        lookupd_http_addresses
+    param: dedup_cache: DedupCache of message ids, disabled by default
+    param: dedup_policy: "fin" to FIN redeliveries of finished messages
+        without handing them out, "flag" to hand them out with
+        message.duplicate set
+    param: batch_size: if set, messages() yields MessageBatch of up to
+        batch_size messages read at once instead of NsqMessage, the dedup
+        cache is not applied to batches
     """
     loop = loop or asyncio.get_event_loop()
     if lookupd_http_addresses:
@@ -42,6 +70,7 @@ async def create_reader(
             lookupd_http_addresses=lookupd_http_addresses,
             max_in_flight=max_in_flight,
             loop=loop,
+            **kwargs,
         )
     else:
         if nsqd_tcp_addresses is None:
@@ -57,6 +86,49 @@ async def create_reader(
     return reader
 
 
+class NsqdState:
+    """
+    connection state of one nsqd of a Reader
+    """
+
+    def __init__(self):
+        self.is_connected = False
+        self.reconnects = 0
+        self.last_error = None
+        self._downtime = 0.0
+        self._down_since = time.time()
+
+    @property
+    def downtime(self):
+        """total seconds without connection, current outage included"""
+        if self._down_since is None:
+            return self._downtime
+        return self._downtime + time.time() - self._down_since
+
+    def connected(self, reconnect=False):
+        if self._down_since is not None:
+            self._downtime += time.time() - self._down_since
+            self._down_since = None
+        self.is_connected = True
+        if reconnect:
+            self.reconnects += 1
+
+    def disconnected(self, error=None):
+        if self._down_since is None:
+            self._down_since = time.time()
+        self.is_connected = False
+        if error is not None:
+            self.last_error = repr(error)
+
+    def as_dict(self):
+        return {
+            "connected": self.is_connected,
+            "reconnects": self.reconnects,
+            "downtime": self.downtime,
+            "last_error": self.last_error,
+        }
+
+
 class Reader:
     """
     NSQ tcp reader
@@ -80,6 +152,18 @@ class Reader:
         msg_timeout: Optional[int] = None,
         client_id: str = "",
         hostname: str = "",
+        rdy_threshold: float = 0.25,
+        rdy_policy: "Optional[RdyPolicy]" = None,
+        max_in_flight_controller: "Optional[AimdController]" = None,
+        lookupd_poll_interval: float = 30,
+        lookupd_poll_jitter: float = 0.3,
+        lookupd_timeout: float = 5,
+        connect_concurrency: int = 16,
+        connect_timeout: float = 10,
+        topology: "Optional[LookupdTopology]" = None,
+        dedup_cache: "Optional[DedupCache]" = None,
+        dedup_policy: str = DEDUP_FIN,
+        batch_size: int = 0,
     ):
         user_agents = ["nsqio/{}".format(get_version())]
         if user_agent:
@@ -119,16 +203,50 @@ class Reader:
 
         self._is_subscribe = False
         self._redistribute_timeout = 5  # sec
-        self._lookupd_poll_time = 30  # sec
+        self._lookupd_poll_time = lookupd_poll_interval  # sec
+        self._lookupd_poll_jitter = lookupd_poll_jitter
         self.topic = None
         self.channel = None
         self._rdy_control = RdyControl(
             idle_timeout=self._idle_timeout,
             max_in_flight=self._max_in_flight,
             loop=self._loop,
+            rdy_threshold=rdy_threshold,
+            policy=rdy_policy,
         )
+        # a given topology is shared with other readers and not closed here
+        self._topology = topology
+        self._own_topology = topology is None
+        if topology is not None:
+            self._lookupd_http_addresses = topology.lookupd_http_addresses
+        elif self._lookupd_http_addresses:
+            self._topology = LookupdTopology(
+                self._lookupd_http_addresses, loop=self._loop, timeout=lookupd_timeout
+            )
         self._auto_poll_lookupd_task_closed = asyncio.Event(loop=self._loop)
         self._auto_poll_lookupd_task = None
+        self._redistribute_task = None
+        self._max_in_flight_controller = max_in_flight_controller
+        self._auto_tune_task = None
+
+        # connect, IDENTIFY and SUB run concurrently up to this limit
+        self._connect_semaphore = asyncio.Semaphore(
+            connect_concurrency, loop=self._loop
+        )
+        self._connect_timeout = connect_timeout
+        # "tcp://host:port" of nsqd being connected, the tasks keeping
+        # every known nsqd connected and their stats
+        self._connecting = set()
+        self._supervisors = {}
+        self._nsqd_stats = {}
+        self._subscribed_conns = weakref.WeakSet()
+        self._is_closed = False
+        assert dedup_policy in (DEDUP_FIN, DEDUP_FLAG), "unknown dedup_policy"
+        self._dedup_cache = dedup_cache
+        self._dedup_policy = dedup_policy
+        self._batch_size = batch_size
+        # set on message events while unsubscribe is draining
+        self._drain_event = asyncio.Event(loop=self._loop)
 
     async def connect(self):
         logging.info("reader connecting")
@@ -139,85 +257,250 @@ class Reader:
             """
             pass
         if self._nsqd_tcp_addresses:
-            connections: "Dict[str, TcpConnection]" = {}
-            for host, port in self._nsqd_tcp_addresses:
-                conn: "TcpConnection" = await create_connection(
-                    host, port, queue=self._queue, loop=self._loop
-                )
-                await self.prepare_conn(conn)
-                connections[conn.id] = conn
-            self._rdy_control.add_connections(connections)
+            await self._connect_nsqds(self._nsqd_tcp_addresses)
         # init distribute for conns, init update rdy state for conn
         self._rdy_control.redistribute()
 
+    async def _connect_nsqds(self, addresses):
+        """connect all nsqd concurrently, failed ones are retried in background
+
+        :return: number of new connections
+        """
+        addresses = [
+            (host, port)
+            for host, port in addresses
+            if self._nsqd_id(host, port) not in self._connecting
+            and self._nsqd_id(host, port) not in self._supervisors
+        ]
+        results = await asyncio.gather(
+            *[self._connect_nsqd(host, port) for host, port in addresses],
+            loop=self._loop,
+            return_exceptions=True,
+        )
+        num_connected = 0
+        for (host, port), res in zip(addresses, results):
+            if isinstance(res, Exception):
+                logger.error("connect to {}:{} failed: {!r}".format(host, port, res))
+                self._nsqd_state(host, port).disconnected(res)
+                self._supervise_nsqd(host, port)
+            else:
+                num_connected += 1
+                self._nsqd_state(host, port).connected()
+                self._supervise_nsqd(host, port, res)
+        return num_connected
+
+    def _nsqd_id(self, host, port):
+        return "tcp://{}:{}".format(host, port)
+
+    async def _connect_nsqd(self, host, port):
+        nsqd_id = self._nsqd_id(host, port)
+        self._connecting.add(nsqd_id)
+        try:
+            async with self._connect_semaphore:
+                conn = await asyncio.wait_for(
+                    self._open_conn(host, port),
+                    self._connect_timeout,
+                    loop=self._loop,
+                )
+        finally:
+            self._connecting.discard(nsqd_id)
+        self._rdy_control.add_connection(conn)
+        if self._is_subscribe:
+            # subscribe() may have started after _open_conn checked it and
+            # listed the connections before this one was added
+            try:
+                await asyncio.wait_for(
+                    self._sub_conn(conn), self._connect_timeout, loop=self._loop
+                )
+            except BaseException:
+                self._rdy_control.remove_connection(conn)
+                raise
+            self._rdy_control.rdy_changed(conn.id)
+        logger.debug("new nsqd added: conn.id={}".format(conn.id))
+        return conn
+
+    async def _open_conn(self, host, port):
+        conn = await create_connection(host, port, queue=self._queue, loop=self._loop)
+        try:
+            await self.prepare_conn(conn)
+            if self._is_subscribe:
+                await self._sub_conn(conn)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _nsqd_state(self, host, port) -> "NsqdState":
+        nsqd_id = self._nsqd_id(host, port)
+        state = self._nsqd_stats.get(nsqd_id, None)
+        if state is None:
+            state = self._nsqd_stats[nsqd_id] = NsqdState()
+        return state
+
+    @property
+    def nsqd_stats(self):
+        """connection state, reconnect count and downtime of every nsqd"""
+        return {
+            nsqd_id: state.as_dict() for nsqd_id, state in self._nsqd_stats.items()
+        }
+
+    def _supervise_nsqd(self, host, port, conn=None):
+        nsqd_id = self._nsqd_id(host, port)
+        if self._is_closed or nsqd_id in self._supervisors:
+            return
+        task = self._loop.create_task(self._nsqd_supervisor(host, port, conn))
+        self._supervisors[nsqd_id] = task
+        task.add_done_callback(lambda _: self._supervisors.pop(nsqd_id, None))
+
+    def _is_wanted_nsqd(self, host, port):
+        if (host, port) in self._nsqd_tcp_addresses:
+            return True
+        # discovered nsqd are dropped once lookupd forgets them
+        return self._topology is not None and (host, port) in self._topology.producers(
+            self.topic
+        )
+
+    def _reconnect_delays(self, now=True):
+        return retry_iterator(init_delay=1, max_delay=30.0, now=now)
+
+    async def _nsqd_supervisor(self, host, port, conn=None):
+        """keep one nsqd connected, reconnect with backoff when it is lost"""
+        nsqd_id = self._nsqd_id(host, port)
+        state = self._nsqd_state(host, port)
+        delays = self._reconnect_delays(now=False)
+        try:
+            while not self._is_closed:
+                if conn is not None:
+                    await conn.wait_for_closed(None)
+                    if self._is_closed:
+                        return
+                    logger.warning("{} lost, reconnecting".format(nsqd_id))
+                    state.disconnected()
+                    if self._rdy_control.connections.get(nsqd_id, None) is conn:
+                        self._rdy_control.remove_connection(conn)
+                    conn = None
+                    delays = self._reconnect_delays()
+                await asyncio.sleep(next(delays), loop=self._loop)
+                if not self._is_wanted_nsqd(host, port):
+                    logger.info("{} is not known anymore, give up".format(nsqd_id))
+                    return
+                try:
+                    conn = await self._connect_nsqd(host, port)
+                except Exception as e:
+                    logger.warning("reconnect to {} failed: {!r}".format(nsqd_id, e))
+                    state.disconnected(e)
+                else:
+                    state.connected(reconnect=True)
+                    self._rdy_control.redistribute()
+        except asyncio.CancelledError:
+            logger.debug("{} supervisor cancelled".format(nsqd_id))
+
     async def prepare_conn(self, conn: "TcpConnection"):
         conn._on_message = partial(self._on_message, conn)
+        if self._batch_size:
+            conn.set_batch_mode(self._batch_size, partial(self._on_batch, conn))
         _ = await conn.identify(**self._config)
 
     def _on_message(self, conn: "TcpConnection", msg: "NsqMessage"):
-        conn._last_message = time.time()
-        if conn._on_rdy_changed_cb is not None:
-            conn._on_rdy_changed_cb(conn.id)
-        msg._processed_hook = lambda m: conn._on_rdy_changed_cb(conn.id)
+        conn._last_message = msg._received_at = time.time()
+        msg._topic, msg._channel = self.topic, self.channel
+        self._rdy_control.message_received(conn.id)
+        msg._processed_hook = partial(self._on_processed, conn)
+        if not self._is_subscribe:
+            self._drain_event.set()
+        if self._dedup_cache is not None:
+            return self._dedup(conn, msg)
         return msg
 
-    async def _poll_lookupd(self, host, port):
-        nsqlookup_conn = None
+    def _dedup(self, conn: "TcpConnection", msg: "NsqMessage"):
+        finished = self._dedup_cache.received(msg.message_id)
+        if finished is None:
+            return msg
+        msg._is_duplicate = True
+        # a redelivery of a message still in a handler is handed out flagged,
+        # the first delivery may yet fail
+        if not finished or self._dedup_policy != DEDUP_FIN:
+            return msg
+        logger.debug("{} duplicate {} finished".format(self, msg.message_id))
         try:
-            nsqlookup_conn = NsqLookupd(host, port, loop=self._loop)
-
-            res = await nsqlookup_conn.lookup(self.topic)
-            logger.debug("lookupd response {}".format(res))
-
-            if "producers" in res:
-                addrs = []
-                for producer in res["producers"]:
-                    host = producer["broadcast_address"]
-                    port = producer["tcp_port"]
-                    addrs.append((host, port))
-                return addrs
+            conn.execute(FIN, msg.message_id)
+        except Exception as e:
+            logger.warning("{} FIN of duplicate failed: {}".format(conn, e))
+            return msg
+        msg._mark_processed()
+        self._rdy_control.rdy_changed(conn.id)
+        return None
+
+    def _on_processed(self, conn: "TcpConnection", msg: "NsqMessage"):
+        if self._dedup_cache is not None:
+            if msg.requeued:
+                self._dedup_cache.forget(msg.message_id)
             else:
-                logger.debug("producers not found error")
-                return []
+                self._dedup_cache.finished(msg.message_id)
+        if self._max_in_flight_controller is not None:
+            self._max_in_flight_controller.on_processed(
+                time.time() - msg._received_at, msg.requeued
+            )
+        self._rdy_control.rdy_changed(conn.id)
+        if not self._is_subscribe:
+            self._drain_event.set()
+
+    def _on_batch(self, conn: "TcpConnection", batch: "MessageBatch"):
+        conn._last_message = batch._received_at = time.time()
+        batch._topic, batch._channel = self.topic, self.channel
+        self._rdy_control.message_received(conn.id, len(batch))
+        batch._processed_hook = partial(self._on_batch_processed, conn)
+        if not self._is_subscribe:
+            self._drain_event.set()
+        return batch
+
+    def _on_batch_processed(
+        self, conn: "TcpConnection", batch: "MessageBatch", count, requeued
+    ):
+        if self._max_in_flight_controller is not None:
+            latency = time.time() - batch._received_at
+            for _ in range(count):
+                self._max_in_flight_controller.on_processed(latency, requeued)
+        self._rdy_control.rdy_changed(conn.id)
+        if not self._is_subscribe:
+            self._drain_event.set()
+
+    @property
+    def topology(self) -> "Optional[LookupdTopology]":
+        """producers discovered from lookupd, None without lookupd"""
+        return self._topology
+
+    async def _poll_lookupd(self):
+        try:
+            return await self._topology.poll(self.topic)
         except Exception as e:
             logger.error(e)
             return []
-        finally:
-            if nsqlookup_conn is not None:
-                try:
-                    await nsqlookup_conn.close()
-                except Exception as e:
-                    logger.error(e)
 
-    async def _init_lookupd_conns(self, host, port):
-        producers = await self._poll_lookupd(host, port)
+    def _lookupd_poll_delays(self):
+        jitter = self._lookupd_poll_jitter
+        for delay in retry_iterator(init_delay=3, max_delay=self._lookupd_poll_time):
+            yield delay * random.uniform(1 - jitter, 1 + jitter)
+
+    async def _init_lookupd_conns(self):
+        producers = await self._poll_lookupd()
         if len(producers) == 0:
             # no producer
             logger.debug("No producer detected")
             return False
-        for producer in producers:
-            try:
-                p_host, p_port = producer
-                tmp_id = "tcp://{}:{}".format(p_host, p_port)
-                if not await self._rdy_control._is_valid_connection(tmp_id):
-                    logger.debug(
-                        "new connection: host={}, port={}".format(p_host, p_port)
-                    )
-                    conn = await create_connection(
-                        host=p_host, port=p_port, queue=self._queue, loop=self._loop
-                    )
-                    await self.prepare_conn(conn)
-                    logger.debug("conn.id={}".format(conn.id))
-                    # self._rdy_control.connections[conn.id] = conn
-                    self._rdy_control.add_connection(conn)
-            except Exception as e:
-                logger.error(e)
-                return False
+        await self._connect_nsqds(self._new_producers(producers))
         return True
 
+    def _new_producers(self, producers):
+        return [
+            (host, port)
+            for host, port in producers
+            if self._nsqd_id(host, port) not in self._rdy_control.connections
+        ]
+
     async def _auto_poll_lookupd(self):
         logger.debug("starting _auto_poll_lookupd")
-        timeout_generator = retry_iterator(init_delay=3, max_delay=30.0)
+        timeout_generator = self._lookupd_poll_delays()
         try:
             while (
                 self._is_subscribe
@@ -226,60 +509,13 @@ class Reader:
             ):
                 logger.info("reader _auto_poll_lookupd check loop")
 
-                host, port = random.choice(self._lookupd_http_addresses)
-                producers = await self._poll_lookupd(host, port)
-                if len(producers) > 0:
-                    # no producer
-                    for producer in producers:
-                        conn = None
-                        try:
-                            p_host, p_port = producer
-                            tmp_id = "tcp://{}:{}".format(p_host, p_port)
-                            # if tmp_id not in self._rdy_control.connections:
-                            # missing? add it!
-                            if not await self._rdy_control._is_valid_connection(tmp_id):
-                                logger.debug(
-                                    "_auto_poll_lookupd: new connection: host={}, port={}".format(
-                                        p_host, p_port
-                                    )
-                                )
-                                conn = await create_connection(
-                                    host=p_host,
-                                    port=p_port,
-                                    queue=self._queue,
-                                    loop=self._loop,
-                                )
-                                logger.debug("conn.id={}".format(conn.id))
-                                await self.prepare_conn(conn)
-                                # self._rdy_control.connections[conn.id] = conn
-                                self._rdy_control.add_connection(conn)
-
-                                await self.sub(conn, self.topic, self.channel)
-
-                                logger.debug(
-                                    "new nsqd added: conn.id={}".format(conn.id)
-                                )
-
-                                # why?
-                                if conn._on_rdy_changed_cb is not None:
-                                    conn._on_rdy_changed_cb(conn.id)
-                            # else:
-                            #     logger.debug("skip... {}".format(tmp_id))
-                        except Exception as e:
-                            logger.error(e)
-                            if conn is not None:
-                                try:
-                                    conn.close()
-                                except Exception as e:
-                                    logger.error(e)
-                        finally:
-                            if not self._is_subscribe and conn is not None:
-                                try:
-                                    conn.close()
-                                except Exception as e:
-                                    logger.error(e)
-                        if not self._is_subscribe:
-                            break
+                producers = await self._poll_lookupd()
+                # check connections and drop the closed ones
+                for conn_id in list(self._rdy_control.connections.keys()):
+                    await self._rdy_control._is_valid_connection(conn_id)
+                new_producers = self._new_producers(producers)
+                if new_producers:
+                    await self._connect_nsqds(new_producers)
 
                 try:
                     self._rdy_control.redistribute()
@@ -296,6 +532,7 @@ class Reader:
         self.topic = topic
         self.channel = channel
         self._is_subscribe = True
+        self._rdy_control.resume()
 
         # firstly, we check lookupd
         if self._lookupd_http_addresses:
@@ -313,21 +550,61 @@ class Reader:
             )
 
         # and then, we sub all available topics
-        conns = self._rdy_control.connections.values()
-        for conn in conns:
-            await self.sub(conn, topic, channel)
-            if conn._on_rdy_changed_cb is not None:
-                conn._on_rdy_changed_cb(conn.id)
+        conns = list(self._rdy_control.connections.values())
+        await asyncio.gather(
+            *[self._sub_and_update_rdy(conn) for conn in conns], loop=self._loop
+        )
 
         # redistribute is a task for fail or overload to
         # rebalance tcpconnections
-        # consider for further. disable now
-        # self._redistribute_task = self._loop.create_task(self._redistribute())
+        self._redistribute_task = self._loop.create_task(self._redistribute())
+        if self._max_in_flight_controller is not None:
+            self._auto_tune_task = self._loop.create_task(self._auto_tune())
         return True
 
     async def sub(self, conn: "TcpConnection", topic: str, channel: str):
         await conn.execute(SUB, topic, channel)
 
+    async def _sub_conn(self, conn: "TcpConnection"):
+        if conn in self._subscribed_conns:
+            return
+        self._subscribed_conns.add(conn)
+        await self.sub(conn, self.topic, self.channel)
+
+    async def _sub_and_update_rdy(self, conn: "TcpConnection"):
+        try:
+            async with self._connect_semaphore:
+                await asyncio.wait_for(
+                    self._sub_conn(conn), self._connect_timeout, loop=self._loop
+                )
+        except Exception as e:
+            logger.error("{} sub failed: {!r}".format(conn, e))
+            # closing it hands the nsqd over to its supervisor
+            self._rdy_control.remove_connection(conn)
+            return
+        self._rdy_control.rdy_changed(conn.id)
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    def hold_rdy(self, conn_id):
+        """Set RDY 0 on a connection until release_rdy(), for backpressure."""
+        self._rdy_control.hold(conn_id)
+
+    def release_rdy(self, conn_id):
+        self._rdy_control.release(conn_id)
+
+    def update_max_in_flight(self, max_in_flight: int):
+        """change max_in_flight and redistribute RDY without reconnecting"""
+        if max_in_flight == self._max_in_flight:
+            return
+        logger.info(
+            "{} max_in_flight {} => {}".format(self, self._max_in_flight, max_in_flight)
+        )
+        self._max_in_flight = max_in_flight
+        self._rdy_control.set_max_in_flight(max_in_flight)
+
     async def set_max_in_flight(self, max_in_flight):
         for conn in self._rdy_control.connections.values():
             await conn.execute(RDY, max_in_flight)
@@ -358,91 +635,163 @@ class Reader:
             logger.debug("num readers -- ")
             self._num_readers -= 1
 
+    async def dispatch(self, handler, key_func, lanes=8, **kwargs):
+        """handle messages in parallel lanes, in order per key
+
+        runs until unsubscribed, see KeyedDispatcher
+        """
+        dispatcher = KeyedDispatcher(self, handler, key_func, lanes=lanes, **kwargs)
+        await dispatcher.run()
+
     async def _redistribute(self):
-        while self._is_subscribe:
-            self._rdy_control.redistribute()
-            await asyncio.sleep(self._redistribute_timeout, loop=self._loop)
+        try:
+            while self._is_subscribe:
+                self._rdy_control.redistribute()
+                await asyncio.sleep(self._redistribute_timeout, loop=self._loop)
+        except asyncio.CancelledError:
+            logger.info("{} _redistribute cancelled".format(self))
+
+    async def _auto_tune(self):
+        controller = self._max_in_flight_controller
+        try:
+            while self._is_subscribe:
+                await asyncio.sleep(controller.interval, loop=self._loop)
+                self.update_max_in_flight(controller.update(self._max_in_flight))
+        except asyncio.CancelledError:
+            logger.info("{} _auto_tune cancelled".format(self))
 
     async def _lookupd(self):
-        host, port = random.choice(self._lookupd_http_addresses)
-        return await self._init_lookupd_conns(host, port)
+        return await self._init_lookupd_conns()
 
     async def rescan_connections(self):
         return await self._lookupd()
 
     async def unsubscribe(self, timeout=10):
+        """stop consuming and drain
+
+        RDY 0 and CLS are sent to every connection at once, handlers get up
+        to ``timeout`` seconds to finish their in flight messages while CLS
+        is acked, then the messages never handed out are requeued in one
+        write per connection.
+        """
         if not self._is_subscribe:
             logger.warning("You must subscribe to the topic first")
             return
-        # logger.debug("unsubscribing {}".format(self))
+        deadline = self._loop.time() + timeout
         # mark as disabled
-        await self.set_max_in_flight(0)
+        self._rdy_control.pause()
+        conns = list(self._rdy_control.connections.values())
+        cls_futs = []
+        for conn in conns:
+            try:
+                conn.execute(RDY, 0)
+                cls_futs.append(conn.execute(CLS))
+            except Exception as e:
+                logger.warning("{} RDY 0/CLS failed: {}".format(conn, e))
         # clear is_subscribed flag
         self._is_subscribe = False
+        self._drain_event.clear()
+        for task in (
+            self._redistribute_task,
+            self._auto_tune_task,
+            self._auto_poll_lookupd_task,
+        ):
+            if task is not None:
+                task.cancel()
+        self._redistribute_task = self._auto_tune_task = None
+        self._auto_poll_lookupd_task = None
 
-        # self._auto_poll_lookupd_task_closed = asyncio.Event(loop=self._loop)
-        # self._auto_poll_lookupd_task = None
-        try:
-            if self._auto_poll_lookupd_task is not None:
-                logger.info("canceling auto_poll_lookupd_task")
-                self._auto_poll_lookupd_task.cancel()
+        # messages not handed to a reader yet are requeued, readers blocked
+        # in messages() are woken up with a None
+        leftover = self._take_queued()
+        for _ in range(self._num_readers):
+            self._queue.put_nowait(None)
+
+        # let the handlers finish what they hold, CLS is acked meanwhile
+        while True:
+            leftover.extend(self._take_queued())
+            in_handlers = sum(c.in_flight for c in conns) - sum(
+                len(item) if isinstance(item, MessageBatch) else 1
+                for item in leftover
+            )
+            remaining = deadline - self._loop.time()
+            if in_handlers <= 0 or remaining <= 0:
+                break
+            try:
                 await asyncio.wait_for(
-                    self._auto_poll_lookupd_task_closed.wait(),
-                    timeout=timeout,
-                    loop=self._loop,
+                    self._drain_event.wait(), remaining, loop=self._loop
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._drain_event.clear()
+        if in_handlers > 0:
+            logger.warning(
+                "{} {} messages still in handlers after drain".format(
+                    self, in_handlers
                 )
-        except Exception as e:
-            logger.error("cancel failed: {}".format(e))
-        finally:
-            logger.info("auto_poll_lookupd_task canceled")
-
-        # send None to clear readers
-        num_retries = 0
-        while self._num_readers > 0 or num_retries > 1000:
-            for i in range(self._num_readers):
-                self._queue.put_nowait(None)
-            num_retries += 1
-            await asyncio.sleep(0.05, loop=self._loop)
-        if self._num_readers > 0:
-            logger.error(
-                "{} retried {} times but still not work...".format(self, num_retries)
             )
-        # no subscribers now
-
-        # clear & req rest of the messages
-        # mostly it is empty
-        try:
-            # consume all unfinished elems
-            while not self._queue.empty():
+        if cls_futs:
+            # within what is left of the same deadline
+            remaining = max(0, deadline - self._loop.time())
+            await asyncio.wait(cls_futs, timeout=remaining, loop=self._loop)
+            leftover.extend(self._take_queued())
+        self._requeue(leftover)
+
+    def _take_queued(self):
+        messages, num_wakeups = [], 0
+        while not self._queue.empty():
+            result = self._queue.get_nowait()
+            if result is not None:
+                messages.append(result)
+            else:
+                num_wakeups += 1
+        # keep the None for readers still to wake up
+        for _ in range(num_wakeups):
+            self._queue.put_nowait(None)
+        return messages
+
+    def _requeue(self, messages):
+        """REQ messages with one write per connection"""
+        by_conn = {}
+        for msg in messages:
+            if isinstance(msg, MessageBatch):
                 try:
-                    result = self._queue.get_nowait()
-                    if result is not None:
-                        logger.debug("req: {}".format(result))
-                        await result.req(0)
+                    msg._requeue_pending()
                 except Exception as e:
-                    logger.warning("req message failed {}".format(e))
-        except Exception as e:
-            logger.warning("requeue all messages failed {}".format(e))
-
-    async def close(self):
+                    logger.warning("{} requeue failed: {}".format(msg.conn, e))
+            elif not msg.processed:
+                by_conn.setdefault(msg.conn, []).append(msg)
+        for conn, msgs in by_conn.items():
+            try:
+                conn.execute_many(REQ, [(msg.message_id, 0) for msg in msgs])
+                for msg in msgs:
+                    msg._mark_processed(requeued=True)
+                    if self._dedup_cache is not None:
+                        self._dedup_cache.forget(msg.message_id)
+            except Exception as e:
+                logger.warning("{} requeue failed: {}".format(conn, e))
+
+    async def close(self, timeout=10):
+        self._is_closed = True
+        supervisors = list(self._supervisors.values())
+        for task in supervisors:
+            task.cancel()
+        await asyncio.gather(*supervisors, loop=self._loop, return_exceptions=True)
         if self._is_subscribe:
-            await self.unsubscribe()
+            await self.unsubscribe(timeout)
         try:
-            # await self.send_cls()
-            # clear rdy_control
-            if self._rdy_control is not None:
-                self._rdy_control.stop_working()
-            # close all connections
-            # TODO: move to _rdy_control later
-            for conn in self._rdy_control.connections.values():
-                if conn is not None:
-                    try:
-                        conn.close()
-                        await conn.wait_for_closed(1)
-                    except Exception as e:
-                        logger.error(e)
+            conns = list(self._rdy_control.connections.values())
+            # clear rdy_control, it closes all connections
+            self._rdy_control.stop_working()
+            await asyncio.gather(
+                *[conn.wait_for_closed(1) for conn in conns],
+                loop=self._loop,
+                return_exceptions=True,
+            )
         except Exception as e:
             logger.error("close failed: {}".format(e))
+        if self._topology is not None and self._own_topology:
+            await self._topology.close()
 
     def __repr__(self):
         return "<Reader{}/{}>".format(self.topic, self.channel)
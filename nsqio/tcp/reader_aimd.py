@@ -0,0 +1,123 @@
+import time
+
+from nsqio.utils import get_logger
+
+__all__ = ["AimdController"]
+
+logger = get_logger()
+
+
+class AimdController:
+    """
+    adapt max_in_flight of a Reader to handler throughput and latency
+
+    Every ``interval`` seconds the target is raised by ``increase`` while
+    throughput improves, and multiplied by ``decrease`` when the mean
+    handler latency or the requeue rate goes over its limit. The target
+    always stays within ``floor`` and ``ceiling``.
+
+    :param floor: lowest max_in_flight
+    :param ceiling: highest max_in_flight
+    :param increase: additive step when throughput improves
+    :param decrease: multiplicative factor on latency or errors
+    :param interval: seconds between adjustments
+    :param target_latency: max mean handler latency in seconds, by default
+        ``latency_tolerance`` times the baseline latency
+    :param latency_tolerance: see ``target_latency``
+    :param baseline_decay: weight of each window in the baseline latency;
+        the baseline drops to a lower mean latency at once and drifts up
+        towards higher ones, so it follows a lasting shift
+    :param max_error_rate: max fraction of requeued messages
+    """
+
+    def __init__(
+        self,
+        floor: int = 1,
+        ceiling: int = 2500,
+        increase: int = 1,
+        decrease: float = 0.5,
+        interval: float = 5.0,
+        target_latency: float = None,
+        latency_tolerance: float = 2.0,
+        baseline_decay: float = 0.2,
+        max_error_rate: float = 0.1,
+        time_func=None,
+    ):
+        assert 0 < floor <= ceiling, "floor must be in (0, ceiling]"
+        assert 0 < decrease < 1, "decrease must be in (0, 1)"
+        assert 0 < baseline_decay <= 1, "baseline_decay must be in (0, 1]"
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self._target_latency = target_latency
+        self._latency_tolerance = latency_tolerance
+        self._baseline_decay = baseline_decay
+        self._max_error_rate = max_error_rate
+        self._time = time_func or time.time
+
+        self._baseline_latency = None
+        self._last_throughput = 0.0
+        self._reset_window(self._time())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._processed = 0
+        self._errors = 0
+        self._latency_sum = 0.0
+
+    def on_processed(self, latency: float, requeued: bool = False):
+        """Record a finished (or requeued) message handled in ``latency`` sec."""
+        self._processed += 1
+        self._latency_sum += latency
+        if requeued:
+            self._errors += 1
+
+    def update(self, max_in_flight: int) -> int:
+        """Close the current window and return the new max_in_flight."""
+        now = self._time()
+        elapsed = max(now - self._window_start, 1e-9)
+        processed, errors, latency_sum = (
+            self._processed,
+            self._errors,
+            self._latency_sum,
+        )
+        self._reset_window(now)
+        if processed == 0:
+            # nothing handled, keep current target
+            return self._clamp(max_in_flight)
+
+        throughput = processed / elapsed
+        latency = latency_sum / processed
+        error_rate = errors / processed
+        baseline = self._baseline_latency
+        if baseline is None or latency < baseline:
+            baseline = latency
+        else:
+            baseline += (latency - baseline) * self._baseline_decay
+        self._baseline_latency = baseline
+        latency_limit = self._target_latency
+        if latency_limit is None:
+            latency_limit = baseline * self._latency_tolerance
+
+        last_throughput = throughput
+        if error_rate > self._max_error_rate or latency > latency_limit:
+            target = int(max_in_flight * self.decrease)
+            # throughput before the cut is no reference, probe up again
+            last_throughput = 0.0
+        elif throughput > self._last_throughput:
+            target = max_in_flight + self.increase
+        else:
+            target = max_in_flight
+        logger.debug(
+            "aimd: throughput={:.1f}/s latency={:.3f}s errors={:.2f} "
+            "max_in_flight {} => {}".format(
+                throughput, latency, error_rate, max_in_flight, target
+            )
+        )
+        self._last_throughput = last_throughput
+        return self._clamp(target)
+
+    def _clamp(self, max_in_flight):
+        return min(self.ceiling, max(self.floor, max_in_flight))
@@ -6,28 +6,52 @@ if TYPE_CHECKING:
     from typing import Dict
 
 import asyncio
-import random
+import time
 import traceback
 from nsqio.tcp.consts import RDY
-
-REDISTRIBUTE = 0
-CHANGE_CONN_RDY = 1
-NOOP = 2
+from nsqio.tcp.rdy_policy import EvenRdyPolicy
 
 
 class RdyControl:
-    def __init__(self, idle_timeout: int, max_in_flight: int, loop=None):
+    def __init__(
+        self,
+        idle_timeout: int,
+        max_in_flight: int,
+        loop=None,
+        rdy_threshold: float = 0.25,
+        policy=None,
+        time_func=None,
+    ):
         self._connections: "Dict[str, TcpConnection]" = {}
         self._idle_timeout: int = idle_timeout
         self._total_ready_count: int = 0
         self._max_in_flight = max_in_flight
         self._loop = loop or asyncio.get_event_loop()
 
-        self._cmd_queue = asyncio.Queue(loop=self._loop)
+        # RDY is refreshed only when the remaining count of a connection
+        # drops below this fraction of its last allotment
+        self._rdy_threshold = rdy_threshold
+        self._policy = policy or EvenRdyPolicy()
+        # connections waiting for an RDY update, each one is recomputed
+        # at most once per distributor tick
+        self._dirty = set()
+        self._need_redistribute = False
+        self._wakeup = asyncio.Event(loop=self._loop)
 
         self._expected_rdy_state = {}
 
+        # used when max_in_flight < number of connections and RDY is rotated
+        self._time = time_func or time.time
+        # conn_id -> time since the connection is without RDY
+        self._starved_since = {}
+        # conn_id -> time the connection got its rotated RDY
+        self._granted_at = {}
+
         self._is_working = True
+        # no RDY is sent while paused
+        self._is_paused = False
+        # connections kept at RDY 0 by hold()
+        self._held = set()
 
         self._distributor_task = self._loop.create_task(self._distributor())
 
@@ -50,28 +74,96 @@ class RdyControl:
             self._connections[id].close()
         self._connections[connection.id] = connection
 
+    @property
+    def is_rotating(self):
+        """True if there are more connections than max_in_flight."""
+        return self._max_in_flight < len(self._connections)
+
+    def starved_for(self, conn_id):
+        """Seconds the connection has been waiting for a rotated RDY."""
+        since = self._starved_since.get(conn_id, None)
+        return 0 if since is None else self._time() - since
+
+    def set_max_in_flight(self, max_in_flight: int):
+        """Change the in flight budget and redistribute it."""
+        self._max_in_flight = max_in_flight
+        self.redistribute()
+
+    def pause(self):
+        """Stop sending RDY, used while a reader drains."""
+        self._is_paused = True
+        self._dirty.clear()
+        self._need_redistribute = False
+
+    def resume(self):
+        self._is_paused = False
+
+    def hold(self, conn_id):
+        """Keep RDY 0 on a connection until release(), for backpressure."""
+        self._held.add(conn_id)
+        self._dirty.discard(conn_id)
+        conn = self._connections.get(conn_id, None)
+        if conn is None or conn.closed or conn.last_rdy == 0:
+            return
+        try:
+            conn.execute(RDY, 0)
+        except Exception as e:
+            logger.warning("hold RDY of {} failed: {!r}".format(conn_id, e))
+
+    def release(self, conn_id):
+        if conn_id in self._held:
+            self._held.discard(conn_id)
+            self.rdy_changed(conn_id)
+
+    def message_received(self, conn_id, count=1):
+        self._policy.on_message(conn_id, count)
+        self.rdy_changed(conn_id)
+
     def rdy_changed(self, conn_id):
-        self._cmd_queue.put_nowait((CHANGE_CONN_RDY, (conn_id,)))
+        if self._is_paused or conn_id in self._dirty or conn_id in self._held:
+            return
+        conn = self._connections.get(conn_id, None)
+        if conn is not None and not self._need_rdy_update(conn):
+            return
+        self._dirty.add(conn_id)
+        self._wakeup.set()
+
+    def _need_rdy_update(self, conn: "TcpConnection"):
+        return conn.rdy <= 1 or conn.rdy < conn.last_rdy * self._rdy_threshold
 
     def redistribute(self):
-        self._cmd_queue.put_nowait((REDISTRIBUTE, ()))
+        if self._is_paused:
+            return
+        self._need_redistribute = True
+        self._wakeup.set()
 
     async def _distributor(self):
         while self._is_working:
-            cmd, args = await self._cmd_queue.get()
-            if cmd == REDISTRIBUTE:
-                await self._redistribute_rdy_state()
-            elif cmd == CHANGE_CONN_RDY:
-                await self._update_rdy(*args)
-            elif cmd == NOOP:
-                continue
-            else:
-                RuntimeError("Should never be here")
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._is_working:
+                break
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error("rdy flush failed: {}".format(e))
+
+    async def _flush(self):
+        if self._need_redistribute:
+            self._need_redistribute = False
+            await self._redistribute_rdy_state()
+        dirty, self._dirty = self._dirty, set()
+        for conn_id in dirty:
+            await self._update_rdy(conn_id)
 
     def remove_connection(self, conn: "TcpConnection"):
         try:
             if conn is not None and conn.id in self._connections:
                 self._connections.pop(conn.id)
+                self._policy.remove(conn.id)
+                self._starved_since.pop(conn.id, None)
+                self._granted_at.pop(conn.id, None)
+                self._held.discard(conn.id)
             conn.close()
         except Exception as e:
             logger.error("remove connection {} failed: {}".format(conn, e))
@@ -90,7 +182,7 @@ class RdyControl:
 
     def stop_working(self):
         self._is_working = False
-        self._cmd_queue.put_nowait((NOOP, ()))
+        self._wakeup.set()
         self.remove_all()
 
     async def _redistribute_rdy_state(self):
@@ -118,25 +210,72 @@ class RdyControl:
 
         # logger.warning("_redistribute_rdy_state ~~~ ")
 
-        connections = self._connections.values()
-        # disable for further deprecate
+        if not self.is_rotating:
+            # every connection can get RDY, recompute their share
+            self._starved_since.clear()
+            self._granted_at.clear()
+            for conn_id in list(self._connections.keys()):
+                await self._update_rdy(conn_id)
+            return
 
-        # rdy_coros = [
-        #     conn.execute(RDY, 0) for conn in connections
-        #     if not (conn.rdy_state == 0 or
-        #             (time.time() - conn.last_message) < self._idle_timeout)
-        # ]
+        await self._rotate_rdy()
 
-        distributed_rdy = sum(c._in_flight for c in connections)
-        not_distributed_rdy = self._max_in_flight - distributed_rdy
+    async def _rotate_rdy(self):
+        # there are not enough max_in_flight to give every connection RDY 1,
+        # so RDY is moved away from connections that had it for a full
+        # idle_timeout (idle ones first) to the longest starved ones
+        now = self._time()
+        holders, starved, futures = [], [], []
+        for conn in self._connections.values():
+            if conn.id in self._held:
+                continue
+            if conn.last_rdy > 0:
+                holders.append(conn)
+                self._starved_since.pop(conn.id, None)
+                self._granted_at.setdefault(conn.id, now)
+                if conn.last_rdy > 1:
+                    futures.append(conn.execute(RDY, 1))
+            else:
+                starved.append(conn)
+                self._starved_since.setdefault(conn.id, now)
+        starved.sort(key=lambda c: self._starved_since[c.id])
+
+        def last_active(conn):
+            return max(conn._last_message, self._granted_at[conn.id])
+
+        holders.sort(key=last_active)
+        excess = max(0, len(holders) - self._max_in_flight)
+        free = max(0, self._max_in_flight - len(holders))
+        wanted = max(0, len(starved) - free)
+        revoke = holders[:excess]
+        for conn in holders[excess:]:
+            if len(revoke) - excess >= wanted:
+                break
+            if now - self._granted_at[conn.id] >= self._idle_timeout:
+                revoke.append(conn)
+
+        for conn in revoke:
+            logger.debug("rotate RDY away from {}".format(conn.id))
+            futures.append(conn.execute(RDY, 0))
+            self._granted_at.pop(conn.id, None)
+            self._starved_since[conn.id] = now
+
+        for conn in starved[: free + len(revoke) - excess]:
+            logger.debug(
+                "rotate RDY to {} starved for {:.1f}s".format(
+                    conn.id, now - self._starved_since[conn.id]
+                )
+            )
+            futures.append(conn.execute(RDY, 1))
+            self._starved_since.pop(conn.id, None)
+            self._granted_at[conn.id] = now
 
-        random_connections = random.sample(
-            list(connections), min(not_distributed_rdy, len(connections))
+        results = await asyncio.gather(
+            *futures, loop=self._loop, return_exceptions=True
         )
-
-        rdy_coros = [conn.execute(RDY, 1) for conn in random_connections]
-
-        await asyncio.gather(*rdy_coros, loop=self._loop)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("rotate RDY failed: {!r}".format(result))
 
     async def _is_valid_connection(self, conn_id):
         conn = self._connections.get(conn_id, None)
@@ -164,15 +303,24 @@ class RdyControl:
             return
 
         conn = self._connections[conn_id]
+        if conn_id in self._held:
+            return
+        if self.is_rotating and conn.last_rdy == 0:
+            # waiting for its turn in _rotate_rdy
+            return
 
-        # this is the configuration max_in_flight split even on conn
-        base_conn_max_in_flight = self._max_in_flight / max(1, len(self._connections))
+        # this is the configuration max_in_flight share of the conn
+        base_conn_max_in_flight = self._policy.conn_max_in_flight(
+            conn_id, self._connections.keys(), self._max_in_flight
+        )
 
         # this is the in_flight number of the conn_id's conn
         conn_in_flight = conn._in_flight
 
         # get the max rdy state for conn
         rdy_state = int(max(1, base_conn_max_in_flight - conn_in_flight))
+        if rdy_state == conn.rdy:
+            return
 
         logger.debug("_update_rdy :{} => {}".format(conn_id, rdy_state))
         await conn.execute(RDY, rdy_state)
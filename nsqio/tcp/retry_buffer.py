@@ -0,0 +1,240 @@
+from asyncio.events import AbstractEventLoop
+from collections import deque
+from typing import Optional
+
+import asyncio
+
+from nsqio.tcp.exceptions import NSQRetryBufferFull
+from nsqio.utils import _convert_to_bytes
+
+__all__ = [
+    "RetryBuffer",
+    "OVERFLOW_BLOCK",
+    "OVERFLOW_DROP_OLDEST",
+    "OVERFLOW_RAISE",
+]
+
+# when full: wait for room, fail the oldest publish, or fail the new one
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_RAISE = "raise"
+
+
+class _Entry:
+    __slots__ = (
+        "topic",
+        "messages",
+        "size",
+        "expires",
+        "future",
+        "timer",
+        "delay_time",
+        "created",
+    )
+
+    def __init__(
+        self, topic, messages, size, expires, future, delay_time=None, created=None
+    ):
+        self.topic = topic
+        self.messages = messages
+        self.size = size
+        self.expires = expires
+        self.future = future
+        self.timer = None
+        # a DPUB of one message, its delay counted from created
+        self.delay_time = delay_time
+        self.created = created
+
+
+class RetryBuffer:
+    """
+    bounded in-memory queue of publishes waiting for a reconnect
+
+    A publish made while the Writer is disconnected is held here, the
+    caller waiting on its future, and sent in order as MPUB once the
+    connection is back, or as DPUB for delayed publishes. A publish still
+    buffered after its deadline fails with asyncio.TimeoutError.
+
+    :param max_count: max messages buffered
+    :param max_bytes: max bytes of message bodies buffered
+    :param overflow: OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST or OVERFLOW_RAISE,
+        dropped or refused publishes fail with NSQRetryBufferFull
+    :param deadline: default seconds a publish may wait, None for no limit
+    """
+
+    def __init__(
+        self,
+        max_count: int = 10000,
+        max_bytes: int = 16 * 1024 * 1024,
+        overflow: str = OVERFLOW_BLOCK,
+        deadline: Optional[float] = 30.0,
+        loop: Optional[AbstractEventLoop] = None,
+    ):
+        assert overflow in (
+            OVERFLOW_BLOCK,
+            OVERFLOW_DROP_OLDEST,
+            OVERFLOW_RAISE,
+        ), "unknown overflow policy"
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._overflow = overflow
+        self._deadline = deadline
+        self._loop: AbstractEventLoop = loop or asyncio.get_event_loop()
+        self._entries = deque()
+        self._count = 0
+        self._bytes = 0
+        self._room = asyncio.Event(loop=self._loop)
+        self.dropped = 0
+        self.expired = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def empty(self):
+        return self._count == 0
+
+    def _fits(self, count, size):
+        return (
+            self._count + count <= self._max_count
+            and self._bytes + size <= self._max_bytes
+        )
+
+    async def put(
+        self, topic, messages, deadline=None, delay_time=None
+    ) -> asyncio.Future:
+        """Buffer the publish of ``messages``, as one MPUB.
+
+        :param delay_time: delay in millisecond of a DPUB of one message,
+            the time spent buffered is taken off it
+        :return: future of the publish response
+        """
+        messages = [_convert_to_bytes(m) for m in messages]
+        count, size = len(messages), sum(len(m) for m in messages)
+        if count > self._max_count or size > self._max_bytes:
+            raise NSQRetryBufferFull(
+                "{} messages of {} bytes over the buffer size".format(count, size)
+            )
+        deadline = self._deadline if deadline is None else deadline
+        expires = None if deadline is None else self._loop.time() + deadline
+
+        while not self._fits(count, size):
+            if self._overflow == OVERFLOW_RAISE:
+                raise NSQRetryBufferFull("retry buffer full")
+            if self._overflow == OVERFLOW_DROP_OLDEST:
+                entry = self._entries.popleft()
+                self._remove(entry)
+                self.dropped += len(entry.messages)
+                entry.future.done() or entry.future.set_exception(
+                    NSQRetryBufferFull("dropped from the retry buffer")
+                )
+                continue
+            self._room.clear()
+            timeout = None if expires is None else expires - self._loop.time()
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError()
+            await asyncio.wait_for(self._room.wait(), timeout, loop=self._loop)
+
+        entry = _Entry(
+            topic,
+            messages,
+            size,
+            expires,
+            self._loop.create_future(),
+            delay_time,
+            self._loop.time(),
+        )
+        self._entries.append(entry)
+        self._count += count
+        self._bytes += size
+        self._arm(entry)
+        return entry.future
+
+    def _arm(self, entry):
+        if entry.expires is not None:
+            entry.timer = self._loop.call_at(entry.expires, self._expire, entry)
+
+    def _remove(self, entry):
+        if entry.timer is not None:
+            entry.timer.cancel()
+            entry.timer = None
+        self._count -= len(entry.messages)
+        self._bytes -= entry.size
+        self._room.set()
+
+    def _expire(self, entry):
+        entry.timer = None
+        try:
+            self._entries.remove(entry)
+        except ValueError:
+            return
+        self._remove(entry)
+        self.expired += len(entry.messages)
+        entry.future.done() or entry.future.set_exception(asyncio.TimeoutError())
+
+    def take(self, max_count=None, max_bytes=None):
+        """Oldest publishes to the same topic that fit in one MPUB, or in
+        one write of DPUB when they are delayed.
+
+        :return: ``(topic, entries)``, None if empty; the entries are no
+            longer buffered and must be resolved or given back by requeue()
+        """
+        max_count = max_count or self._max_count
+        max_bytes = max_bytes or self._max_bytes
+        if not self._entries:
+            return None
+        topic = self._entries[0].topic
+        delayed = self._entries[0].delay_time is not None
+        entries, count, size = [], 0, 4
+        while self._entries:
+            entry = self._entries[0]
+            if entry.future.done():
+                # the caller gave up waiting
+                self._entries.popleft()
+                self._remove(entry)
+                continue
+            entry_size = entry.size + 4 * len(entry.messages)
+            if (
+                entry.topic != topic
+                or (entry.delay_time is not None) != delayed
+                or (
+                    entries
+                    and (
+                        count + len(entry.messages) > max_count
+                        or size + entry_size > max_bytes
+                    )
+                )
+            ):
+                break
+            self._entries.popleft()
+            self._remove(entry)
+            entries.append(entry)
+            count += len(entry.messages)
+            size += entry_size
+        return topic, entries
+
+    def requeue(self, entries):
+        """Give back entries from take() that could not be sent, in order."""
+        now = self._loop.time()
+        for entry in reversed(entries):
+            if entry.future.done():
+                continue
+            if entry.expires is not None and entry.expires <= now:
+                self.expired += len(entry.messages)
+                entry.future.set_exception(asyncio.TimeoutError())
+                continue
+            self._entries.appendleft(entry)
+            self._count += len(entry.messages)
+            self._bytes += entry.size
+            self._arm(entry)
+
+    def fail_all(self, exc):
+        """Fail every buffered publish with ``exc``."""
+        while self._entries:
+            entry = self._entries.popleft()
+            self._remove(entry)
+            entry.future.done() or entry.future.set_exception(exc)
@@ -0,0 +1,313 @@
+from asyncio.events import AbstractEventLoop
+from bisect import bisect, insort
+from typing import Optional
+
+import asyncio
+import hashlib
+import struct
+
+from functools import partial
+
+from nsqio.tcp.batch_writer import BatchingWriter
+from nsqio.tcp.consts import MPUB, PUB, DPUB
+from nsqio.tcp.exceptions import NSQErrorCode, make_error
+from nsqio.tcp.writer_pool import RETRIABLE_ERRORS, WriterPool
+from nsqio.utils import _convert_to_bytes, get_logger, get_host_and_port
+
+__all__ = ["HashRing", "ShardedWriterPool", "create_sharded_writer_pool"]
+
+logger = get_logger()
+
+_HASH = struct.Struct(">Q")
+
+
+def _hash(value) -> int:
+    return _HASH.unpack_from(hashlib.md5(_convert_to_bytes(value)).digest())[0]
+
+
+async def create_sharded_writer_pool(
+    nsqd_tcp_addresses=None, loop=None, lookupd_http_addresses=None, **kwargs
+):
+    """
+    initial function to get a producer publishing each key to one nsqd
+    param: nsqd_tcp_addresses: tcp addrs with no protocol.
+        such as ['127.0.0.1:4150','182.168.1.1:4150']
+    param: lookupd_http_addresses: discover the nsqd from lookupd too
+    param: vnodes: points of every nsqd on the hash ring
+    param: batch_linger: batch publishes per nsqd as MPUB, waiting at most
+        this many seconds, no batching if None
+    param: batch_max_count: max messages in a batch
+    param: batch_max_bytes: max MPUB body size of a batch
+    other params are those of WriterPool
+    """
+    loop = loop or asyncio.get_event_loop()
+    if nsqd_tcp_addresses is None and not lookupd_http_addresses:
+        nsqd_tcp_addresses = ["127.0.0.1:4150"]
+    nsqd_tcp_addresses = [get_host_and_port(i) for i in nsqd_tcp_addresses or []]
+    pool = ShardedWriterPool(
+        nsqd_tcp_addresses=nsqd_tcp_addresses,
+        lookupd_http_addresses=lookupd_http_addresses,
+        loop=loop,
+        **kwargs,
+    )
+    await pool.connect()
+    return pool
+
+
+class HashRing:
+    """
+    consistent-hash ring with ``vnodes`` points per node
+
+    Adding or removing a node only moves the keys of the arcs it owns.
+    """
+
+    def __init__(self, vnodes: int = 160):
+        assert vnodes > 0, "vnodes must be positive"
+        self._vnodes = vnodes
+        # sorted (hash, node) points
+        self._points = []
+        self._nodes = set()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self._vnodes):
+            insort(self._points, (_hash("{}#{}".format(node, i)), node))
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [p for p in self._points if p[1] != node]
+
+    def nodes_for(self, key):
+        """Every node, the owner of ``key`` first then clockwise."""
+        if not self._points:
+            return
+        start = bisect(self._points, (_hash(key),))
+        seen = set()
+        count = len(self._points)
+        for i in range(count):
+            node = self._points[(start + i) % count][1]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self._nodes):
+                    return
+
+
+class _NodeBatcher(BatchingWriter):
+    """
+    BatchingWriter of the keyed publishes going to one nsqd
+
+    A batch is sent to that nsqd only; if it fails there, its messages are
+    regrouped by the nsqd their own key falls back to and sent again, up to
+    max_retries times.
+    """
+
+    def __init__(self, pool: "ShardedWriterPool", nsqd_id, **kwargs):
+        super().__init__(pool, **kwargs)
+        self._pool = pool
+        self._nsqd_id = nsqd_id
+
+    def _pick_node(self, nsqd_id, exclude):
+        writer = self._pool._writers.get(nsqd_id, None)
+        if nsqd_id in exclude or writer is None:
+            return None
+        if not self._pool._is_healthy(nsqd_id, writer):
+            return None
+        return nsqd_id
+
+    async def _send(self, topic, batch):
+        items = list(zip(batch.keys, batch.messages, batch.futures))
+        await self._send_to(topic, self._nsqd_id, items, frozenset())
+
+    async def _send_to(self, topic, nsqd_id, items, tried):
+        """MPUB ``items`` to ``nsqd_id`` only, rerouted by key if it fails"""
+        try:
+            resp = await self._pool._execute(
+                partial(self._pick_node, nsqd_id),
+                MPUB,
+                topic,
+                data=[message for _, message, _ in items],
+            )
+            error = make_error(*resp) if isinstance(resp, tuple) else None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+        if error is None:
+            self._resolve(items, resp)
+            return
+        if isinstance(error, NSQErrorCode) and not isinstance(error, RETRIABLE_ERRORS):
+            self._resolve(items, error=error)
+            return
+        tried = tried | {nsqd_id}
+        if len(tried) > self._pool._max_retries:
+            logger.warning(
+                "MPUB of {} messages to {} failed: {!r}".format(
+                    len(items), topic, error
+                )
+            )
+            self._resolve(items, error=error)
+            return
+        logger.warning(
+            "MPUB of {} messages to {} on {} failed, rerouted by key: {!r}".format(
+                len(items), topic, nsqd_id, error
+            )
+        )
+        await self._reroute(topic, items, tried, error)
+
+    async def _reroute(self, topic, items, tried, error):
+        # split by the next nsqd of every key, again on every hop
+        groups = {}
+        for item in items:
+            fallback = self._pool._pick_on_ring(item[0], tried)
+            groups.setdefault(fallback, []).append(item)
+        lost = groups.pop(None, None)
+        if lost:
+            self._resolve(lost, error=error)
+        await asyncio.gather(
+            *[
+                self._send_to(topic, nsqd_id, group, tried)
+                for nsqd_id, group in groups.items()
+            ],
+            loop=self._loop,
+        )
+
+    @staticmethod
+    def _resolve(items, resp=None, error=None):
+        if error is None and isinstance(resp, tuple):
+            error = make_error(*resp)
+        for _, _, fut in items:
+            if fut.done():
+                continue
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(resp)
+
+
+class ShardedWriterPool(WriterPool):
+    """
+    NSQ tcp producer publishing every key to the same nsqd
+
+    Keys are mapped to nsqd by a consistent-hash ring. A publish goes to
+    the owner of its key, or while the owner is down or ejected to the next
+    nsqd on the ring, so only the keys of a nsqd that left move. Publishes
+    without key go to the least busy nsqd, as in WriterPool.
+
+    With ``batch_linger`` set, keyed publishes are batched per nsqd into
+    MPUB; a batch failing on its nsqd is split by the fallback nsqd of
+    every key.
+    """
+
+    def __init__(
+        self,
+        nsqd_tcp_addresses=None,
+        lookupd_http_addresses=None,
+        loop: Optional[AbstractEventLoop] = None,
+        vnodes: int = 160,
+        batch_linger: Optional[float] = None,
+        batch_max_count: int = 100,
+        batch_max_bytes: int = 1024 * 1024,
+        **kwargs,
+    ):
+        super().__init__(
+            nsqd_tcp_addresses=nsqd_tcp_addresses,
+            lookupd_http_addresses=lookupd_http_addresses,
+            loop=loop,
+            **kwargs,
+        )
+        self._ring = HashRing(vnodes)
+        self._batch_linger = batch_linger
+        self._batch_max_count = batch_max_count
+        self._batch_max_bytes = batch_max_bytes
+        # nsqd_id -> BatchingWriter
+        self._batchers = {}
+
+    async def _add_nsqds(self, addresses):
+        await super()._add_nsqds(addresses)
+        for nsqd_id in self._writers:
+            self._ring.add(nsqd_id)
+
+    async def _remove_nsqd(self, nsqd_id):
+        self._ring.remove(nsqd_id)
+        batcher = self._batchers.pop(nsqd_id, None)
+        await super()._remove_nsqd(nsqd_id)
+        if batcher is not None:
+            # sent to the next nsqd on the ring
+            await batcher.close()
+
+    def _pick_on_ring(self, key, exclude):
+        """first healthy nsqd not in ``exclude`` from the owner of ``key`` on"""
+        for node in self._ring.nodes_for(key):
+            writer = self._writers.get(node, None)
+            if node in exclude or writer is None:
+                continue
+            if self._is_healthy(node, writer):
+                return node
+        return None
+
+    def node_for(self, key):
+        """nsqd a publish of ``key`` goes to now, None if none is up"""
+        return self._pick_on_ring(key, ())
+
+    def _batcher(self, nsqd_id) -> "_NodeBatcher":
+        batcher = self._batchers.get(nsqd_id, None)
+        if batcher is None:
+            batcher = self._batchers[nsqd_id] = _NodeBatcher(
+                self,
+                nsqd_id,
+                max_count=self._batch_max_count,
+                max_bytes=self._batch_max_bytes,
+                linger=self._batch_linger,
+                loop=self._loop,
+            )
+        return batcher
+
+    async def _execute_for_key(self, key, command, *args, data=None):
+        if key is None:
+            return await self.execute(command, *args, data=data)
+        return await self._execute(
+            lambda exclude: self._pick_on_ring(key, exclude), command, *args, data=data
+        )
+
+    async def pub(self, topic, message, key=None):
+        if self._batch_linger is not None and key is not None:
+            nsqd_id = self.node_for(key)
+            if nsqd_id is not None:
+                return await self._batcher(nsqd_id).pub(topic, message, key)
+        return await self._execute_for_key(key, PUB, topic, data=message)
+
+    async def dpub(self, topic, delay_time, message, key=None):
+        """
+        :param delay_time: delayed time in millisecond
+        """
+        if not delay_time or delay_time is None:
+            delay_time = 0
+        return await self._execute_for_key(key, DPUB, topic, delay_time, data=message)
+
+    async def mpub(self, topic, *messages, key=None):
+        return await self._execute_for_key(key, MPUB, topic, data=list(messages))
+
+    async def flush(self):
+        """Send the messages batched on every nsqd and wait for the responses."""
+        await asyncio.gather(
+            *[b.flush() for b in self._batchers.values()], loop=self._loop
+        )
+
+    async def close(self):
+        await self.flush()
+        self._batchers = {}
+        await super().close()
+
+    def __repr__(self):
+        return "<ShardedWriterPool{}>".format(",".join(self._writers))
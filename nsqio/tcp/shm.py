@@ -0,0 +1,177 @@
+from typing import Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from nsqio.tcp.messages import NsqMessage
+    from nsqio.tcp.reader import Reader
+
+import asyncio
+
+from collections import namedtuple
+
+from nsqio.utils import get_logger
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover, python < 3.8
+    shared_memory = None
+
+__all__ = ["ShmSlot", "SharedMemoryRing", "ShmDispatcher", "read_slot"]
+
+logger = get_logger()
+
+# what a worker gets instead of the body: the slot of the body in the ring,
+# or the body itself if it does not fit in a slot
+ShmSlot = namedtuple("ShmSlot", "name offset length inline")
+
+# shared memory blocks attached in this process, by name
+_attached = {}
+
+
+def read_slot(slot: ShmSlot):
+    """Body referenced by ``slot`` as a memoryview, no copy.
+
+    the view is only valid until the message is finished, copy what must
+    be kept.
+    """
+    if slot.inline is not None:
+        return memoryview(slot.inline)
+    shm = _attached.get(slot.name, None)
+    if shm is None:
+        shm = _attached[slot.name] = shared_memory.SharedMemory(name=slot.name)
+    return shm.buf[slot.offset : slot.offset + slot.length]
+
+
+def _run_slot(func, slot):
+    body = read_slot(slot)
+    try:
+        return func(body)
+    finally:
+        body.release()
+
+
+class SharedMemoryRing:
+    """
+    fixed size slots in one shared memory block
+
+    :param slot_count: number of slots
+    :param slot_size: max body size in a slot
+    """
+
+    def __init__(self, slot_count: int = 64, slot_size: int = 1 << 20):
+        if shared_memory is None:
+            raise RuntimeError("multiprocessing.shared_memory needs python 3.8+")
+        assert slot_count > 0 and slot_size > 0, "slot_count/slot_size must be > 0"
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=slot_count * slot_size)
+        self._free = list(range(slot_count))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def occupancy(self):
+        """Number of slots in use."""
+        return self.slot_count - len(self._free)
+
+    def put(self, body) -> "ShmSlot":
+        """Copy ``body`` in a free slot, there must be one."""
+        if len(body) > self.slot_size:
+            return ShmSlot(None, -1, len(body), bytes(body))
+        index = self._free.pop()
+        offset = index * self.slot_size
+        self._shm.buf[offset : offset + len(body)] = body
+        return ShmSlot(self._shm.name, offset, len(body), None)
+
+    def release(self, slot: "ShmSlot"):
+        if slot.inline is None:
+            self._free.append(slot.offset // self.slot_size)
+
+    def close(self):
+        # the block may have been attached here too by a thread worker
+        attached = _attached.pop(self._shm.name, None)
+        if attached is not None:
+            attached.close()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class ShmDispatcher:
+    """
+    hand the messages of a Reader to worker processes through shared memory
+
+    Bodies are copied once into a SharedMemoryRing slot and workers get the
+    ShmSlot only: ``func(body)`` runs in ``executor`` with ``body`` a
+    memoryview of the slot, ``func`` must be picklable. A message is FIN
+    when ``func`` returns and REQ if it raises, then its slot is free.
+
+    No message is taken from the reader while the ring is full, and the
+    reader max_in_flight is capped to the number of slots so nsqd never
+    sends more than the ring holds.
+    """
+
+    def __init__(
+        self,
+        reader: "Reader",
+        executor: "Executor",
+        func: Callable,
+        slot_count: int = 64,
+        slot_size: int = 1 << 20,
+        requeue_delay: int = 0,
+    ):
+        self._reader = reader
+        self._executor = executor
+        self._func = func
+        self._requeue_delay = requeue_delay
+        self._ring = SharedMemoryRing(slot_count, slot_size)
+        self._slots = asyncio.Semaphore(slot_count, loop=reader._loop)
+        self._pending = set()
+        self._finishing = set()
+
+    @property
+    def ring(self):
+        return self._ring
+
+    async def run(self):
+        """dispatch until the reader is unsubscribed, then wait the workers"""
+        loop = self._reader._loop
+        if self._reader.max_in_flight > self._ring.slot_count:
+            self._reader.update_max_in_flight(self._ring.slot_count)
+        try:
+            async for msg in self._reader.messages():
+                await self._slots.acquire()
+                slot = self._ring.put(msg.body)
+                fut = loop.run_in_executor(self._executor, _run_slot, self._func, slot)
+                self._pending.add(fut)
+                fut.add_done_callback(
+                    lambda f, msg=msg, slot=slot: self._done(f, msg, slot)
+                )
+        finally:
+            if self._pending:
+                await asyncio.wait(list(self._pending), loop=loop)
+            if self._finishing:
+                await asyncio.wait(list(self._finishing), loop=loop)
+            self._ring.close()
+
+    def _done(self, fut, msg: "NsqMessage", slot: "ShmSlot"):
+        self._pending.discard(fut)
+        self._ring.release(slot)
+        self._slots.release()
+        error = "cancelled" if fut.cancelled() else fut.exception()
+        task = asyncio.ensure_future(self._finish(msg, error), loop=self._reader._loop)
+        self._finishing.add(task)
+        task.add_done_callback(self._finishing.discard)
+
+    async def _finish(self, msg: "NsqMessage", error):
+        if msg.processed:
+            return
+        try:
+            if error is None:
+                await msg.fin()
+            else:
+                logger.error("worker of {} failed: {!r}".format(msg, error))
+                await msg.req(self._requeue_delay)
+        except Exception as e:
+            logger.warning("FIN/REQ {} failed: {!r}".format(msg, e))
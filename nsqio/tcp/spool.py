@@ -0,0 +1,295 @@
+import mmap
+import os
+import struct
+import time
+
+from nsqio.tcp.exceptions import NSQSpoolFull
+from nsqio.utils import get_logger
+
+__all__ = ["DiskSpool", "SPOOLED", "FSYNC_ALWAYS", "FSYNC_INTERVAL", "FSYNC_NEVER"]
+
+logger = get_logger()
+
+# response of a publish kept in the spool
+SPOOLED = b"SPOOLED"
+
+# msync after every append, at most every fsync_interval seconds, or never
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+# length of topic + body, length of topic, due time of a DPUB in epoch
+# millisecond or 0 for a PUB; a zero length ends a segment
+_RECORD_HEADER = struct.Struct(">IHQ")
+_SEGMENT_FORMAT = "{:016d}.seg"
+_OFFSET_FILE = "offset"
+
+
+class _Segment:
+    def __init__(self, path, seq, size, create=False):
+        self.path = path
+        self.seq = seq
+        with open(path, "w+b" if create else "r+b") as f:
+            if create:
+                f.truncate(size)
+            else:
+                size = os.fstat(f.fileno()).st_size
+            self.mm = mmap.mmap(f.fileno(), size)
+        self.size = size
+        self.end = 0
+        self.count = 0
+        if not create:
+            self._scan()
+
+    def _scan(self):
+        pos = 0
+        while pos + _RECORD_HEADER.size <= self.size:
+            length, _, _ = _RECORD_HEADER.unpack_from(self.mm, pos)
+            if length == 0 or pos + _RECORD_HEADER.size + length > self.size:
+                break
+            pos += _RECORD_HEADER.size + length
+            self.count += 1
+        self.end = pos
+
+    def append(self, topic: bytes, body: bytes, due: int = 0):
+        """Write a record, False if it does not fit."""
+        length = len(topic) + len(body)
+        end = self.end + _RECORD_HEADER.size + length
+        if end > self.size:
+            return False
+        _RECORD_HEADER.pack_into(self.mm, self.end, length, len(topic), due)
+        start = self.end + _RECORD_HEADER.size
+        self.mm[start : start + len(topic)] = topic
+        self.mm[start + len(topic) : end] = body
+        self.end = end
+        self.count += 1
+        return True
+
+    def read(self, pos):
+        """``(topic, body, next_pos, due)`` of the record at ``pos``, None at
+        end."""
+        if pos >= self.end:
+            return None
+        length, topic_len, due = _RECORD_HEADER.unpack_from(self.mm, pos)
+        start = pos + _RECORD_HEADER.size
+        topic = self.mm[start : start + topic_len]
+        body = self.mm[start + topic_len : start + length]
+        return topic, body, start + length, due
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self, delete=False):
+        self.mm.close()
+        if delete:
+            os.remove(self.path)
+
+
+class DiskSpool:
+    """
+    write-ahead spool of publishes, in mmap segment files
+
+    Records ``(topic, body)``, with the due time of a DPUB, are appended
+    length-prefixed to preallocated segment files of ``segment_size`` bytes
+    and read back in order. The read position is kept in an ``offset`` file
+    and fully read segments are deleted, so a spool reopened after a crash
+    replays what was not committed.
+
+    :param directory: directory of the segment files
+    :param segment_size: size of a segment file, max size of a record
+    :param max_bytes: max bytes of records not committed, appends over it
+        raise NSQSpoolFull
+    :param fsync: FSYNC_ALWAYS, FSYNC_INTERVAL or FSYNC_NEVER
+    :param fsync_interval: seconds between msync with FSYNC_INTERVAL
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_size: int = 64 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        fsync: str = FSYNC_INTERVAL,
+        fsync_interval: float = 1.0,
+    ):
+        assert fsync in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER), "unknown fsync"
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_bytes = max_bytes
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._last_fsync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = []
+        self._read_seq, self._read_pos = self._load_offset()
+        self._open_segments()
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _load_offset(self):
+        try:
+            with open(self._path(_OFFSET_FILE)) as f:
+                seq, pos = f.read().split()
+            return int(seq), int(pos)
+        except FileNotFoundError:
+            return 0, 0
+
+    def _save_offset(self):
+        tmp = self._path(_OFFSET_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write("{} {}".format(self._read_seq, self._read_pos))
+        os.replace(tmp, self._path(_OFFSET_FILE))
+
+    def _open_segments(self):
+        names = sorted(n for n in os.listdir(self._directory) if n.endswith(".seg"))
+        for name in names:
+            seq = int(name[: -len(".seg")])
+            if seq < self._read_seq:
+                os.remove(self._path(name))
+                continue
+            self._segments.append(_Segment(self._path(name), seq, None))
+        if not self._segments:
+            self._read_seq, self._read_pos = self._read_seq + 1, 0
+            self._new_segment(self._read_seq)
+        elif self._segments[0].seq != self._read_seq:
+            self._read_seq, self._read_pos = self._segments[0].seq, 0
+
+        # bytes and records left to read
+        self._bytes, self._count = 0, 0
+        for segment in self._segments:
+            self._bytes += segment.end
+            self._count += segment.count
+        head, pos = self._segments[0], 0
+        while pos < self._read_pos:
+            record = head.read(pos)
+            if record is None:
+                break
+            self._count -= 1
+            pos = record[2]
+        self._bytes -= pos
+
+    def _new_segment(self, seq):
+        path = self._path(_SEGMENT_FORMAT.format(seq))
+        segment = _Segment(path, seq, self._segment_size, create=True)
+        self._segments.append(segment)
+        return segment
+
+    @property
+    def bytes(self):
+        """Bytes of records not committed yet."""
+        return self._bytes
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def empty(self):
+        return self._count == 0
+
+    def append(self, topic, body: bytes, delay_time: int = 0):
+        """Append a publish of ``body`` to ``topic``.
+
+        :param delay_time: delay in millisecond of a DPUB, counted from now
+            so that it keeps running while spooled
+        """
+        due = int(time.time() * 1000) + delay_time if delay_time else 0
+        if isinstance(topic, str):
+            topic = topic.encode()
+        size = _RECORD_HEADER.size + len(topic) + len(body)
+        if size > self._segment_size:
+            raise ValueError("record of {} bytes over segment_size".format(size))
+        if self._bytes + size > self._max_bytes:
+            raise NSQSpoolFull("spool over {} bytes".format(self._max_bytes))
+        tail = self._segments[-1]
+        if not tail.append(topic, body, due):
+            tail.flush()
+            tail = self._new_segment(tail.seq + 1)
+            tail.append(topic, body, due)
+        self._bytes += size
+        self._count += 1
+        if self._fsync == FSYNC_ALWAYS:
+            tail.flush()
+        elif self._fsync == FSYNC_INTERVAL:
+            now = time.monotonic()
+            if now - self._last_fsync >= self._fsync_interval:
+                self._last_fsync = now
+                tail.flush()
+
+    def peek(self, max_count=100, max_bytes=1024 * 1024):
+        """Oldest records not committed that go to the same topic, all PUB
+        or all DPUB.
+
+        :return: ``(topic, bodies, position, dues)`` with position to commit
+            once the bodies are published and dues the due time in epoch
+            millisecond of every DPUB, None for PUB; None if the spool is
+            empty
+        """
+        topic, bodies, dues, size = None, [], [], 4
+        seq, pos = self._read_seq, self._read_pos
+        for segment in self._segments:
+            if segment.seq < seq:
+                continue
+            if segment.seq > seq:
+                pos = 0
+            while len(bodies) < max_count:
+                record = segment.read(pos)
+                if record is None:
+                    break
+                record_topic, body, next_pos, due = record
+                if topic is None:
+                    topic = record_topic
+                elif (
+                    record_topic != topic
+                    or bool(due) != bool(dues[0])
+                    or size + 4 + len(body) > max_bytes
+                ):
+                    return self._batch(topic, bodies, (seq, pos), dues)
+                bodies.append(body)
+                dues.append(due)
+                size += 4 + len(body)
+                seq, pos = segment.seq, next_pos
+            if len(bodies) >= max_count:
+                break
+        if topic is None:
+            return None
+        return self._batch(topic, bodies, (seq, pos), dues)
+
+    @staticmethod
+    def _batch(topic, bodies, position, dues):
+        return topic.decode(), bodies, position, dues if dues[0] else None
+
+    def commit(self, position):
+        """Drop the records before ``position``, as returned by peek."""
+        seq, pos = position
+        while self._read_seq < seq or self._read_pos < pos:
+            head = self._segments[0]
+            record = head.read(self._read_pos)
+            if record is None:
+                if head is self._segments[-1]:
+                    break
+                head.close(delete=True)
+                self._segments.pop(0)
+                self._read_seq, self._read_pos = self._segments[0].seq, 0
+                continue
+            self._bytes -= record[2] - self._read_pos
+            self._count -= 1
+            self._read_pos = record[2]
+        # a fully read segment is deleted once the writer moved on
+        head = self._segments[0]
+        if head is not self._segments[-1] and self._read_pos >= head.end:
+            head.close(delete=True)
+            self._segments.pop(0)
+            self._read_seq, self._read_pos = self._segments[0].seq, 0
+        self._save_offset()
+
+    def flush(self):
+        """msync the segment being written."""
+        self._segments[-1].flush()
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._save_offset()
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
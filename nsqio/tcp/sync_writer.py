@@ -0,0 +1,171 @@
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Optional
+
+import asyncio
+import threading
+
+from nsqio.tcp.batch_writer import BatchingWriter
+from nsqio.tcp.writer_pool import create_writer_pool
+from nsqio.utils import _convert_to_bytes, get_logger
+
+__all__ = ["SyncWriter"]
+
+logger = get_logger()
+
+
+class SyncWriter:
+    """
+    blocking, thread-safe producer for synchronous code
+
+    Owns a background thread running an event loop with a WriterPool
+    connected once. publish() from any thread appends to a deque and wakes
+    the loop at most once per drain; the loop batches what it finds into
+    MPUB with a BatchingWriter.
+
+    :param nsqd_tcp_addresses: tcp addrs with no protocol.
+        such as ['127.0.0.1:4150','182.168.1.1:4150']
+    :param max_count: max messages in a MPUB
+    :param max_bytes: max MPUB body size
+    :param linger: max seconds a message waits for others
+    :param connect_timeout: seconds to wait for the connection
+    other params are those of create_writer_pool
+    """
+
+    def __init__(
+        self,
+        nsqd_tcp_addresses=None,
+        max_count: int = 100,
+        max_bytes: int = 1024 * 1024,
+        linger: float = 0.005,
+        connect_timeout: float = 10,
+        **pool_kwargs,
+    ):
+        self._nsqd_tcp_addresses = nsqd_tcp_addresses
+        self._pool_kwargs = pool_kwargs
+        self._batch_kwargs = dict(
+            max_count=max_count, max_bytes=max_bytes, linger=linger
+        )
+        # (topic, data, concurrent Future or None) waiting for the loop
+        self._pending = deque()
+        self._scheduled = False
+        self._closed = False
+        self._writer = None
+        self._batcher: Optional[BatchingWriter] = None
+        self.errors = 0
+
+        self._loop = asyncio.new_event_loop()
+        started = Future()
+        self._thread = threading.Thread(
+            target=self._run, args=(started,), name="nsqio-sync-writer", daemon=True
+        )
+        self._thread.start()
+        try:
+            started.result(connect_timeout)
+        except BaseException:
+            # timed out or failed, stop the loop thread before giving up
+            try:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            except RuntimeError:
+                # loop already closed by a failed connect
+                pass
+            self._thread.join(connect_timeout)
+            raise
+
+    def _run(self, started: Future):
+        asyncio.set_event_loop(self._loop)
+        connect = self._loop.create_task(self._connect())
+        try:
+            self._writer = self._loop.run_until_complete(connect)
+            self._batcher = BatchingWriter(
+                self._writer, loop=self._loop, **self._batch_kwargs
+            )
+        except Exception as e:
+            # stopped on timeout while connecting, let the connect unwind
+            connect.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(connect, loop=self._loop, return_exceptions=True)
+            )
+            started.set_exception(e)
+            self._loop.close()
+            return
+        started.set_result(None)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _connect(self):
+        return await create_writer_pool(
+            self._nsqd_tcp_addresses, loop=self._loop, **self._pool_kwargs
+        )
+
+    def publish(self, topic, message, wait=False, timeout=None):
+        """
+        publish ``message``, from any thread
+
+        :param wait: block until nsqd acked it, raise its error if any
+        :param timeout: max seconds to wait
+        :return: the MPUB response if ``wait``
+        """
+        if self._closed:
+            raise RuntimeError("SyncWriter closed")
+        fut = Future() if wait else None
+        self._pending.append((topic, _convert_to_bytes(message), fut))
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._drain)
+        if fut is not None:
+            return fut.result(timeout)
+
+    def _drain(self):
+        # reset first: a publish racing with the drain schedules another one
+        self._scheduled = False
+        pending = self._pending
+        while pending:
+            topic, data, fut = pending.popleft()
+            async_fut = self._batcher.publish(topic, data)
+            async_fut.add_done_callback(partial(self._on_done, target=fut))
+
+    def _on_done(self, fut: asyncio.Future, target: Optional[Future] = None):
+        error = None if fut.cancelled() else fut.exception()
+        if error is not None:
+            self.errors += 1
+        if target is None or target.done():
+            return
+        if fut.cancelled():
+            target.cancel()
+        elif error is not None:
+            target.set_exception(error)
+        else:
+            target.set_result(fut.result())
+
+    async def _flush(self):
+        self._drain()
+        await self._batcher.flush()
+
+    def flush(self, timeout=None):
+        """Block until every message published so far is acked or failed."""
+        asyncio.run_coroutine_threadsafe(self._flush(), self._loop).result(timeout)
+
+    async def _close(self):
+        await self._flush()
+        await self._writer.close()
+
+    def close(self, timeout=10):
+        """Flush, close the connections and stop the loop thread."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
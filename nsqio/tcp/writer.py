@@ -3,7 +3,16 @@ import time
 from nsqio.utils import retry_iterator
 from nsqio.tcp.connection import create_connection
 from nsqio.tcp.consts import MPUB, PUB, SUB, AUTH, DPUB, INIT, CONNECTED, CLOSED
-from nsqio.utils import get_logger
+from nsqio.tcp.consts import MAX_MSG_SIZE, MAX_BODY_SIZE
+from nsqio.tcp.exceptions import (
+    make_error,
+    NSQErrorCode,
+    NSQPubFailed,
+    NSQMPubFailed,
+    NSQDPubFailed,
+)
+from nsqio.tcp.spool import SPOOLED
+from nsqio.utils import get_logger, _convert_to_bytes
 
 logger = get_logger()
 
@@ -21,6 +30,12 @@ async def create_writer(
     deflate_level=6,
     consumer=False,
     sample_rate=0,
+    max_outstanding=None,
+    spool=None,
+    retry_buffer=None,
+    max_body_size=None,
+    max_msg_size=None,
+    ack_timeout=30.0,
 ):
     """"
     param: host: host addr with no protocol. 127.0.0.1 
@@ -29,6 +44,18 @@ async def create_writer(
     param: heartbeat_interval: heartbeat interval with nsq, set -1 to disable nsq heartbeat check
     params: snappy: snappy compress
     params: deflate: deflate compress  can't set True both with snappy
+    params: max_outstanding: max commands waiting for a response at once,
+        others wait their turn, unbounded by default
+    params: spool: DiskSpool keeping PUB and MPUB while nsqd is unreachable,
+        they are replayed in order as MPUB once connected
+    params: retry_buffer: RetryBuffer holding PUB and MPUB in memory while
+        reconnecting, unused with a spool
+    params: max_body_size: nsqd --max-body-size, mpub splits its messages in
+        MPUB of at most this size, from IDENTIFY or the nsqd default if None
+    params: max_msg_size: nsqd --max-msg-size, from IDENTIFY or the nsqd
+        default if None
+    params: ack_timeout: seconds a command waits for its response before
+        the connection is dropped as stuck, no limit if None
     """
     # TODO: add parameters type and value validation
     loop = loop or asyncio.get_event_loop()
@@ -46,6 +73,12 @@ async def create_writer(
         sample_rate=sample_rate,
         consumer=consumer,
         loop=loop,
+        max_outstanding=max_outstanding,
+        spool=spool,
+        retry_buffer=retry_buffer,
+        max_body_size=max_body_size,
+        max_msg_size=max_msg_size,
+        ack_timeout=ack_timeout,
     )
     await writer.connect()
     return writer
@@ -67,6 +100,12 @@ class Writer:
         sample_rate=0,
         consumer=False,
         max_in_flight=42,
+        max_outstanding=None,
+        spool=None,
+        retry_buffer=None,
+        max_body_size=None,
+        max_msg_size=None,
+        ack_timeout=30.0,
     ):
         # TODO: add parameters type and value validation
         self._config = {
@@ -87,10 +126,32 @@ class Writer:
         self._status = INIT
         self._on_rdy_changed_cb = None
         self._is_working = True
-        self._auto_reconnect_task_closed = asyncio.Event(loop=self._loop)
-        self._auto_reconnect_task = self._loop.create_task(self.auto_reconnect())
+        # reconnect in progress, only while the connection is lost, and the
+        # future of its current attempt that publishers wait on
+        self._reconnect_task = None
+        self._attempt = None
         self._exit_event = asyncio.Event(loop=self._loop)
 
+        # pipelining window: commands sent and not acked yet
+        self._max_outstanding = max_outstanding
+        self._window = None
+        if max_outstanding:
+            self._window = asyncio.Semaphore(max_outstanding, loop=self._loop)
+        self._outstanding = 0
+        self._waiting = 0
+        self._acks = 0
+        self._ack_latency = 0.0
+        self._max_ack_latency = 0.0
+
+        self._spool = spool
+        self._replay_task = None
+        self._retry_buffer = retry_buffer
+        self._flush_task = None
+
+        self._max_body_size = max_body_size
+        self._max_msg_size = max_msg_size
+        self._ack_timeout = ack_timeout
+
     async def connect(self):
         logger.debug("writer init connect")
         try:
@@ -99,17 +160,21 @@ class Writer:
             )
 
             self._conn._on_message = self._on_message
+            self._conn._on_close = self._on_conn_closed
             await self._conn.identify(**self._config)
             self._status = CONNECTED
+            self._start_replay()
         except Exception as e:
             logger.error("connect failed! {}".format(e))
             try:
                 if self._conn:
+                    self._conn._on_close = None
                     self._conn.close()
             except Exception as e:
                 logger.info("conn close failed, maybe its closed {}".format(e))
             finally:
                 self._status = CLOSED
+            self._start_reconnect()
 
     def _on_message(self, msg):
         # should not be coroutine
@@ -125,10 +190,35 @@ class Writer:
     def last_message(self):
         return self._last_message
 
+    def _on_conn_closed(self, conn):
+        if conn is self._conn:
+            logger.warning("{} connection lost".format(self))
+            self._connection_lost()
+
+    def _connection_lost(self):
+        self._status = CLOSED
+        self._start_reconnect()
+
+    def _start_reconnect(self):
+        if not self._is_working:
+            return
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._attempt = self._loop.create_future()
+            self._reconnect_task = self._loop.create_task(self.auto_reconnect())
+
     async def reconnect(self):
+        """reconnect now, or wait for the attempt of the reconnect in progress"""
+        if self._reconnect_task is not None and not self._reconnect_task.done():
+            await asyncio.shield(self._attempt, loop=self._loop)
+            return
+        await self._reconnect()
+
+    async def _reconnect(self):
         logger.debug("{} writer reconnect, status: {}".format(self, self._status))
         try:
             if self._conn:
+                # closed on purpose, not lost
+                self._conn._on_close = None
                 self._conn.close()
             self._status = CLOSED
         except Exception as tmp:
@@ -137,42 +227,98 @@ class Writer:
         await self.connect()
 
     async def auto_reconnect(self):
+        """reconnect with backoff until connected, started once the
+        connection is lost"""
         logger.debug("writer autoreconnect")
         timeout_generator = retry_iterator(init_delay=0.1, max_delay=10.0)
         try:
             while self._is_working:
-                logger.debug("writer autoreconnect check loop")
-                if not (self._status == CONNECTED or self._status == INIT):
-                    logger.debug(f"writer close({self._status})detected,reconnect")
-                    conn_id = self.id if self._conn else "init"
-                    logger.info("{} reconnect writer{}".format(self, conn_id))
-                    try:
-                        await self.reconnect()
-                    except ConnectionError:
-                        logger.error(
-                            "Can not connect to: {}:{} ".format(self._host, self._port)
+                await asyncio.sleep(next(timeout_generator), loop=self._loop)
+                logger.info("{} reconnect writer".format(self))
+                try:
+                    await self._reconnect()
+                except Exception as e:
+                    logger.error(
+                        "Can not connect to: {}:{} {!r}".format(
+                            self._host, self._port, e
                         )
-                    else:
-                        self._status = CONNECTED
-                t = next(timeout_generator)
-                await asyncio.sleep(t, loop=self._loop)
+                    )
+                connected = self._is_connected()
+                self._attempt.done() or self._attempt.set_result(connected)
+                if connected:
+                    return
+                self._attempt = self._loop.create_future()
         except asyncio.CancelledError:
             logger.info("{} auto_reconnect cancelled".format(self))
         finally:
-            self._auto_reconnect_task_closed.set()
-            try:
-                if self._conn and not self._conn.closed:
-                    self._conn.close()
-            except Exception as tmp:
-                logger.info("conn close failed,maybe its closed already or init")
-                logger.exception(tmp)
+            self._attempt.done() or self._attempt.set_result(False)
+
+    async def _ensure_connected(self):
+        """wait for the reconnect in progress, raise if its attempt failed"""
+        if self._conn is not None and not self._conn.closed:
+            return
+        self._connection_lost()
+        if not self._is_working or not await asyncio.shield(
+            self._attempt, loop=self._loop
+        ):
+            raise ConnectionError("{}:{} not connected".format(self._host, self._port))
 
     async def execute(self, command, *args, data=None):
-        if self._conn.closed:
-            logger.info("{} execute found conn closed, reconnect()".format(self))
-            await self.reconnect()
-        response = self._conn.execute(command, *args, data=data)
-        return await response
+        if self._window is None:
+            return await self._execute(command, *args, data=data)
+        self._waiting += 1
+        try:
+            await self._window.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            return await self._execute(command, *args, data=data)
+        finally:
+            self._window.release()
+
+    async def _execute(self, command, *args, data=None):
+        await self._ensure_connected()
+        start = self._loop.time()
+        self._outstanding += 1
+        try:
+            response = self._conn.execute(command, *args, data=data)
+            return await self._wait_ack(response)
+        finally:
+            self._outstanding -= 1
+            self._ack(self._loop.time() - start)
+
+    async def _wait_ack(self, response):
+        if self._ack_timeout is None:
+            return await response
+        try:
+            return await asyncio.wait_for(response, self._ack_timeout, loop=self._loop)
+        except asyncio.TimeoutError:
+            # responses come in order, none will come after a lost one; the
+            # close fails the other commands waiting and reconnects
+            conn = self._conn
+            logger.warning("{} no response in {}s".format(self, self._ack_timeout))
+            conn.close()
+            raise ConnectionError(
+                "{} no response in {}s".format(conn.id, self._ack_timeout)
+            )
+
+    def _ack(self, latency):
+        self._acks += 1
+        # moving average over about the last 20 acks
+        self._ack_latency += (latency - self._ack_latency) / min(self._acks, 20)
+        self._max_ack_latency = max(self._max_ack_latency, latency)
+
+    @property
+    def window(self):
+        """pipelining window: size, depth, publishes waiting and ack latency"""
+        return {
+            "size": self._max_outstanding,
+            "depth": self._outstanding,
+            "waiting": self._waiting,
+            "acks": self._acks,
+            "ack_latency": self._ack_latency,
+            "max_ack_latency": self._max_ack_latency,
+        }
 
     async def auth(self, secret):
         """
@@ -193,13 +339,20 @@ class Writer:
 
         return await self.execute(SUB, topic, channel)
 
-    async def pub(self, topic, message):
+    async def pub(self, topic, message, deadline=None):
         """
 
         :param topic:
         :param message:
+        :param deadline: seconds the publish may wait in the retry buffer
         :return:
         """
+        if self._spool is not None:
+            return await self._spool_or_execute(topic, [message], PUB, data=message)
+        if self._retry_buffer is not None:
+            return await self._buffer_or_execute(
+                topic, [message], PUB, data=message, deadline=deadline
+            )
         return await self.execute(PUB, topic, data=message)
 
     async def dpub(self, topic, delay_time, message):
@@ -214,17 +367,286 @@ class Writer:
             delay_time = 0
         return await self.execute(DPUB, topic, delay_time, data=message)
 
-    async def mpub(self, topic, *messages):
+    @property
+    def max_body_size(self):
+        if self._max_body_size:
+            return self._max_body_size
+        return self._conn.max_body_size if self._conn else MAX_BODY_SIZE
+
+    @property
+    def max_msg_size(self):
+        if self._max_msg_size:
+            return self._max_msg_size
+        return self._conn.max_msg_size if self._conn else MAX_MSG_SIZE
+
+    async def dpub_many(self, items, deadline=None):
+        """
+        publish delayed messages as DPUB frames sent in one write
+
+        With max_outstanding every frame takes a slot of the window, the
+        frames are sent in writes of as many as there are free slots. They
+        are spooled or buffered like pub() while disconnected.
+
+        :param items: ``(topic, delay_time, message)``, delay_time in
+            millisecond
+        :param deadline: seconds the publish may wait in the retry buffer
+        :return: response of every DPUB, in order
+        """
+        items = [
+            (topic, int(delay_time or 0), _convert_to_bytes(message))
+            for topic, delay_time, message in items
+        ]
+        if not items:
+            return []
+        if self._spool is not None:
+            return await self._spool_or_dpub(items)
+        if self._retry_buffer is not None:
+            return await self._buffer_or_dpub(items, deadline)
+        return await self._window_dpub(items)
+
+    async def _window_dpub(self, items):
+        calls = [((topic, delay_time), message) for topic, delay_time, message in items]
+        if self._window is None:
+            return await self._dpub_many(calls)
+        responses = []
+        while calls:
+            self._waiting += 1
+            try:
+                await self._window.acquire()
+            finally:
+                self._waiting -= 1
+            # take the other free slots without waiting, slots are never
+            # held while waiting for more so concurrent calls cannot block
+            count = 1
+            while count < len(calls) and not self._window.locked():
+                await self._window.acquire()
+                count += 1
+            try:
+                responses.extend(await self._dpub_many(calls[:count]))
+            finally:
+                for _ in range(count):
+                    self._window.release()
+            calls = calls[count:]
+        return responses
+
+    async def _dpub_many(self, calls):
+        await self._ensure_connected()
+        start = self._loop.time()
+        self._outstanding += len(calls)
+        try:
+            futures = self._conn.execute_pipelined(DPUB, calls)
+            return await self._wait_ack(asyncio.gather(*futures, loop=self._loop))
+        finally:
+            self._outstanding -= len(calls)
+            self._ack(self._loop.time() - start)
+
+    async def mpub(self, topic, *messages, deadline=None):
         """
+        publish messages, as several MPUB if they are over max_body_size
+
+        ``messages`` may also be one iterable or async iterable of messages,
+        MPUB are sent as they fill so it is never held whole in memory.
 
         :param topic:
         :param message:
-        :param messages:
-        :return:
+        :param messages: messages, or an iterable or async iterable of them
+        :param deadline: seconds the publish may wait in the retry buffer
+        :return: response of the last MPUB, or of the first one failing,
+            the MPUB before it were published
         """
-        msgs = list(messages)
+        if len(messages) == 1 and not isinstance(
+            messages[0], (bytes, bytearray, str, int, float)
+        ):
+            messages = messages[0]
+        max_body_size, max_msg_size = self.max_body_size, self.max_msg_size
+        resp = None
+        msgs, size = [], 4
+        async for message in _iterate(messages):
+            message = _convert_to_bytes(message)
+            if len(message) > max_msg_size:
+                raise ValueError(
+                    "message of {} bytes over max_msg_size".format(len(message))
+                )
+            if msgs and size + 4 + len(message) > max_body_size:
+                resp = await self._mpub(topic, msgs, deadline)
+                if isinstance(resp, tuple):
+                    return resp
+                msgs, size = [], 4
+            msgs.append(message)
+            size += 4 + len(message)
+        if msgs:
+            resp = await self._mpub(topic, msgs, deadline)
+        return resp
+
+    async def _mpub(self, topic, msgs, deadline):
+        if self._spool is not None:
+            return await self._spool_or_execute(topic, msgs, MPUB, data=msgs)
+        if self._retry_buffer is not None:
+            return await self._buffer_or_execute(
+                topic, msgs, MPUB, data=msgs, deadline=deadline
+            )
         return await self.execute(MPUB, topic, data=msgs)
 
+    def _is_connected(self):
+        if self._status != CONNECTED or self._conn is None:
+            return False
+        if self._conn.closed:
+            self._connection_lost()
+            return False
+        return True
+
+    async def _spool_or_execute(self, topic, messages, command, data):
+        """publish, or spool while disconnected or older publishes are spooled"""
+        if self._spool.empty and self._is_connected():
+            try:
+                return await self.execute(command, topic, data=data)
+            except (ConnectionError, OSError, AssertionError) as e:
+                logger.warning("{} publish failed, spooled: {!r}".format(self, e))
+                self._connection_lost()
+        for message in messages:
+            self._spool.append(topic, _convert_to_bytes(message))
+        self._start_replay()
+        return SPOOLED
+
+    async def _spool_or_dpub(self, items):
+        """DPUB, or spool with the delays while disconnected or older
+        publishes are spooled"""
+        if self._spool.empty and self._is_connected():
+            try:
+                return await self._window_dpub(items)
+            except (ConnectionError, OSError, AssertionError) as e:
+                logger.warning("{} publish failed, spooled: {!r}".format(self, e))
+                self._connection_lost()
+        for topic, delay_time, message in items:
+            self._spool.append(topic, message, delay_time)
+        self._start_replay()
+        return [SPOOLED] * len(items)
+
+    async def _buffer_or_execute(self, topic, messages, command, data, deadline):
+        """publish, or buffer while reconnecting or older publishes are buffered"""
+        if self._retry_buffer.empty and self._is_connected():
+            try:
+                return await self.execute(command, topic, data=data)
+            except (ConnectionError, OSError, AssertionError) as e:
+                logger.warning("{} publish failed, buffered: {!r}".format(self, e))
+                self._connection_lost()
+        fut = await self._retry_buffer.put(topic, messages, deadline)
+        self._start_replay()
+        return await fut
+
+    async def _buffer_or_dpub(self, items, deadline):
+        """DPUB, or buffer with the delays while reconnecting or older
+        publishes are buffered"""
+        if self._retry_buffer.empty and self._is_connected():
+            try:
+                return await self._window_dpub(items)
+            except (ConnectionError, OSError, AssertionError) as e:
+                logger.warning("{} publish failed, buffered: {!r}".format(self, e))
+                self._connection_lost()
+        futures = []
+        for topic, delay_time, message in items:
+            futures.append(
+                await self._retry_buffer.put(topic, [message], deadline, delay_time)
+            )
+        self._start_replay()
+        return await asyncio.gather(*futures, loop=self._loop)
+
+    def _start_replay(self):
+        if not self._is_connected():
+            return
+        if self._spool is not None and not self._spool.empty:
+            if self._replay_task is None or self._replay_task.done():
+                self._replay_task = self._loop.create_task(self._replay())
+        if self._retry_buffer is not None and not self._retry_buffer.empty:
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = self._loop.create_task(self._flush_retry_buffer())
+
+    async def _flush_retry_buffer(self):
+        """publish the retry buffer in order as MPUB, stop when disconnected"""
+        buffer = self._retry_buffer
+        while self._is_working and not buffer.empty and self._is_connected():
+            topic, entries = buffer.take(max_bytes=self.max_body_size)
+            if not entries:
+                continue
+            try:
+                if entries[0].delay_time is None:
+                    bodies = [body for entry in entries for body in entry.messages]
+                    resp = await self._execute(MPUB, topic, data=bodies)
+                    responses = [resp] * len(entries)
+                else:
+                    now = self._loop.time()
+                    calls = [
+                        (
+                            (topic, _remaining(entry.delay_time, entry.created, now)),
+                            entry.messages[0],
+                        )
+                        for entry in entries
+                    ]
+                    responses = await self._dpub_many(calls)
+            except (ConnectionError, OSError, AssertionError) as e:
+                logger.warning("{} retry buffer flush failed: {!r}".format(self, e))
+                buffer.requeue(entries)
+                self._connection_lost()
+                return
+            except asyncio.CancelledError:
+                buffer.requeue(entries)
+                if not self._is_working:
+                    buffer.fail_all(ConnectionError("writer closed"))
+                raise
+            for entry, resp in zip(entries, responses):
+                entry.future.done() or entry.future.set_result(resp)
+
+    async def _replay(self):
+        """publish the spool in order as MPUB, retried with backoff while
+        connected, restarted by connect() once reconnected"""
+        spool = self._spool
+        delays = retry_iterator(init_delay=0.1, max_delay=10.0, now=False)
+        try:
+            while self._is_working and not spool.empty and self._is_connected():
+                topic, bodies, position, dues = spool.peek(max_bytes=self.max_body_size)
+                try:
+                    if dues is None:
+                        responses = [await self._execute(MPUB, topic, data=bodies)]
+                    else:
+                        now = int(time.time() * 1000)
+                        responses = await self._dpub_many(
+                            [
+                                ((topic, max(0, due - now)), body)
+                                for body, due in zip(bodies, dues)
+                            ]
+                        )
+                    errors = [make_error(*r) for r in responses if isinstance(r, tuple)]
+                    error = errors[0] if errors else None
+                except (ConnectionError, OSError, AssertionError) as e:
+                    logger.warning("{} replay stopped: {!r}".format(self, e))
+                    self._connection_lost()
+                    return
+                except Exception as e:
+                    error = e
+                if isinstance(error, (NSQPubFailed, NSQMPubFailed, NSQDPubFailed)) or (
+                    error is not None and not isinstance(error, NSQErrorCode)
+                ):
+                    delay = next(delays)
+                    logger.error(
+                        "{} replay failed, retry in {:.2f}s: {!r}".format(
+                            self, delay, error
+                        )
+                    )
+                    await asyncio.sleep(delay, loop=self._loop)
+                    continue
+                if error is not None:
+                    # never accepted by nsqd, retrying would block the spool
+                    logger.error(
+                        "{} {} spooled messages to {} dropped: {!r}".format(
+                            self, len(bodies), topic, error
+                        )
+                    )
+                spool.commit(position)
+                delays = retry_iterator(init_delay=0.1, max_delay=10.0, now=False)
+            logger.info("{} spool replayed".format(self))
+        except asyncio.CancelledError:
+            logger.info("{} replay cancelled".format(self))
+
     @property
     def id(self):
         return self._conn.endpoint
@@ -232,23 +654,34 @@ class Writer:
     async def close(self, timeout=10):
         # time_in = time.time()
         self._is_working = False
-        self._conn.close()
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+        if self._spool is not None:
+            self._spool.flush()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        if self._retry_buffer is not None:
+            self._retry_buffer.fail_all(ConnectionError("writer closed"))
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
         self._status = CLOSED
-        try:
-            await self._conn.wait_for_closed()
-        except asyncio.TimeoutError:
-            logger.warning("closing current connection failed: timeout")
-
-        self._auto_reconnect_task.cancel()
-        try:
-            await asyncio.wait_for(
-                self._auto_reconnect_task_closed.wait(),
-                timeout=timeout,
-                loop=self._loop,
-            )
-        except asyncio.TimeoutError:
-            logger.warning("cancel auto_reconnect_task failed: timeout")
-        logger.info("auto_reconnect_task closed")
+        if self._conn is not None:
+            self._conn._on_close = None
+            self._conn.close()
+            try:
+                await self._conn.wait_for_closed(timeout)
+            except asyncio.TimeoutError:
+                logger.warning("closing current connection failed: timeout")
+        if self._reconnect_task is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.wait([self._reconnect_task], loop=self._loop),
+                    timeout=timeout,
+                    loop=self._loop,
+                )
+            except asyncio.TimeoutError:
+                logger.warning("cancel auto_reconnect failed: timeout")
+        logger.info("{} closed".format(self))
 
     # def close(self, timeout = 10):
     #     time_in = time.time()
@@ -270,3 +703,17 @@ class Writer:
 
     def __repr__(self):
         return "<Writer{}>".format(self._conn.__repr__())
+
+
+def _remaining(delay_time, created, now):
+    """delay in millisecond left of a DPUB delayed from ``created``"""
+    return max(0, delay_time - int((now - created) * 1000))
+
+
+async def _iterate(messages):
+    if hasattr(messages, "__aiter__"):
+        async for message in messages:
+            yield message
+    else:
+        for message in messages:
+            yield message
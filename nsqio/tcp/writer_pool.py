@@ -0,0 +1,285 @@
+from asyncio.events import AbstractEventLoop
+from typing import Optional
+
+import asyncio
+import random
+
+from nsqio.http import LookupdTopology
+from nsqio.tcp.consts import MPUB, PUB, DPUB, CONNECTED
+from nsqio.tcp.exceptions import (
+    NSQNoConnections,
+    NSQPutFailed,
+    NSQPubFailed,
+    NSQMPubFailed,
+    make_error,
+)
+from nsqio.tcp.writer import Writer
+from nsqio.utils import get_logger, get_host_and_port, retry_iterator
+
+__all__ = ["WriterPool", "create_writer_pool"]
+
+logger = get_logger()
+
+# nsqd errors worth trying on another node, the others are about the
+# publish itself: bad topic, bad body...
+RETRIABLE_ERRORS = (NSQPutFailed, NSQPubFailed, NSQMPubFailed)
+
+
+async def create_writer_pool(
+    nsqd_tcp_addresses=None, loop=None, lookupd_http_addresses=None, **kwargs
+):
+    """
+    initial function to get a producer publishing to many nsqd
+    param: nsqd_tcp_addresses: tcp addrs with no protocol.
+        such as ['127.0.0.1:4150','182.168.1.1:4150']
+    param: lookupd_http_addresses: discover the nsqd from lookupd too
+    param: max_retries: number of other nsqd a failed publish is retried on
+    param: eject_errors: consecutive errors before a nsqd is ejected
+    param: lookupd_poll_interval: seconds between lookupd polls
+    other params are passed to every Writer
+    """
+    loop = loop or asyncio.get_event_loop()
+    if nsqd_tcp_addresses is None and not lookupd_http_addresses:
+        nsqd_tcp_addresses = ["127.0.0.1:4150"]
+    nsqd_tcp_addresses = [get_host_and_port(i) for i in nsqd_tcp_addresses or []]
+    pool = WriterPool(
+        nsqd_tcp_addresses=nsqd_tcp_addresses,
+        lookupd_http_addresses=lookupd_http_addresses,
+        loop=loop,
+        **kwargs,
+    )
+    await pool.connect()
+    return pool
+
+
+class WriterPool:
+    """
+    NSQ tcp producer over several nsqd
+
+    Every publish goes to the connected nsqd with the fewest responses
+    pending, and is retried on other nsqd if it fails there. A nsqd failing
+    ``eject_errors`` times in a row is ejected from the pool and reconnected
+    in background until it is back.
+
+    As with Writer, an error response of nsqd is returned as a
+    ``(code, message)`` tuple, after the retries for E_PUB_FAILED and the
+    like; a publish raises only when no nsqd could be reached, with the
+    error of the last one tried.
+    """
+
+    def __init__(
+        self,
+        nsqd_tcp_addresses=None,
+        lookupd_http_addresses=None,
+        loop: Optional[AbstractEventLoop] = None,
+        max_retries: int = 2,
+        eject_errors: int = 3,
+        lookupd_poll_interval: float = 30,
+        lookupd_timeout: float = 5,
+        **writer_kwargs,
+    ):
+        self._loop: AbstractEventLoop = loop or asyncio.get_event_loop()
+        self._nsqd_tcp_addresses = [
+            (host, int(port)) for host, port in nsqd_tcp_addresses or []
+        ]
+        self._max_retries = max_retries
+        self._eject_errors = eject_errors
+        self._lookupd_poll_interval = lookupd_poll_interval
+        self._writer_kwargs = writer_kwargs
+        self._topology = None
+        if lookupd_http_addresses:
+            self._topology = LookupdTopology(
+                lookupd_http_addresses, loop=self._loop, timeout=lookupd_timeout
+            )
+        # "tcp://host:port" -> Writer, consecutive errors and probe tasks
+        self._writers = {}
+        self._errors = {}
+        self._probes = {}
+        self._next = 0
+        self._poll_lookupd_task = None
+        self._is_closed = False
+
+    def _nsqd_id(self, host, port):
+        return "tcp://{}:{}".format(host, port)
+
+    async def connect(self):
+        await self._add_nsqds(self._nsqd_tcp_addresses)
+        if self._topology is not None:
+            await self._add_nsqds(await self._topology.poll(None))
+            self._poll_lookupd_task = self._loop.create_task(self._poll_lookupd())
+
+    async def _add_nsqds(self, addresses):
+        new = []
+        for host, port in addresses:
+            nsqd_id = self._nsqd_id(host, port)
+            if nsqd_id in self._writers:
+                continue
+            writer = Writer(host, port, loop=self._loop, **self._writer_kwargs)
+            self._writers[nsqd_id] = writer
+            self._errors[nsqd_id] = 0
+            new.append(writer)
+        # Writer.connect logs and never raises, it reconnects in background
+        await asyncio.gather(*[w.connect() for w in new], loop=self._loop)
+
+    async def _remove_nsqd(self, nsqd_id):
+        writer = self._writers.pop(nsqd_id)
+        self._errors.pop(nsqd_id, None)
+        probe = self._probes.pop(nsqd_id, None)
+        if probe is not None:
+            probe.cancel()
+        await self._close_writer(writer)
+
+    async def _poll_lookupd(self):
+        try:
+            while not self._is_closed:
+                await asyncio.sleep(
+                    self._lookupd_poll_interval * random.uniform(0.7, 1.3),
+                    loop=self._loop,
+                )
+                producers = await self._topology.poll(None)
+                if not producers:
+                    continue
+                await self._add_nsqds(producers)
+                static = set(self._nsqd_id(h, p) for h, p in self._nsqd_tcp_addresses)
+                wanted = static | set(self._nsqd_id(h, p) for h, p in producers)
+                for nsqd_id in list(self._writers):
+                    if nsqd_id not in wanted:
+                        logger.info("{} left lookupd, removed".format(nsqd_id))
+                        await self._remove_nsqd(nsqd_id)
+        except asyncio.CancelledError:
+            logger.info("{} _poll_lookupd cancelled".format(self))
+
+    def _is_healthy(self, nsqd_id, writer):
+        return (
+            nsqd_id not in self._probes
+            and writer._status == CONNECTED
+            and writer._conn is not None
+            and not writer._conn.closed
+        )
+
+    def _pick(self, exclude) -> "Optional[str]":
+        """nsqd with the fewest pending responses, ties in turn"""
+        ids = list(self._writers)
+        if not ids:
+            return None
+        self._next = (self._next + 1) % len(ids)
+        chosen, chosen_pending = None, None
+        for nsqd_id in ids[self._next :] + ids[: self._next]:
+            writer = self._writers[nsqd_id]
+            if nsqd_id in exclude or not self._is_healthy(nsqd_id, writer):
+                continue
+            pending = len(writer._conn._cmd_waiters)
+            if chosen is None or pending < chosen_pending:
+                chosen, chosen_pending = nsqd_id, pending
+        return chosen
+
+    @property
+    def nodes(self):
+        """state of every nsqd of the pool"""
+        return {
+            nsqd_id: {
+                "healthy": self._is_healthy(nsqd_id, writer),
+                "ejected": nsqd_id in self._probes,
+                "pending": len(writer._conn._cmd_waiters) if writer._conn else 0,
+                "errors": self._errors.get(nsqd_id, 0),
+            }
+            for nsqd_id, writer in self._writers.items()
+        }
+
+    async def execute(self, command, *args, data=None):
+        """Execute ``command`` on a nsqd, retried on others on failure."""
+        return await self._execute(self._pick, command, *args, data=data)
+
+    async def _execute(self, pick, command, *args, data=None):
+        """execute on ``pick(exclude)``, then on the next picks on failure"""
+        tried, last_error, last_resp = set(), None, None
+        for _ in range(1 + self._max_retries):
+            nsqd_id = pick(tried)
+            if nsqd_id is None:
+                break
+            tried.add(nsqd_id)
+            writer = self._writers[nsqd_id]
+            try:
+                resp = await writer.execute(command, *args, data=data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error, last_resp = e, None
+            else:
+                if not isinstance(resp, tuple):
+                    self._errors[nsqd_id] = 0
+                    return resp
+                last_error, last_resp = make_error(*resp), resp
+                if not isinstance(last_error, RETRIABLE_ERRORS):
+                    return resp
+            logger.warning("{} on {} failed: {!r}".format(command, nsqd_id, last_error))
+            self._failed(nsqd_id)
+        if last_resp is not None:
+            return last_resp
+        if last_error is None:
+            raise NSQNoConnections("no nsqd available")
+        raise last_error
+
+    def _failed(self, nsqd_id):
+        if nsqd_id not in self._writers:
+            return
+        self._errors[nsqd_id] += 1
+        if self._errors[nsqd_id] >= self._eject_errors and nsqd_id not in self._probes:
+            logger.warning("{} ejected".format(nsqd_id))
+            self._probes[nsqd_id] = self._loop.create_task(self._probe(nsqd_id))
+
+    async def _probe(self, nsqd_id):
+        """reconnect an ejected nsqd until it is back"""
+        writer = self._writers[nsqd_id]
+        delays = retry_iterator(init_delay=0.2, max_delay=30.0, now=False)
+        try:
+            while not self._is_closed:
+                await asyncio.sleep(next(delays), loop=self._loop)
+                try:
+                    await writer.reconnect()
+                except Exception as e:
+                    logger.info("probe {} failed: {!r}".format(nsqd_id, e))
+                    continue
+                if writer._status == CONNECTED:
+                    logger.info("{} back in the pool".format(nsqd_id))
+                    self._errors[nsqd_id] = 0
+                    self._probes.pop(nsqd_id, None)
+                    return
+        except asyncio.CancelledError:
+            logger.info("probe {} cancelled".format(nsqd_id))
+
+    async def pub(self, topic, message):
+        return await self.execute(PUB, topic, data=message)
+
+    async def dpub(self, topic, delay_time, message):
+        """
+        :param delay_time: delayed time in millisecond
+        """
+        if not delay_time or delay_time is None:
+            delay_time = 0
+        return await self.execute(DPUB, topic, delay_time, data=message)
+
+    async def mpub(self, topic, *messages):
+        return await self.execute(MPUB, topic, data=list(messages))
+
+    async def _close_writer(self, writer: Writer):
+        try:
+            await writer.close()
+        except Exception as e:
+            logger.error("close {} failed: {}".format(writer, e))
+
+    async def close(self):
+        self._is_closed = True
+        tasks = list(self._probes.values())
+        if self._poll_lookupd_task is not None:
+            tasks.append(self._poll_lookupd_task)
+        for task in tasks:
+            task.cancel()
+        writers, self._writers = list(self._writers.values()), {}
+        self._probes = {}
+        await asyncio.gather(*[self._close_writer(w) for w in writers], loop=self._loop)
+        if self._topology is not None:
+            await self._topology.close()
+
+    def __repr__(self):
+        return "<WriterPool{}>".format(",".join(self._writers))
@@ -1,7 +1,13 @@
 import asyncio
+import struct
 import unittest
 from functools import wraps
 
+# commands with a body after their line
+_BODY_COMMANDS = (b"IDENTIFY", b"AUTH", b"PUB", b"MPUB", b"DPUB")
+# commands nsqd sends no response to
+_NO_RESPONSE = (b"RDY", b"FIN", b"REQ", b"TOUCH", b"NOP")
+
 
 def run_until_complete(fun):
     if not asyncio.iscoroutinefunction(fun):
@@ -28,3 +34,56 @@ class BaseTest(unittest.TestCase):
         pass
         # self.loop.close()
         # del self.loop
+
+
+class FakeNsqd:
+    """Local tcp server speaking enough of nsqd for a Writer.
+
+    Every command is answered OK, the connection is closed on receiving
+    one of ``drop_on`` and ``ignore`` commands are left without response.
+    """
+
+    def __init__(self, loop, drop_on=(), ignore=()):
+        self.loop = loop
+        self.drop_on = drop_on
+        self.ignore = ignore
+        self.commands = []
+        self.port = None
+        self._server = None
+        self._writers = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, "127.0.0.1", 0, loop=self.loop
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, reader, writer):
+        self._writers.append(writer)
+        try:
+            await reader.readexactly(4)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.split()[0]
+                if command in _BODY_COMMANDS:
+                    (size,) = struct.unpack(">l", await reader.readexactly(4))
+                    await reader.readexactly(size)
+                self.commands.append(command)
+                if command in self.drop_on:
+                    break
+                if command in _NO_RESPONSE or command in self.ignore:
+                    continue
+                writer.write(struct.pack(">ll", 6, 0) + b"OK")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        self._server.close()
+        for writer in self._writers:
+            writer.close()
+        await self._server.wait_closed()
@@ -0,0 +1,62 @@
+import unittest
+from array import array
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.batch import MessageBatch, numpy
+from nsqio.tcp.consts import FIN, REQ
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commands = []
+
+    def execute_many(self, command, args_list):
+        self.commands.append((command, list(args_list)))
+
+
+def _batch(conn, num=4):
+    ids = bytearray(b"".join(b"%016d" % i for i in range(num)))
+    bodies = bytearray(b"".join(b"body%d" % i for i in range(num)))
+    offsets = array("q", [5 * i for i in range(num + 1)])
+    return MessageBatch(
+        array("q", range(num)), array("h", [1] * num), ids, bodies, offsets, conn
+    )
+
+
+class MessageBatchTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.conn = FakeConnection()
+        self.batch = _batch(self.conn)
+        self.processed = []
+        self.batch._processed_hook = lambda b, count, requeued: self.processed.append(
+            (count, requeued)
+        )
+
+    def test_columns(self):
+        self.assertEqual(len(self.batch), 4)
+        self.assertEqual(self.batch.message_id(2), b"0000000000000002")
+        self.assertEqual(bytes(self.batch.body(3)), b"body3")
+
+    @run_until_complete
+    async def test_fin_and_req_ranges(self):
+        self.assertEqual(await self.batch.fin(0, 2), 2)
+        self.assertEqual(await self.batch.req(1, None, timeout=0), 2)
+        self.assertEqual(await self.batch.fin(), 0)
+        self.assertTrue(self.batch.processed)
+        self.assertEqual(
+            self.conn.commands,
+            [
+                (FIN, [(b"0000000000000000",), (b"0000000000000001",)]),
+                (REQ, [(b"0000000000000002", 0), (b"0000000000000003", 0)]),
+            ],
+        )
+        self.assertEqual(self.processed, [(2, False), (2, True)])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_views(self):
+        columns = self.batch.as_numpy()
+        self.assertEqual(list(columns["timestamps"]), [0, 1, 2, 3])
+        self.assertEqual(columns["ids"][1], b"0000000000000001")
+        self.batch.bodies[0:1] = b"B"
+        self.assertEqual(columns["bodies"][0], ord("B"))
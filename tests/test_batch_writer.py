@@ -0,0 +1,61 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.batch_writer import BatchingWriter
+from nsqio.tcp.exceptions import NSQMPubFailed
+
+
+class FakeWriter:
+    def __init__(self, response=b"OK"):
+        self.response = response
+        self.mpubs = []
+
+    async def mpub(self, topic, *messages):
+        self.mpubs.append((topic, list(messages)))
+        return self.response
+
+
+class BatchingWriterTest(BaseTest):
+    @run_until_complete
+    async def test_coalesce_by_count(self):
+        writer = FakeWriter()
+        batcher = BatchingWriter(writer, max_count=10, linger=0.01, loop=self.loop)
+        results = await asyncio.gather(
+            *[batcher.pub("foo", "msg{}".format(i)) for i in range(25)],
+            loop=self.loop,
+            return_exceptions=True,
+        )
+        # the last 5 are sent after linger
+        self.assertEqual(results, [b"OK"] * 25)
+        self.assertEqual([len(m) for _, m in writer.mpubs], [10, 10, 5])
+
+    @run_until_complete
+    async def test_linger_and_topics(self):
+        writer = FakeWriter()
+        batcher = BatchingWriter(writer, linger=0.01, loop=self.loop)
+        futs = [batcher.publish("foo", b"a"), batcher.publish("bar", b"b")]
+        futs.append(batcher.publish("foo", b"c"))
+        self.assertEqual(writer.mpubs, [])
+        await asyncio.sleep(0.05, loop=self.loop)
+        self.assertTrue(all(f.done() for f in futs))
+        self.assertEqual(sorted(writer.mpubs), [("bar", [b"b"]), ("foo", [b"a", b"c"])])
+
+    @run_until_complete
+    async def test_max_bytes(self):
+        writer = FakeWriter()
+        batcher = BatchingWriter(
+            writer, max_bytes=4 + 2 * 14, linger=10, loop=self.loop
+        )
+        for _ in range(5):
+            batcher.publish("foo", b"x" * 10)
+        await batcher.flush()
+        self.assertEqual([len(m) for _, m in writer.mpubs], [2, 2, 1])
+
+    @run_until_complete
+    async def test_error_fails_every_caller(self):
+        writer = FakeWriter((b"E_MPUB_FAILED", b"failed"))
+        batcher = BatchingWriter(writer, loop=self.loop)
+        futs = [batcher.publish("foo", b"x") for _ in range(3)]
+        await batcher.flush()
+        for fut in futs:
+            self.assertIsInstance(fut.exception(), NSQMPubFailed)
@@ -0,0 +1,38 @@
+import unittest
+from nsqio.tcp.dedup import DedupCache
+
+
+class DedupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = DedupCache(capacity=3, ttl=10, time_func=lambda: self.now)
+
+    def test_states(self):
+        self.assertIsNone(self.cache.received(b"a"))
+        self.assertFalse(self.cache.received(b"a"))
+        self.cache.finished(b"a")
+        self.assertTrue(self.cache.received(b"a"))
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_requeued_is_forgotten(self):
+        self.cache.received(b"a")
+        self.cache.forget(b"a")
+        self.assertIsNone(self.cache.received(b"a"))
+
+    def test_capacity_evicts_least_recently_seen(self):
+        for message_id in (b"a", b"b", b"c"):
+            self.cache.received(message_id)
+        self.cache.received(b"a")
+        self.cache.received(b"d")
+        self.assertEqual(len(self.cache), 3)
+        self.assertNotIn(b"b", self.cache)
+        self.assertIn(b"a", self.cache)
+
+    def test_ttl(self):
+        self.cache.received(b"a")
+        self.now = 5
+        self.cache.received(b"b")
+        self.now = 12
+        self.assertIsNone(self.cache.received(b"c"))
+        self.assertNotIn(b"a", self.cache)
+        self.assertIn(b"b", self.cache)
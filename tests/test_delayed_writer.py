@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.delayed_writer import DelayedWriter
+from nsqio.tcp.exceptions import NSQBadTopic
+
+
+class FakeWriter:
+    def __init__(self):
+        self.writes = []
+
+    async def dpub_many(self, items):
+        self.writes.append(list(items))
+        return [
+            (b"E_BAD_TOPIC", b"bad topic") if topic == "bad" else b"OK"
+            for topic, _, _ in items
+        ]
+
+
+class DelayedWriterTest(BaseTest):
+    @run_until_complete
+    async def test_one_write_per_flush(self):
+        writer = FakeWriter()
+        delayed = DelayedWriter(writer, max_count=10, linger=0.01, loop=self.loop)
+        futs = [delayed.publish("foo", b"x", 1000 * (i % 3)) for i in range(25)]
+        await asyncio.wait(futs, loop=self.loop)
+        self.assertEqual([len(w) for w in writer.writes], [10, 10, 5])
+        self.assertTrue(all(f.result() == b"OK" for f in futs))
+        # grouped by delay
+        delays = [delay for _, delay, _ in writer.writes[0]]
+        self.assertEqual(len(list(itertools.groupby(delays))), 3)
+
+    @run_until_complete
+    async def test_error_response(self):
+        writer = FakeWriter()
+        delayed = DelayedWriter(writer, loop=self.loop)
+        ok = delayed.publish("foo", b"x", 100)
+        bad = delayed.publish("bad", b"x", 100)
+        await delayed.flush()
+        self.assertEqual(len(writer.writes), 1)
+        self.assertEqual(ok.result(), b"OK")
+        self.assertIsInstance(bad.exception(), NSQBadTopic)
+
+    @run_until_complete
+    async def test_hold_long_delays(self):
+        writer = FakeWriter()
+        delayed = DelayedWriter(writer, linger=0.001, hold_after=20, loop=self.loop)
+        short = delayed.publish("foo", b"short", 10)
+        long = delayed.publish("foo", b"long", 60)
+        self.assertEqual(delayed.held, 1)
+        await asyncio.wait_for(short, 1, loop=self.loop)
+        [(topic, delay, body)] = writer.writes[0]
+        # shortened by the time it lingered
+        self.assertEqual(body, b"short")
+        self.assertLessEqual(delay, 10)
+
+        await asyncio.wait_for(long, 1, loop=self.loop)
+        self.assertEqual(delayed.held, 0)
+        topic, delay, body = writer.writes[1][0]
+        self.assertEqual(body, b"long")
+        self.assertLessEqual(delay, 20)
+
+    @run_until_complete
+    async def test_close_drops_held(self):
+        writer = FakeWriter()
+        delayed = DelayedWriter(writer, hold_after=1000, loop=self.loop)
+        fut = delayed.publish("foo", b"x", 3600 * 1000)
+        await delayed.close()
+        self.assertTrue(fut.cancelled())
+        self.assertEqual(writer.writes, [])
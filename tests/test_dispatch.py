@@ -0,0 +1,133 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.dispatch import KeyedDispatcher
+
+
+class FakeConnection:
+    id = "tcp://127.0.0.1:4150"
+
+
+class FakeMessage:
+    conn = FakeConnection()
+
+    def __init__(self, key, seq):
+        self.key = key
+        self.seq = seq
+        self.processed = False
+        self.finished = False
+        self.requeued = None
+
+    async def fin(self):
+        self.processed = self.finished = True
+
+    async def req(self, timeout=10):
+        self.processed = True
+        self.requeued = timeout
+
+
+class FakeReader:
+    def __init__(self, loop, messages, max_in_flight=100):
+        self._loop = loop
+        self._messages = messages
+        self.max_in_flight = max_in_flight
+        # RDY held per conn_id, and every hold and release
+        self.held = set()
+        self.rdy_changes = []
+
+    def hold_rdy(self, conn_id):
+        self.held.add(conn_id)
+        self.rdy_changes.append(("hold", conn_id))
+
+    def release_rdy(self, conn_id):
+        self.held.discard(conn_id)
+        self.rdy_changes.append(("release", conn_id))
+
+    async def messages(self):
+        for msg in self._messages:
+            yield msg
+            await asyncio.sleep(0, loop=self._loop)
+
+
+class KeyedDispatcherTest(BaseTest):
+    @run_until_complete
+    async def test_ordered_per_key_parallel_across_keys(self):
+        msgs = [FakeMessage("k{}".format(i % 4), i) for i in range(40)]
+        handled, running, max_running = {}, [0], [0]
+
+        async def handler(msg):
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            await asyncio.sleep(0.001, loop=self.loop)
+            handled.setdefault(msg.key, []).append(msg.seq)
+            running[0] -= 1
+            if msg.seq == 5:
+                raise ValueError("fail")
+
+        reader = FakeReader(self.loop, msgs)
+        dispatcher = KeyedDispatcher(
+            reader, handler, lambda m: m.key, lanes=16, lane_capacity=40
+        )
+        await dispatcher.run()
+
+        for key, seqs in handled.items():
+            self.assertEqual(seqs, sorted(seqs))
+        self.assertGreater(max_running[0], 1)
+        self.assertEqual(msgs[5].requeued, 0)
+        self.assertTrue(all(m.finished for m in msgs if m.seq != 5))
+
+    @run_until_complete
+    async def test_hot_key_backpressure_keeps_order(self):
+        msgs = [FakeMessage("hot", i) for i in range(20)]
+        msgs.append(FakeMessage("cold", 20))
+        handled, held_while_full = [], []
+
+        async def handler(msg):
+            held_while_full.append(bool(reader.held))
+            await asyncio.sleep(0.005, loop=self.loop)
+            handled.append(msg.seq)
+
+        reader = FakeReader(self.loop, msgs, max_in_flight=8)
+        dispatcher = KeyedDispatcher(reader, handler, lambda m: m.key, lanes=2)
+        self.assertEqual(dispatcher.lane_capacity, 4)
+        await dispatcher.run()
+
+        self.assertGreater(dispatcher.overflows, 0)
+        self.assertEqual([s for s in handled if s < 20], list(range(20)))
+        # nothing requeued, RDY held while the lane was full then released
+        self.assertTrue(all(m.finished for m in msgs))
+        self.assertTrue(any(held_while_full))
+        self.assertEqual(
+            reader.rdy_changes.count(("hold", FakeConnection.id)),
+            reader.rdy_changes.count(("release", FakeConnection.id)),
+        )
+        self.assertEqual(reader.held, set())
+
+    @run_until_complete
+    async def test_cold_key_flows_while_hot_lane_full(self):
+        msgs = [FakeMessage("hot", i) for i in range(10)]
+        msgs += [FakeMessage("cold", i) for i in range(10, 20)]
+        hot_blocked = asyncio.Event(loop=self.loop)
+        handled = []
+
+        async def handler(msg):
+            if msg.key == "hot":
+                await hot_blocked.wait()
+            handled.append(msg.seq)
+            if msg.seq == 19:
+                # every cold message handled while the hot lane is stuck
+                self.assertTrue(reader.held)
+                self.assertGreater(dispatcher.lane_depths()[hot_lane], 2)
+                hot_blocked.set()
+
+        reader = FakeReader(self.loop, msgs)
+        dispatcher = KeyedDispatcher(
+            reader, handler, lambda m: m.key, lanes=2, lane_capacity=2
+        )
+        hot_lane = dispatcher._lane_of(msgs[0])
+        self.assertNotEqual(hot_lane, dispatcher._lane_of(msgs[-1]))
+        await asyncio.wait_for(dispatcher.run(), 5, loop=self.loop)
+
+        self.assertEqual(handled[:10], list(range(10, 20)))
+        self.assertEqual(handled[10:], list(range(10)))
+        self.assertEqual(reader.held, set())
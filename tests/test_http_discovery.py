@@ -0,0 +1,74 @@
+from ._testutils import run_until_complete, BaseTest
+from nsqio.http.discovery import LookupdTopology
+from nsqio.http.lookupd import NsqLookupd
+from nsqio.http.writer import NsqdHttpWriter
+
+
+class FakeLookupdTopology(LookupdTopology):
+    """Answers lookups from a dict instead of http."""
+
+    def __init__(self, responses, **kwargs):
+        super().__init__(list(responses.keys()), **kwargs)
+        self.responses = responses
+
+    async def _lookup(self, host, port, topic):
+        res = self.responses[(host, port)]
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+
+def _producer(host, port):
+    return {"broadcast_address": host, "tcp_port": port}
+
+
+class LookupdTopologyTest(BaseTest):
+    @run_until_complete
+    async def test_merge_and_dedup(self):
+        topology = FakeLookupdTopology(
+            {
+                ("lookupd1", 4161): {
+                    "producers": [_producer("a", 4150), _producer("b", 4150)]
+                },
+                ("lookupd2", 4161): {
+                    "producers": [_producer("b", 4150), _producer("c", 4150)]
+                },
+                ("lookupd3", 4161): ConnectionError("partitioned"),
+            },
+            loop=self.loop,
+        )
+        producers = await topology.poll("foo")
+        self.assertEqual(sorted(producers), [("a", 4150), ("b", 4150), ("c", 4150)])
+        self.assertEqual(sorted(topology.producers("foo")), sorted(producers))
+        self.assertIsNotNone(topology.updated_at("foo"))
+
+    @run_until_complete
+    async def test_keep_cache_when_all_fail(self):
+        responses = {("lookupd1", 4161): {"producers": [_producer("a", 4150)]}}
+        topology = FakeLookupdTopology(responses, loop=self.loop)
+        await topology.poll("foo")
+        responses[("lookupd1", 4161)] = ConnectionError("down")
+        self.assertEqual(await topology.poll("foo"), [("a", 4150)])
+        self.assertEqual(topology.producers("bar"), [])
+
+
+class SharedSessionTest(BaseTest):
+    @run_until_complete
+    async def test_clients_share_session(self):
+        lookupd = NsqLookupd("127.0.0.1", 4161, loop=self.loop, shared_session=True)
+        writer = NsqdHttpWriter("127.0.0.1", 4151, loop=self.loop, shared_session=True)
+        self.assertIs(lookupd._session, writer._session)
+        session = lookupd._session
+
+        await lookupd.close()
+        self.assertFalse(session.closed)
+        await writer.close()
+        self.assertTrue(session.closed)
+
+    @run_until_complete
+    async def test_topology_keeps_clients(self):
+        topology = LookupdTopology([("127.0.0.1", 4161)], loop=self.loop)
+        client = topology._client("127.0.0.1", 4161)
+        self.assertIs(topology._client("127.0.0.1", 4161), client)
+        await topology.close()
+        self.assertTrue(client._session.closed)
@@ -0,0 +1,65 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.multi_reader import MultiReader, _Subscription
+
+
+class FakeReader:
+    def __init__(self, loop):
+        self._queue = asyncio.Queue(loop=loop)
+        self.max_in_flight = None
+
+    def update_max_in_flight(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+
+
+class MultiReaderTest(BaseTest):
+    def _multi_reader(self, weights, max_in_flight=40):
+        multi = MultiReader(max_in_flight=max_in_flight, loop=self.loop)
+        for topic, weight in weights.items():
+            reader = FakeReader(self.loop)
+            multi._subscriptions[(topic, "ch")] = _Subscription(reader, weight)
+        multi._rebalance()
+        return multi
+
+    def test_budget_split_by_weight(self):
+        multi = self._multi_reader({"a": 3, "b": 1})
+        self.assertEqual(multi.readers[("a", "ch")].max_in_flight, 30)
+        self.assertEqual(multi.readers[("b", "ch")].max_in_flight, 10)
+
+        multi.update_max_in_flight(4)
+        self.assertEqual(multi.readers[("b", "ch")].max_in_flight, 1)
+
+    @run_until_complete
+    async def test_weighted_interleaving(self):
+        multi = self._multi_reader({"a": 3, "b": 1})
+        for topic, reader in multi.readers.items():
+            for i in range(100):
+                reader._queue.put_nowait(topic[0])
+
+        received = []
+        async for msg in multi.messages():
+            received.append(msg)
+            if len(received) == 40:
+                break
+        self.assertEqual(received.count("a"), 30)
+        self.assertEqual(received.count("b"), 10)
+
+    @run_until_complete
+    async def test_idle_subscription_banks_no_credit(self):
+        multi = self._multi_reader({"a": 1, "b": 1})
+        queue_a = multi.readers[("a", "ch")]._queue
+        queue_b = multi.readers[("b", "ch")]._queue
+        for i in range(20):
+            queue_a.put_nowait("a")
+
+        received = []
+        async for msg in multi.messages():
+            received.append(msg)
+            if len(received) == 10:
+                for i in range(20):
+                    queue_b.put_nowait("b")
+            if len(received) == 20:
+                break
+        # b gets its fair half once busy, not the 10 it missed
+        self.assertEqual(received[10:].count("b"), 5)
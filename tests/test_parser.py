@@ -83,6 +83,31 @@ class ParserTest(unittest.TestCase):
         self.assertEqual(b"E_BAD_TOPIC", code)
         self.assertEqual(b'PUB topic name "fo/o" is not valid', msg)
 
+    def test_gets_messages(self):
+        msg = (
+            b"\x00\x00\x00&\x00\x00\x00\x02\x13\x8c4\xcd\x01x~\x83"
+            b"\x00\x0106f6cbf50539f004test_msg"
+        )
+        heartbeat = b"\x00\x00\x00\x0f\x00\x00\x00\x00_heartbeat_"
+        self.parser.feed(msg * 3 + heartbeat + msg[:10])
+
+        timestamps, attempts, ids, bodies, offsets = self.parser.gets_messages(2)
+        self.assertEqual(list(timestamps), [1408558838557736579] * 2)
+        self.assertEqual(list(attempts), [1, 1])
+        self.assertEqual(bytes(ids), b"06f6cbf50539f004" * 2)
+        self.assertEqual(bytes(bodies), b"test_msg" * 2)
+        self.assertEqual(list(offsets), [0, 8, 16])
+
+        _, _, _, bodies, _ = self.parser.gets_messages()
+        self.assertEqual(bytes(bodies), b"test_msg")
+        # stops at the heartbeat, left to gets()
+        self.assertIsNone(self.parser.gets_messages())
+        self.assertEqual(self.parser.gets(), (0, b"_heartbeat_"))
+        # incomplete frame
+        self.assertIsNone(self.parser.gets_messages())
+        self.parser.feed(msg[10:])
+        self.assertEqual(len(self.parser.gets_messages()[0]), 1)
+
     # def test_protocol_error(self):
     #     ok_raw = b'\x00\x00\x00\x06\x00\x00\x00\x03OK'
     #     self.parser.feed(ok_raw)
@@ -0,0 +1,316 @@
+import asyncio
+import time
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.consts import CLS, FIN, RDY, REQ, SUB
+from nsqio.tcp.messages import NsqMessage
+from nsqio.tcp.reader import Reader
+
+
+class FakeConnection:
+    """Stand-in for TcpConnection that records the commands sent."""
+
+    def __init__(self, id, loop):
+        self.id = id
+        self.closed = False
+        self.in_flight = 0
+        self.rdy = 0
+        self.last_rdy = 0
+        self._last_message = 0
+        self._on_rdy_changed_cb = None
+        self._loop = loop
+        self._on_close = asyncio.Event(loop=loop)
+        self.commands = []
+        self.requeued = []
+        # commands never acked
+        self.stalled = set()
+
+    def execute(self, command, *args):
+        self.commands.append((command,) + args)
+        if command == RDY:
+            self.rdy = self.last_rdy = args[0]
+        elif command in (FIN, REQ):
+            self.in_flight -= 1
+        fut = self._loop.create_future()
+        if command not in self.stalled:
+            fut.set_result(b"OK")
+        return fut
+
+    def execute_many(self, command, args_list):
+        assert command == REQ
+        self.requeued.append([args[0] for args in args_list])
+        self.in_flight -= len(args_list)
+
+    def deliver(self, reader, message_id):
+        self.in_flight += 1
+        msg = NsqMessage(0, 1, message_id, b"body", self)
+        reader._queue.put_nowait(reader._on_message(self, msg))
+        return msg
+
+    def close(self):
+        self.closed = True
+        self._on_close.set()
+
+    async def wait_for_closed(self, timeout=10):
+        await asyncio.wait_for(self._on_close.wait(), timeout, loop=self._loop)
+
+
+class FakeReader(Reader):
+    """Reader opening FakeConnection, nsqd answer after ``delays`` seconds."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delays = {}
+        self.refused = set()
+        # the open of an nsqd returns once its gate is set
+        self.gates = {}
+        self.conns = []
+        self.opening = 0
+        self.max_opening = 0
+        self.reconnect_delays = []
+        # reconnect delays are slept this much shorter
+        self.time_scale = 0.001
+
+    def _reconnect_delays(self, now=True):
+        for delay in super()._reconnect_delays(now):
+            self.reconnect_delays.append(delay)
+            yield delay * self.time_scale
+
+    async def _open_conn(self, host, port):
+        self.opening += 1
+        self.max_opening = max(self.max_opening, self.opening)
+        try:
+            await asyncio.sleep(self.delays.get((host, port), 0), loop=self._loop)
+            if (host, port) in self.refused:
+                raise ConnectionRefusedError("{}:{} refused".format(host, port))
+            conn = FakeConnection(self._nsqd_id(host, port), self._loop)
+            if self._is_subscribe:
+                await self._sub_conn(conn)
+            if (host, port) in self.gates:
+                await self.gates[(host, port)].wait()
+        finally:
+            self.opening -= 1
+        self.conns.append(conn)
+        return conn
+
+
+class ReaderConnectTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.addresses = [("127.0.0.1", 4150 + i) for i in range(5)]
+
+    def _reader(self, **kwargs):
+        self.reader = FakeReader(
+            nsqd_tcp_addresses=self.addresses, loop=self.loop, **kwargs
+        )
+        return self.reader
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.reader.close(timeout=0))
+        super().tearDown()
+
+    @run_until_complete
+    async def test_concurrency_limited(self):
+        reader = self._reader(connect_concurrency=2)
+        for address in self.addresses:
+            reader.delays[address] = 0.02
+        num = await reader._connect_nsqds(self.addresses)
+        self.assertEqual(num, 5)
+        self.assertEqual(reader.max_opening, 2)
+        self.assertEqual(len(reader._rdy_control.connections), 5)
+
+    @run_until_complete
+    async def test_timeout_per_node(self):
+        reader = self._reader(connect_timeout=0.05)
+        slow = self.addresses[0]
+        reader.delays[slow] = 10
+        start = time.time()
+        num = await reader._connect_nsqds(self.addresses)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(num, 4)
+        stats = reader.nsqd_stats[reader._nsqd_id(*slow)]
+        self.assertFalse(stats["connected"])
+        self.assertIn("TimeoutError", stats["last_error"])
+        # retried in background
+        self.assertIn(reader._nsqd_id(*slow), reader._supervisors)
+
+    @run_until_complete
+    async def test_failing_node_does_not_block_others(self):
+        reader = self._reader(connect_concurrency=1, connect_timeout=1)
+        refused = self.addresses[0]
+        reader.refused.add(refused)
+        num = await reader._connect_nsqds(self.addresses)
+        self.assertEqual(num, 4)
+        self.assertNotIn(reader._nsqd_id(*refused), reader._rdy_control.connections)
+        for address in self.addresses[1:]:
+            self.assertTrue(reader.nsqd_stats[reader._nsqd_id(*address)]["connected"])
+        stats = reader.nsqd_stats[reader._nsqd_id(*refused)]
+        self.assertIn("ConnectionRefusedError", stats["last_error"])
+
+    @run_until_complete
+    async def test_added_during_subscribe_gets_sub(self):
+        self.addresses = self.addresses[:2]
+        reader = self._reader()
+        late = self.addresses[1]
+        reader.gates[late] = asyncio.Event(loop=self.loop)
+        connecting = self.loop.create_task(reader._connect_nsqds(self.addresses))
+        while len(reader._rdy_control.connections) < 1:
+            await asyncio.sleep(0)
+        # the late nsqd answered before subscribe() but is not listed yet
+        await reader.subscribe("topic", "channel")
+        reader.gates[late].set()
+        self.assertEqual(await connecting, 2)
+        for conn in reader.conns:
+            subs = [cmd for cmd in conn.commands if cmd[0] == SUB]
+            self.assertEqual(subs, [(SUB, "topic", "channel")])
+
+
+class ReaderSupervisorTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.address = ("127.0.0.1", 4150)
+        self.nsqd_id = "tcp://127.0.0.1:4150"
+        self.reader = FakeReader(nsqd_tcp_addresses=[self.address], loop=self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.reader.close(timeout=0))
+        super().tearDown()
+
+    async def _until(self, predicate, timeout=2):
+        deadline = self.loop.time() + timeout
+        while not predicate():
+            self.assertLess(self.loop.time(), deadline)
+            await asyncio.sleep(0.001)
+
+    @run_until_complete
+    async def test_reconnect_after_close(self):
+        reader = self.reader
+        await reader.connect()
+        first = reader.conns[0]
+        reader.delays[self.address] = 0.02
+        first.close()
+        await self._until(lambda: len(reader.conns) == 2)
+        await self._until(lambda: reader.nsqd_stats[self.nsqd_id]["connected"])
+        self.assertIs(reader._rdy_control.connections[self.nsqd_id], reader.conns[1])
+        stats = reader.nsqd_stats[self.nsqd_id]
+        self.assertEqual(stats["reconnects"], 1)
+        self.assertGreaterEqual(stats["downtime"], 0.02)
+        self.assertIn(self.nsqd_id, reader._supervisors)
+
+    @run_until_complete
+    async def test_backoff_between_attempts(self):
+        reader = self.reader
+        await reader.connect()
+        reader.refused.add(self.address)
+        reader.conns[0].close()
+        await self._until(lambda: len(reader.reconnect_delays) >= 5)
+        delays = reader.reconnect_delays
+        # the first attempt is at once, then each waits longer up to the max
+        self.assertEqual(delays[0], 0)
+        for prev, delay in zip(delays[1:], delays[2:]):
+            self.assertTrue(prev < delay or delay == 30.0, delays)
+        stats = reader.nsqd_stats[self.nsqd_id]
+        self.assertFalse(stats["connected"])
+        self.assertEqual(stats["reconnects"], 0)
+        self.assertIn("ConnectionRefusedError", stats["last_error"])
+
+        reader.refused.clear()
+        await self._until(lambda: reader.nsqd_stats[self.nsqd_id]["connected"])
+        self.assertEqual(reader.nsqd_stats[self.nsqd_id]["reconnects"], 1)
+
+    @run_until_complete
+    async def test_stops_when_not_wanted(self):
+        reader = self.reader
+        await reader.connect()
+        supervisor = reader._supervisors[self.nsqd_id]
+        reader._nsqd_tcp_addresses.remove(self.address)
+        reader.conns[0].close()
+        await asyncio.wait_for(supervisor, 1, loop=self.loop)
+        self.assertNotIn(self.nsqd_id, reader._supervisors)
+        self.assertEqual(len(reader.conns), 1)
+
+    @run_until_complete
+    async def test_stops_on_close(self):
+        reader = self.reader
+        reader.refused.add(self.address)
+        await reader.connect()
+        supervisor = reader._supervisors[self.nsqd_id]
+        await reader.close(timeout=0)
+        self.assertTrue(supervisor.done())
+        self.assertEqual(reader._supervisors, {})
+        await asyncio.sleep(0.01)
+        self.assertEqual(reader.conns, [])
+
+
+class ReaderUnsubscribeTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        addresses = [("127.0.0.1", 4150), ("127.0.0.1", 4151)]
+        self.reader = FakeReader(nsqd_tcp_addresses=addresses, loop=self.loop)
+        self.loop.run_until_complete(self._subscribe())
+
+    async def _subscribe(self):
+        await self.reader.connect()
+        await self.reader.subscribe("topic", "channel")
+        self.conns = self.reader.conns
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.reader.close(timeout=0))
+        super().tearDown()
+
+    async def _handle(self, delay):
+        """take one message and FIN it after ``delay`` seconds"""
+        async for msg in self.reader.messages():
+            await asyncio.sleep(delay, loop=self.loop)
+            await msg.fin()
+            return msg
+
+    @run_until_complete
+    async def test_rdy_0_and_cls_to_all(self):
+        await self.reader.unsubscribe(timeout=0.1)
+        for conn in self.conns:
+            self.assertEqual(conn.commands[-2:], [(RDY, 0), (CLS,)])
+        self.assertFalse(self.reader._is_subscribe)
+
+    @run_until_complete
+    async def test_handlers_finish_before_deadline(self):
+        msg = self.conns[0].deliver(self.reader, b"1")
+        handler = self.loop.create_task(self._handle(0.05))
+        await asyncio.sleep(0)
+        start = time.time()
+        await self.reader.unsubscribe(timeout=5)
+        self.assertLess(time.time() - start, 1)
+        self.assertIs(await handler, msg)
+        self.assertTrue(msg.processed)
+        self.assertFalse(msg.requeued)
+        self.assertEqual(self.conns[0].requeued, [])
+
+    @run_until_complete
+    async def test_queued_requeued_after_deadline(self):
+        held = self.conns[0].deliver(self.reader, b"held")
+        handler = self.loop.create_task(self._handle(10))
+        await asyncio.sleep(0)
+        queued = [self.conns[0].deliver(self.reader, b"q1")]
+        queued.append(self.conns[1].deliver(self.reader, b"q2"))
+        queued.append(self.conns[0].deliver(self.reader, b"q3"))
+        start = time.time()
+        await self.reader.unsubscribe(timeout=0.05)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        # one write per connection
+        self.assertEqual(self.conns[0].requeued, [[b"q1", b"q3"]])
+        self.assertEqual(self.conns[1].requeued, [[b"q2"]])
+        self.assertTrue(all(msg.requeued for msg in queued))
+        self.assertFalse(held.processed)
+        handler.cancel()
+
+    @run_until_complete
+    async def test_cls_not_acked_shares_deadline(self):
+        for conn in self.conns:
+            conn.stalled.add(CLS)
+        msg = self.conns[0].deliver(self.reader, b"1")
+        handler = self.loop.create_task(self._handle(0.05))
+        await asyncio.sleep(0)
+        start = time.time()
+        await self.reader.unsubscribe(timeout=0.2)
+        self.assertLess(time.time() - start, 0.3)
+        self.assertIs(await handler, msg)
+        self.assertFalse(msg.requeued)
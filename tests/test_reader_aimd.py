@@ -0,0 +1,72 @@
+import unittest
+from nsqio.tcp.reader_aimd import AimdController
+
+
+class AimdControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.controller = AimdController(
+            floor=2,
+            ceiling=20,
+            increase=1,
+            decrease=0.5,
+            interval=1.0,
+            target_latency=0.1,
+            time_func=lambda: self.now,
+        )
+
+    def _window(self, num, latency, requeued=0):
+        for i in range(num):
+            self.controller.on_processed(latency, i < requeued)
+        self.now += 1.0
+
+    def test_additive_increase(self):
+        max_in_flight = 10
+        for num in (10, 20, 30):
+            self._window(num, 0.01)
+            max_in_flight = self.controller.update(max_in_flight)
+        self.assertEqual(max_in_flight, 13)
+
+    def test_hold_without_improvement(self):
+        self._window(10, 0.01)
+        max_in_flight = self.controller.update(10)
+        self._window(10, 0.01)
+        self.assertEqual(self.controller.update(max_in_flight), max_in_flight)
+
+    def test_multiplicative_decrease_on_latency(self):
+        self._window(10, 0.5)
+        self.assertEqual(self.controller.update(10), 5)
+
+    def test_multiplicative_decrease_on_errors(self):
+        self._window(10, 0.01, requeued=5)
+        self.assertEqual(self.controller.update(10), 5)
+
+    def test_clamped(self):
+        self._window(10, 0.5)
+        self.assertEqual(self.controller.update(3), 2)
+        self._window(100, 0.01)
+        self.assertEqual(self.controller.update(20), 20)
+
+    def test_idle_window_keeps_target(self):
+        self.now += 1.0
+        self.assertEqual(self.controller.update(7), 7)
+
+    def test_baseline_follows_latency_shift(self):
+        self.controller = AimdController(
+            floor=2,
+            ceiling=20,
+            interval=1.0,
+            latency_tolerance=2.0,
+            time_func=lambda: self.now,
+        )
+        max_in_flight = 10
+        self._window(10 * max_in_flight, 0.01)
+        max_in_flight = self.controller.update(max_in_flight)
+        # latency shifts up and stays there
+        history = []
+        for _ in range(30):
+            self._window(10 * max_in_flight, 0.05)
+            max_in_flight = self.controller.update(max_in_flight)
+            history.append(max_in_flight)
+        self.assertEqual(min(history), 2)
+        self.assertEqual(max_in_flight, 20)
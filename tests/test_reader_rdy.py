@@ -0,0 +1,215 @@
+import asyncio
+import math
+import unittest
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.reader_rdy import RdyControl
+from nsqio.tcp.rdy_policy import WeightedRdyPolicy
+
+
+class FakeConnection:
+    """Stand-in for TcpConnection that records sent RDY counts."""
+
+    def __init__(self, id):
+        self.id = id
+        self.closed = False
+        self._in_flight = 0
+        self._rdy = 0
+        self._last_rdy = 0
+        self._last_message = 0
+        self._on_rdy_changed_cb = None
+        self.sent = []
+
+    @property
+    def rdy(self):
+        return self._rdy
+
+    @property
+    def last_rdy(self):
+        return self._last_rdy
+
+    def deliver(self):
+        self._in_flight += 1
+        self._rdy = max(0, self._rdy - 1)
+
+    def execute(self, command, *args):
+        self._last_rdy = self._rdy = args[0]
+        self.sent.append(args[0])
+        fut = asyncio.Future()
+        fut.set_result(b"OK")
+        return fut
+
+    def close(self):
+        self.closed = True
+
+
+class RdyControlTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.rdy_control = RdyControl(
+            idle_timeout=10, max_in_flight=100, loop=self.loop, rdy_threshold=0.25
+        )
+        self.conn = FakeConnection("tcp://127.0.0.1:4150")
+        self.rdy_control.add_connection(self.conn)
+
+    def tearDown(self):
+        self.rdy_control.stop_working()
+        super().tearDown()
+
+    @run_until_complete
+    async def test_rdy_refreshed_below_threshold(self):
+        self.rdy_control.rdy_changed(self.conn.id)
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100])
+
+        # deliveries above 25% of the allotment do not send RDY
+        for _ in range(75):
+            self.conn.deliver()
+            self.rdy_control.rdy_changed(self.conn.id)
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100])
+
+        # all processed, the next delivery crosses the threshold
+        self.conn._in_flight = 0
+        self.conn.deliver()
+        self.rdy_control.rdy_changed(self.conn.id)
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100, 99])
+
+    @run_until_complete
+    async def test_hold_and_release(self):
+        self.rdy_control.rdy_changed(self.conn.id)
+        await asyncio.sleep(0)
+        self.rdy_control.hold(self.conn.id)
+        self.assertEqual(self.conn.sent, [100, 0])
+        # no RDY while held
+        self.conn.deliver()
+        self.rdy_control.rdy_changed(self.conn.id)
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100, 0])
+
+        self.rdy_control.release(self.conn.id)
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100, 0, 99])
+
+    @run_until_complete
+    async def test_pending_updates_coalesced(self):
+        for _ in range(10):
+            self.rdy_control.rdy_changed(self.conn.id)
+        self.assertEqual(self.rdy_control._dirty, {self.conn.id})
+        await asyncio.sleep(0)
+        self.assertEqual(self.conn.sent, [100])
+
+
+class RdyRotationTest(BaseTest):
+    """Simulate rotation with a fake clock when max_in_flight < #nsqd."""
+
+    num_conns = 10
+    max_in_flight = 3
+    idle_timeout = 10
+    tick = 5
+
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.rdy_control = RdyControl(
+            idle_timeout=self.idle_timeout,
+            max_in_flight=self.max_in_flight,
+            loop=self.loop,
+            time_func=lambda: self.now,
+        )
+        self.conns = [
+            FakeConnection("tcp://10.0.0.{}:4150".format(i))
+            for i in range(self.num_conns)
+        ]
+        for conn in self.conns:
+            self.rdy_control.add_connection(conn)
+
+    def tearDown(self):
+        self.rdy_control.stop_working()
+        super().tearDown()
+
+    async def _simulate(self, ticks, busy):
+        max_starved = {conn.id: 0 for conn in self.conns}
+        ever_granted = set()
+        for _ in range(ticks):
+            await self.rdy_control._redistribute_rdy_state()
+            holders = [c for c in self.conns if c.last_rdy > 0]
+            self.assertLessEqual(len(holders), self.max_in_flight)
+            for conn in self.conns:
+                max_starved[conn.id] = max(
+                    max_starved[conn.id], self.rdy_control.starved_for(conn.id)
+                )
+            ever_granted.update(c.id for c in holders)
+            self.now += self.tick
+            for conn in holders:
+                if busy:
+                    conn._last_message = self.now
+        return max_starved, ever_granted
+
+    def _bound(self):
+        rounds = math.ceil((self.num_conns - self.max_in_flight) / self.max_in_flight)
+        return rounds * (self.idle_timeout + self.tick)
+
+    @run_until_complete
+    async def test_bounded_starvation_busy(self):
+        max_starved, ever_granted = await self._simulate(100, busy=True)
+        self.assertEqual(len(ever_granted), self.num_conns)
+        self.assertLessEqual(max(max_starved.values()), self._bound())
+
+    @run_until_complete
+    async def test_bounded_starvation_idle(self):
+        max_starved, ever_granted = await self._simulate(100, busy=False)
+        self.assertEqual(len(ever_granted), self.num_conns)
+        self.assertLessEqual(max(max_starved.values()), self._bound())
+
+    @run_until_complete
+    async def test_rdy_failure_does_not_stop_rotation(self):
+        def fail(command, *args):
+            fut = asyncio.Future()
+            fut.set_exception(ConnectionError("closed"))
+            return fut
+
+        self.conns[0].execute = fail
+        await self.rdy_control._rotate_rdy()
+        holders = [c for c in self.conns[1:] if c.last_rdy > 0]
+        self.assertEqual(len(holders), self.max_in_flight - 1)
+
+    @run_until_complete
+    async def test_message_does_not_grant_rdy_to_starved(self):
+        await self.rdy_control._redistribute_rdy_state()
+        starved = [c for c in self.conns if c.last_rdy == 0]
+        await self.rdy_control._update_rdy(starved[0].id)
+        self.assertEqual(starved[0].sent, [])
+
+
+class WeightedRdyPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.policy = WeightedRdyPolicy(half_life=5.0, time_func=lambda: self.now)
+        self.conn_ids = ["tcp://a:4150", "tcp://b:4150", "tcp://c:4150"]
+
+    def test_even_split_without_history(self):
+        share = self.policy.conn_max_in_flight("tcp://a:4150", self.conn_ids, 30)
+        self.assertEqual(share, 10)
+
+    def test_busy_connection_gets_budget(self):
+        for _ in range(100):
+            self.now += 0.01
+            self.policy.on_message("tcp://a:4150")
+        for _ in range(10):
+            self.now += 0.1
+            self.policy.on_message("tcp://b:4150")
+
+        share_a = self.policy.conn_max_in_flight("tcp://a:4150", self.conn_ids, 30)
+        share_b = self.policy.conn_max_in_flight("tcp://b:4150", self.conn_ids, 30)
+        share_c = self.policy.conn_max_in_flight("tcp://c:4150", self.conn_ids, 30)
+        self.assertEqual(share_c, 1)
+        self.assertGreater(share_a, share_b)
+        self.assertAlmostEqual(share_a + share_b, 29)
+
+    def test_rate_decays(self):
+        for _ in range(10):
+            self.policy.on_message("tcp://a:4150")
+        rate = self.policy.rate("tcp://a:4150")
+        self.now += 5.0
+        self.assertAlmostEqual(self.policy.rate("tcp://a:4150"), rate / 2)
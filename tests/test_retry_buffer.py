@@ -0,0 +1,145 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest, FakeNsqd
+from nsqio.tcp.consts import CONNECTED
+from nsqio.tcp.exceptions import NSQRetryBufferFull
+from nsqio.tcp.retry_buffer import (
+    RetryBuffer,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_RAISE,
+)
+from nsqio.tcp.writer import Writer, create_writer
+
+
+class FakeConnection:
+    max_body_size = 1024
+
+    def __init__(self):
+        self.closed = False
+        self.commands = []
+        self.pipelined = []
+
+    async def execute(self, command, *args, data=None):
+        self.commands.append((command, args, data))
+        return b"OK"
+
+    def execute_pipelined(self, command, calls):
+        self.pipelined.append((command, calls))
+        futures = [asyncio.Future() for _ in calls]
+        for fut in futures:
+            fut.set_result(b"OK")
+        return futures
+
+
+class RetryBufferTest(BaseTest):
+    @run_until_complete
+    async def test_take_groups_topics(self):
+        buffer = RetryBuffer(loop=self.loop)
+        await buffer.put("foo", [b"a"])
+        await buffer.put("foo", [b"b", b"c"])
+        await buffer.put("bar", [b"d"])
+        self.assertEqual((len(buffer), buffer.bytes), (4, 4))
+        topic, entries = buffer.take()
+        self.assertEqual(topic, "foo")
+        self.assertEqual([e.messages for e in entries], [[b"a"], [b"b", b"c"]])
+        buffer.requeue(entries)
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(len(buffer.take(max_count=2)[1]), 1)
+
+    @run_until_complete
+    async def test_overflow_policies(self):
+        buffer = RetryBuffer(max_count=2, overflow=OVERFLOW_RAISE, loop=self.loop)
+        await buffer.put("foo", [b"a", b"b"])
+        with self.assertRaises(NSQRetryBufferFull):
+            await buffer.put("foo", [b"c"])
+
+        buffer = RetryBuffer(max_bytes=2, overflow=OVERFLOW_DROP_OLDEST, loop=self.loop)
+        first = await buffer.put("foo", [b"a"])
+        await buffer.put("foo", [b"b"])
+        await buffer.put("foo", [b"c"])
+        self.assertIsInstance(first.exception(), NSQRetryBufferFull)
+        self.assertEqual((len(buffer), buffer.dropped), (2, 1))
+
+    @run_until_complete
+    async def test_block_until_room(self):
+        buffer = RetryBuffer(max_count=1, loop=self.loop)
+        await buffer.put("foo", [b"a"])
+        put = self.loop.create_task(buffer.put("foo", [b"b"]))
+        await asyncio.sleep(0.01, loop=self.loop)
+        self.assertFalse(put.done())
+        buffer.take()
+        await asyncio.wait_for(put, 1, loop=self.loop)
+        self.assertEqual(len(buffer), 1)
+
+    @run_until_complete
+    async def test_deadline(self):
+        buffer = RetryBuffer(deadline=0.01, loop=self.loop)
+        fut = await buffer.put("foo", [b"a"])
+        other = await buffer.put("foo", [b"b"], deadline=10)
+        await asyncio.sleep(0.05, loop=self.loop)
+        self.assertIsInstance(fut.exception(), asyncio.TimeoutError)
+        self.assertFalse(other.done())
+        self.assertEqual((len(buffer), buffer.expired), (1, 1))
+
+    @run_until_complete
+    async def test_writer_flushes_on_reconnect(self):
+        buffer = RetryBuffer(loop=self.loop)
+        writer = Writer(loop=self.loop, retry_buffer=buffer)
+        pubs = [
+            self.loop.create_task(writer.pub("foo", "msg{}".format(i)))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0, loop=self.loop)
+        self.assertEqual(len(buffer), 3)
+
+        conn = writer._conn = FakeConnection()
+        writer._status = CONNECTED
+        writer._start_replay()
+        results = await asyncio.gather(*pubs, loop=self.loop)
+        self.assertEqual(results, [b"OK"] * 3)
+        self.assertEqual(
+            conn.commands, [(b"MPUB", ("foo",), [b"msg0", b"msg1", b"msg2"])]
+        )
+        # connected with an empty buffer, publish directly
+        await writer.pub("foo", b"msg3")
+        self.assertEqual(conn.commands[-1][0], b"PUB")
+
+    @run_until_complete
+    async def test_writer_buffers_dpub(self):
+        buffer = RetryBuffer(loop=self.loop)
+        writer = Writer(loop=self.loop, retry_buffer=buffer)
+        items = [("foo", 5000, b"msg0"), ("foo", 5000, b"msg1")]
+        dpubs = self.loop.create_task(writer.dpub_many(items))
+        await asyncio.sleep(0, loop=self.loop)
+        self.assertEqual(len(buffer), 2)
+
+        conn = writer._conn = FakeConnection()
+        writer._status = CONNECTED
+        writer._start_replay()
+        self.assertEqual(await dpubs, [b"OK"] * 2)
+        [(command, calls)] = conn.pipelined
+        self.assertEqual(command, b"DPUB")
+        self.assertEqual([data for _, data in calls], [b"msg0", b"msg1"])
+        for (topic, delay_time), _ in calls:
+            self.assertEqual(topic, "foo")
+            self.assertTrue(4000 < delay_time <= 5000)
+
+    @run_until_complete
+    async def test_in_flight_buffered_until_deadline(self):
+        server = await FakeNsqd(self.loop, drop_on=(b"PUB", b"MPUB")).start()
+        buffer = RetryBuffer(loop=self.loop)
+        writer = await create_writer(
+            port=server.port, loop=self.loop, retry_buffer=buffer
+        )
+        try:
+            # dropped in flight then on every flush, until the deadline
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    writer.pub("foo", b"msg", deadline=0.3), 5, loop=self.loop
+                )
+            self.assertEqual(server.commands[:2], [b"IDENTIFY", b"PUB"])
+            self.assertIn(b"MPUB", server.commands)
+            self.assertEqual((len(buffer), buffer.expired), (0, 1))
+        finally:
+            await writer.close()
+            await server.close()
@@ -0,0 +1,144 @@
+from collections import deque
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.consts import CONNECTED, MPUB
+from nsqio.tcp.sharded_writer import HashRing, ShardedWriterPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self._cmd_waiters = deque()
+        self.closed = False
+
+
+class FakeWriter:
+    def __init__(self):
+        self._status = CONNECTED
+        self._conn = FakeConnection()
+        self.executed = []
+        self.fail = False
+
+    async def execute(self, command, *args, data=None):
+        if self.fail:
+            raise ConnectionError("lost")
+        self.executed.append((command, args, data))
+        return b"OK"
+
+    async def close(self):
+        self._conn.closed = True
+
+
+class HashRingTest(BaseTest):
+    def test_only_leaving_node_keys_move(self):
+        ring = HashRing(vnodes=100)
+        for node in ("a", "b", "c", "d"):
+            ring.add(node)
+        owners = {key: next(ring.nodes_for(key)) for key in range(2000)}
+        self.assertEqual(set(owners.values()), {"a", "b", "c", "d"})
+        # roughly even
+        for node in "abcd":
+            self.assertGreater(list(owners.values()).count(node), 300)
+
+        ring.remove("b")
+        for key, owner in owners.items():
+            new_owner = next(ring.nodes_for(key))
+            if owner != "b":
+                self.assertEqual(new_owner, owner)
+            else:
+                self.assertNotEqual(new_owner, "b")
+        self.assertEqual(sorted(ring.nodes_for("x")), ["a", "c", "d"])
+
+
+class ShardedWriterPoolTest(BaseTest):
+    def _pool(self, writers, **kwargs):
+        pool = ShardedWriterPool(loop=self.loop, **kwargs)
+        for nsqd_id, writer in writers.items():
+            pool._writers[nsqd_id] = writer
+            pool._errors[nsqd_id] = 0
+            pool._ring.add(nsqd_id)
+        return pool
+
+    @run_until_complete
+    async def test_key_affinity_and_failover(self):
+        writers = {name: FakeWriter() for name in "abc"}
+        pool = self._pool(writers)
+        owner = pool.node_for("user-1")
+        for _ in range(5):
+            await pool.pub("topic", b"msg", key="user-1")
+        self.assertEqual(len(writers[owner].executed), 5)
+
+        writers[owner]._conn.closed = True
+        fallback = pool.node_for("user-1")
+        self.assertNotEqual(fallback, owner)
+        await pool.pub("topic", b"msg", key="user-1")
+        self.assertEqual(len(writers[fallback].executed), 1)
+
+        # back on its owner once it is healthy again
+        writers[owner]._conn.closed = False
+        self.assertEqual(pool.node_for("user-1"), owner)
+
+    @run_until_complete
+    async def test_per_node_batching(self):
+        writers = {name: FakeWriter() for name in "ab"}
+        pool = self._pool(writers, batch_linger=10)
+        keys = ["key{}".format(i) for i in range(20)]
+        for key in keys:
+            pool._batcher(pool.node_for(key)).publish("topic", key, key)
+        await pool.flush()
+        for name, writer in writers.items():
+            [(command, args, data)] = writer.executed
+            self.assertEqual(command, MPUB)
+            self.assertEqual(
+                data, [k.encode() for k in keys if pool.node_for(k) == name]
+            )
+
+    @run_until_complete
+    async def test_failed_batch_rerouted_by_key(self):
+        writers = {name: FakeWriter() for name in "abcd"}
+        pool = self._pool(writers, batch_linger=10)
+        keys = [k for k in map("key{}".format, range(200)) if pool.node_for(k) == "a"]
+        fallbacks = {key: pool._pick_on_ring(key, ("a",)) for key in keys}
+        self.assertGreater(len(set(fallbacks.values())), 1)
+
+        writers["a"].fail = True
+        futures = [pool._batcher("a").publish("topic", key, key) for key in keys]
+        await pool.flush()
+        self.assertEqual([f.result() for f in futures], [b"OK"] * len(keys))
+        for name, writer in writers.items():
+            sent = [m for _, _, data in writer.executed for m in data]
+            self.assertEqual(sent, [k.encode() for k in keys if fallbacks[k] == name])
+
+    @run_until_complete
+    async def test_rerouted_by_key_on_every_hop(self):
+        writers = {name: FakeWriter() for name in "abcde"}
+        pool = self._pool(writers, batch_linger=10, eject_errors=10)
+        keys = [k for k in map("key{}".format, range(500)) if pool.node_for(k) == "a"]
+        second = {key: pool._pick_on_ring(key, ("a",)) for key in keys}
+        # the busiest second hop fails too
+        hop = max(set(second.values()), key=list(second.values()).count)
+        third = {key: pool._pick_on_ring(key, ("a", hop)) for key in keys}
+        self.assertGreater(
+            len({third[k] for k in keys if second[k] == hop}), 1, "keys share hops"
+        )
+
+        writers["a"].fail = writers[hop].fail = True
+        futures = [pool._batcher("a").publish("topic", key, key) for key in keys]
+        await pool.flush()
+        self.assertEqual([f.result() for f in futures], [b"OK"] * len(keys))
+        for name, writer in writers.items():
+            sent = sorted(m for _, _, data in writer.executed for m in data)
+            expected = [
+                k for k in keys if (second[k] if second[k] != hop else third[k]) == name
+            ]
+            self.assertEqual(sent, sorted(k.encode() for k in expected))
+
+    @run_until_complete
+    async def test_node_removed(self):
+        writers = {name: FakeWriter() for name in "abc"}
+        pool = self._pool(writers)
+        owners = {key: pool.node_for(key) for key in range(100)}
+        await pool._remove_nsqd("a")
+        self.assertTrue(writers["a"]._conn.closed)
+        for key, owner in owners.items():
+            if owner != "a":
+                self.assertEqual(pool.node_for(key), owner)
@@ -0,0 +1,94 @@
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.shm import SharedMemoryRing, ShmDispatcher, read_slot, shared_memory
+
+
+class FakeMessage:
+    def __init__(self, body):
+        self.body = body
+        self.processed = False
+        self.finished = False
+        self.requeued = False
+
+    async def fin(self):
+        self.processed = self.finished = True
+
+    async def req(self, timeout=10):
+        self.processed = self.requeued = True
+
+
+class FakeReader:
+    def __init__(self, loop, messages, max_in_flight=100):
+        self._loop = loop
+        self._messages = messages
+        self.max_in_flight = max_in_flight
+
+    def update_max_in_flight(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+
+    async def messages(self):
+        for msg in self._messages:
+            yield msg
+
+
+def _checksum(body):
+    if bytes(body[:4]) == b"fail":
+        raise ValueError("fail")
+    return sum(body)
+
+
+@unittest.skipIf(shared_memory is None, "needs python 3.8+")
+class SharedMemoryRingTest(unittest.TestCase):
+    def test_slots(self):
+        ring = SharedMemoryRing(slot_count=2, slot_size=8)
+        try:
+            first = ring.put(b"hello")
+            second = ring.put(b"world!")
+            self.assertEqual(ring.occupancy, 2)
+            self.assertEqual(bytes(read_slot(first)), b"hello")
+            self.assertEqual(bytes(read_slot(second)), b"world!")
+            ring.release(first)
+            self.assertEqual(ring.occupancy, 1)
+            # too big for a slot, shipped inline
+            big = ring.put(b"x" * 9)
+            self.assertEqual(bytes(read_slot(big)), b"x" * 9)
+            self.assertEqual(ring.occupancy, 1)
+        finally:
+            ring.close()
+
+
+@unittest.skipIf(shared_memory is None, "needs python 3.8+")
+class ShmDispatcherTest(BaseTest):
+    @run_until_complete
+    async def test_dispatch(self):
+        msgs = [FakeMessage(bytes([i]) * 100) for i in range(20)]
+        msgs.append(FakeMessage(b"fail"))
+        reader = FakeReader(self.loop, msgs)
+        with ThreadPoolExecutor(4) as executor:
+            dispatcher = ShmDispatcher(
+                reader, executor, _checksum, slot_count=4, slot_size=128
+            )
+            await dispatcher.run()
+        self.assertEqual(reader.max_in_flight, 4)
+        self.assertTrue(all(m.finished for m in msgs[:-1]))
+        self.assertTrue(msgs[-1].requeued)
+        self.assertEqual(dispatcher.ring.occupancy, 0)
+
+    @run_until_complete
+    async def test_dispatch_to_processes(self):
+        # workers attach to the ring by name from another process
+        msgs = [FakeMessage(bytes([i]) * 100) for i in range(10)]
+        msgs.append(FakeMessage(b"x" * 200))
+        msgs.append(FakeMessage(b"fail"))
+        reader = FakeReader(self.loop, msgs)
+        with ProcessPoolExecutor(2) as executor:
+            dispatcher = ShmDispatcher(
+                reader, executor, _checksum, slot_count=4, slot_size=128
+            )
+            await dispatcher.run()
+        self.assertTrue(all(m.finished for m in msgs[:-1]))
+        self.assertTrue(msgs[-1].requeued)
+        self.assertEqual(dispatcher.ring.occupancy, 0)
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ._testutils import run_until_complete, BaseTest, FakeNsqd
+from nsqio.tcp.consts import CONNECTED
+from nsqio.tcp.exceptions import NSQSpoolFull
+from nsqio.tcp.spool import DiskSpool, FSYNC_ALWAYS, SPOOLED
+from nsqio.tcp.writer import Writer, create_writer
+
+
+class FakeConnection:
+    """fails the first ``failures`` MPUB with E_MPUB_FAILED"""
+
+    max_body_size = 1024 * 1024
+
+    def __init__(self, failures=0):
+        self.closed = False
+        self.failures = failures
+        self.published = []
+
+    async def execute(self, command, topic, data=None):
+        if self.failures:
+            self.failures -= 1
+            return (b"E_MPUB_FAILED", b"failed")
+        self.published.extend(data if isinstance(data, list) else [data])
+        return b"OK"
+
+    def execute_pipelined(self, command, calls):
+        futures = []
+        for (topic, delay_time), data in calls:
+            self.published.append((data, delay_time))
+            futures.append(asyncio.Future())
+            futures[-1].set_result(b"OK")
+        return futures
+
+
+class DiskSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _segments(self):
+        return sorted(n for n in os.listdir(self.directory) if n.endswith(".seg"))
+
+    def test_batches_in_order(self):
+        spool = DiskSpool(self.directory, segment_size=1024)
+        for i in range(3):
+            spool.append("foo", b"foo%d" % i)
+        spool.append("bar", b"bar")
+        spool.append("foo", b"foo3")
+        self.assertEqual(len(spool), 5)
+
+        batches = []
+        while not spool.empty:
+            topic, bodies, position, dues = spool.peek(max_count=2)
+            self.assertIsNone(dues)
+            batches.append((topic, bodies))
+            spool.commit(position)
+        self.assertEqual(
+            batches,
+            [
+                ("foo", [b"foo0", b"foo1"]),
+                ("foo", [b"foo2"]),
+                ("bar", [b"bar"]),
+                ("foo", [b"foo3"]),
+            ],
+        )
+        self.assertEqual(spool.bytes, 0)
+        self.assertIsNone(spool.peek())
+        spool.close()
+
+    def test_segments_rolled_and_deleted(self):
+        spool = DiskSpool(self.directory, segment_size=64)
+        for i in range(10):
+            spool.append("foo", b"x" * 20)
+        self.assertGreater(len(self._segments()), 3)
+        while not spool.empty:
+            spool.commit(spool.peek()[2])
+        self.assertEqual(len(self._segments()), 1)
+        spool.close()
+
+    def test_reopen_replays_uncommitted(self):
+        spool = DiskSpool(self.directory, segment_size=64, fsync=FSYNC_ALWAYS)
+        for i in range(6):
+            spool.append("foo", b"msg%d" % i)
+        spool.commit(spool.peek(max_count=4)[2])
+        spool.close()
+
+        spool = DiskSpool(self.directory, segment_size=64)
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.peek()[1], [b"msg4", b"msg5"])
+        spool.append("foo", b"msg6")
+        self.assertEqual(spool.peek()[1], [b"msg4", b"msg5", b"msg6"])
+        spool.close()
+
+    def test_delayed_records(self):
+        spool = DiskSpool(self.directory, segment_size=1024)
+        spool.append("foo", b"pub")
+        spool.append("foo", b"dpub0", delay_time=1000)
+        spool.append("foo", b"dpub1", delay_time=2000)
+        spool.append("foo", b"pub")
+
+        topic, bodies, position, dues = spool.peek()
+        self.assertEqual((bodies, dues), ([b"pub"], None))
+        spool.commit(position)
+        now = time.time() * 1000
+        topic, bodies, position, dues = spool.peek()
+        self.assertEqual(bodies, [b"dpub0", b"dpub1"])
+        self.assertTrue(now < dues[0] <= now + 1000)
+        self.assertTrue(now + 1000 < dues[1] <= now + 2000)
+        spool.commit(position)
+        topic, bodies, position, dues = spool.peek()
+        self.assertEqual((bodies, dues), ([b"pub"], None))
+        spool.close()
+
+    def test_size_cap(self):
+        spool = DiskSpool(self.directory, segment_size=1024, max_bytes=30)
+        spool.append("foo", b"x" * 10)
+        with self.assertRaises(NSQSpoolFull):
+            spool.append("foo", b"x" * 10)
+        with self.assertRaises(ValueError):
+            spool.append("foo", b"x" * 2000)
+        spool.close()
+
+
+class WriterSpoolTest(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    @run_until_complete
+    async def test_replay_retried_after_failure(self):
+        spool = DiskSpool(self.directory, segment_size=1024)
+        writer = Writer(loop=self.loop, spool=spool)
+        # disconnected, spooled
+        self.assertEqual(await writer.pub("foo", b"msg0"), SPOOLED)
+
+        conn = writer._conn = FakeConnection(failures=1)
+        writer._status = CONNECTED
+        # spooled behind msg0, starts the replay
+        self.assertEqual(await writer.pub("foo", b"msg1"), SPOOLED)
+        # first attempt failed, next one in 0.1s
+        await asyncio.sleep(0.01, loop=self.loop)
+        self.assertEqual(conn.failures, 0)
+        self.assertEqual(len(spool), 2)
+
+        # retried with backoff while connected
+        await asyncio.wait_for(writer._replay_task, 5, loop=self.loop)
+        self.assertTrue(spool.empty)
+        self.assertEqual(conn.published, [b"msg0", b"msg1"])
+        self.assertEqual(await writer.pub("foo", b"msg2"), b"OK")
+        spool.close()
+
+    @run_until_complete
+    async def test_in_flight_spooled_on_drop(self):
+        server = await FakeNsqd(self.loop, drop_on=(b"PUB",)).start()
+        spool = DiskSpool(self.directory, segment_size=1024)
+        writer = await create_writer(port=server.port, loop=self.loop, spool=spool)
+        try:
+            # sent, then the connection dropped before its response
+            resp = await asyncio.wait_for(writer.pub("foo", b"msg"), 5, loop=self.loop)
+            self.assertEqual(resp, SPOOLED)
+            self.assertEqual(server.commands[-1], b"PUB")
+
+            # replayed once reconnected
+            for _ in range(50):
+                if spool.empty:
+                    break
+                await asyncio.sleep(0.1, loop=self.loop)
+            self.assertTrue(spool.empty)
+            self.assertEqual(server.commands[-1], b"MPUB")
+        finally:
+            await writer.close()
+            await server.close()
+            spool.close()
+
+    @run_until_complete
+    async def test_dpub_spooled(self):
+        spool = DiskSpool(self.directory, segment_size=1024)
+        writer = Writer(loop=self.loop, spool=spool)
+        items = [("foo", 5000, b"msg0"), ("foo", 0, b"msg1")]
+        self.assertEqual(await writer.dpub_many(items), [SPOOLED] * 2)
+
+        conn = writer._conn = FakeConnection()
+        writer._status = CONNECTED
+        writer._start_replay()
+        await asyncio.wait_for(writer._replay_task, 5, loop=self.loop)
+        self.assertTrue(spool.empty)
+        [(body, delay_time), published] = conn.published
+        self.assertEqual(body, b"msg0")
+        self.assertTrue(4000 < delay_time <= 5000)
+        self.assertEqual(published, b"msg1")
+        spool.close()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from concurrent.futures import TimeoutError
+
+from ._testutils import FakeNsqd
+
+from nsqio.tcp.exceptions import NSQBadTopic, NSQNoConnections
+from nsqio.tcp.sync_writer import SyncWriter
+
+
+class FakeWriter:
+    def __init__(self):
+        self.mpubs = []
+        self.closed = False
+
+    async def mpub(self, topic, *messages):
+        self.mpubs.append((topic, list(messages)))
+        if topic == "bad":
+            return (b"E_BAD_TOPIC", b"bad topic")
+        return b"OK"
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeSyncWriter(SyncWriter):
+    async def _connect(self):
+        return FakeWriter()
+
+
+class HangingSyncWriter(SyncWriter):
+    async def _connect(self):
+        await asyncio.sleep(60)
+
+
+class FailingSyncWriter(SyncWriter):
+    async def _connect(self):
+        raise ConnectionRefusedError()
+
+
+class SyncWriterTest(unittest.TestCase):
+    def test_publish_from_threads(self):
+        writer = FakeSyncWriter(linger=0.01)
+
+        def publish(n):
+            for i in range(100):
+                writer.publish("foo", "{}-{}".format(n, i))
+
+        threads = [threading.Thread(target=publish, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush(timeout=5)
+        fake = writer._writer
+        bodies = [m for _, messages in fake.mpubs for m in messages]
+        self.assertEqual(len(bodies), 400)
+        # batched, and in order within a thread
+        self.assertLess(len(fake.mpubs), 400)
+        self.assertEqual(
+            [b for b in bodies if b.startswith(b"1-")],
+            [b"1-%d" % i for i in range(100)],
+        )
+        writer.close()
+        self.assertTrue(fake.closed)
+        with self.assertRaises(RuntimeError):
+            writer.publish("foo", b"late")
+
+    def test_wait_for_ack(self):
+        with FakeSyncWriter(linger=0.001) as writer:
+            self.assertEqual(writer.publish("foo", b"x", wait=True, timeout=5), b"OK")
+            with self.assertRaises(NSQBadTopic):
+                writer.publish("bad", b"x", wait=True, timeout=5)
+            writer.publish("bad", b"x")
+            writer.flush(timeout=5)
+            self.assertEqual(writer.errors, 2)
+
+    def test_connect_timeout_stops_thread(self):
+        with self.assertRaises(TimeoutError):
+            HangingSyncWriter(connect_timeout=0.1)
+        with self.assertRaises(ConnectionRefusedError):
+            FailingSyncWriter(connect_timeout=5)
+        self.assertFalse(
+            [t for t in threading.enumerate() if t.name == "nsqio-sync-writer"]
+        )
+
+    def test_drop_with_publish_pending(self):
+        # the server runs on a loop of its own, the writer has its thread
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        server = asyncio.run_coroutine_threadsafe(
+            FakeNsqd(loop, drop_on=(b"MPUB",)).start(), loop
+        ).result(5)
+        try:
+            writer = SyncWriter(["127.0.0.1:{}".format(server.port)], linger=0.001)
+            with self.assertRaises(ConnectionError):
+                writer.publish("foo", b"x", wait=True, timeout=5)
+
+            server.drop_on = ()
+            deadline = time.monotonic() + 5
+            while True:
+                try:
+                    resp = writer.publish("foo", b"x", wait=True, timeout=5)
+                    break
+                except NSQNoConnections:
+                    # reconnecting
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.05)
+            self.assertEqual(resp, b"OK")
+            writer.close()
+        finally:
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
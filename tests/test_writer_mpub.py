@@ -0,0 +1,66 @@
+from ._testutils import run_until_complete, BaseTest
+from nsqio.tcp.consts import MAX_BODY_SIZE
+from nsqio.tcp.writer import Writer
+
+
+class FakeConnection:
+    closed = False
+    max_body_size = 4 + 3 * 14
+    max_msg_size = 10
+
+    def __init__(self, response=b"OK"):
+        self.response = response
+        self.mpubs = []
+
+    async def execute(self, command, topic, data=None):
+        self.mpubs.append(data)
+        return self.response
+
+
+class WriterMpubTest(BaseTest):
+    def _writer(self, conn):
+        writer = Writer(loop=self.loop)
+        writer._conn = conn
+        return writer
+
+    @run_until_complete
+    async def test_split_by_body_size(self):
+        conn = FakeConnection()
+        writer = self._writer(conn)
+        resp = await writer.mpub("foo", *[b"x" * 10 for _ in range(7)])
+        self.assertEqual(resp, b"OK")
+        self.assertEqual([len(m) for m in conn.mpubs], [3, 3, 1])
+
+        with self.assertRaises(ValueError):
+            await writer.mpub("foo", b"x" * 11)
+
+    @run_until_complete
+    async def test_iterables(self):
+        conn = FakeConnection()
+        writer = self._writer(conn)
+        await writer.mpub("foo", (b"%d" % i for i in range(5)))
+
+        async def source():
+            for i in range(5):
+                yield "msg{}".format(i)
+
+        await writer.mpub("foo", source())
+        self.assertEqual(conn.mpubs[0], [b"0", b"1", b"2", b"3", b"4"])
+        self.assertEqual(conn.mpubs[1][-1], b"msg4")
+
+    @run_until_complete
+    async def test_stop_at_error(self):
+        conn = FakeConnection((b"E_BAD_BODY", b"too big"))
+        writer = self._writer(conn)
+        resp = await writer.mpub("foo", *[b"x" * 10 for _ in range(7)])
+        self.assertEqual(resp, (b"E_BAD_BODY", b"too big"))
+        self.assertEqual(len(conn.mpubs), 1)
+
+    @run_until_complete
+    async def test_limits(self):
+        writer = Writer(loop=self.loop, max_body_size=100)
+        self.assertEqual(writer.max_body_size, 100)
+        writer._max_body_size = None
+        self.assertEqual(writer.max_body_size, MAX_BODY_SIZE)
+        writer._conn = FakeConnection()
+        self.assertEqual(writer.max_body_size, FakeConnection.max_body_size)
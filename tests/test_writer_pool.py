@@ -0,0 +1,118 @@
+import asyncio
+
+from collections import deque
+
+from ._testutils import run_until_complete, BaseTest, FakeNsqd
+from nsqio.tcp.consts import CONNECTED, PUB
+from nsqio.tcp.exceptions import NSQNoConnections
+from nsqio.tcp.writer_pool import WriterPool, create_writer_pool
+
+
+class FakeConnection:
+    def __init__(self):
+        self._cmd_waiters = deque()
+        self.closed = False
+
+
+class FakeWriter:
+    def __init__(self, response=b"OK"):
+        self._status = CONNECTED
+        self._conn = FakeConnection()
+        self.response = response
+        self.executed = []
+        self.reconnects = 0
+
+    async def execute(self, command, *args, data=None):
+        self.executed.append((command, args, data))
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+    async def reconnect(self):
+        self.reconnects += 1
+        self.response = b"OK"
+
+
+class WriterPoolTest(BaseTest):
+    def _pool(self, writers, **kwargs):
+        pool = WriterPool(loop=self.loop, **kwargs)
+        for nsqd_id, writer in writers.items():
+            pool._writers[nsqd_id] = writer
+            pool._errors[nsqd_id] = 0
+        return pool
+
+    @run_until_complete
+    async def test_least_pending(self):
+        busy, idle = FakeWriter(), FakeWriter()
+        busy._conn._cmd_waiters.extend([None] * 3)
+        pool = self._pool({"busy": busy, "idle": idle})
+        for _ in range(4):
+            await pool.pub("topic", b"msg")
+        self.assertEqual(len(idle.executed), 4)
+        self.assertEqual(busy.executed, [])
+
+    @run_until_complete
+    async def test_failover_and_eject(self):
+        bad = FakeWriter(ConnectionError("down"))
+        good = FakeWriter()
+        bad._conn._cmd_waiters.clear()
+        good._conn._cmd_waiters.append(None)
+        pool = self._pool({"bad": bad, "good": good}, eject_errors=2)
+        for _ in range(3):
+            self.assertEqual(await pool.pub("topic", b"msg"), b"OK")
+        self.assertEqual(len(good.executed), 3)
+        # ejected after 2 errors, not tried anymore
+        self.assertEqual(len(bad.executed), 2)
+        self.assertTrue(pool.nodes["bad"]["ejected"])
+
+        # the probe reconnects it
+        await asyncio.sleep(1.5, loop=self.loop)
+        self.assertEqual(bad.reconnects, 1)
+        self.assertFalse(pool.nodes["bad"]["ejected"])
+        await pool.close()
+
+    @run_until_complete
+    async def test_publish_errors(self):
+        writer = FakeWriter((b"E_BAD_TOPIC", b"bad topic"))
+        other = FakeWriter()
+        other._conn._cmd_waiters.append(None)
+        pool = self._pool({"writer": writer, "other": other})
+        resp = await pool.execute(PUB, "bad topic", data=b"msg")
+        self.assertEqual(resp, (b"E_BAD_TOPIC", b"bad topic"))
+        # not retried elsewhere
+        self.assertEqual(other.executed, [])
+
+        writer._status = other._status = None
+        with self.assertRaises(NSQNoConnections):
+            await pool.pub("topic", b"msg")
+
+    @run_until_complete
+    async def test_retriable_response_returned_after_retries(self):
+        writers = {n: FakeWriter((b"E_PUB_FAILED", b"failed")) for n in "ab"}
+        pool = self._pool(writers, max_retries=1)
+        resp = await pool.pub("topic", b"msg")
+        self.assertEqual(resp, (b"E_PUB_FAILED", b"failed"))
+        self.assertEqual([len(w.executed) for w in writers.values()], [1, 1])
+
+    @run_until_complete
+    async def test_in_flight_fails_over(self):
+        dying = await FakeNsqd(self.loop, drop_on=(b"PUB",)).start()
+        alive = await FakeNsqd(self.loop).start()
+        addresses = ["127.0.0.1:{}".format(s.port) for s in (dying, alive)]
+        pool = await create_writer_pool(addresses, loop=self.loop, eject_errors=1)
+        try:
+            for _ in range(4):
+                resp = await asyncio.wait_for(
+                    pool.pub("topic", b"msg"), 5, loop=self.loop
+                )
+                self.assertEqual(resp, b"OK")
+            # sent to the dying one once, then ejected
+            self.assertEqual(dying.commands.count(b"PUB"), 1)
+            self.assertEqual(alive.commands.count(b"PUB"), 4)
+            self.assertTrue(
+                pool.nodes[pool._nsqd_id("127.0.0.1", dying.port)]["ejected"]
+            )
+        finally:
+            await pool.close()
+            await dying.close()
+            await alive.close()
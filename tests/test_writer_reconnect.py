@@ -0,0 +1,105 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest, FakeNsqd
+from nsqio.tcp.consts import CLOSED, CONNECTED
+from nsqio.tcp.writer import Writer, create_writer
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self._on_close = None
+
+    async def execute(self, command, *args, data=None):
+        return b"OK"
+
+    async def wait_for_closed(self, timeout=10):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._on_close and self._on_close(self)
+
+
+class FakeWriter(Writer):
+    """connects to nothing, ``up`` tells if connecting succeeds"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.up = True
+        self.attempts = 0
+
+    async def connect(self):
+        self.attempts += 1
+        await asyncio.sleep(0.01, loop=self._loop)
+        if not self.up:
+            self._status = CLOSED
+            self._start_reconnect()
+            return
+        self._conn = FakeConnection()
+        self._conn._on_close = self._on_conn_closed
+        self._status = CONNECTED
+
+
+class WriterReconnectTest(BaseTest):
+    @run_until_complete
+    async def test_idle_while_healthy(self):
+        writer = FakeWriter(loop=self.loop)
+        await writer.connect()
+        await asyncio.sleep(0.05, loop=self.loop)
+        self.assertIsNone(writer._reconnect_task)
+        self.assertEqual(writer.attempts, 1)
+        await writer.close()
+
+    @run_until_complete
+    async def test_single_reconnect_on_loss(self):
+        writer = FakeWriter(loop=self.loop)
+        await writer.connect()
+        writer._conn.close()
+        self.assertEqual(writer._status, CLOSED)
+        self.assertIsNotNone(writer._reconnect_task)
+
+        results = await asyncio.gather(
+            *[writer.pub("foo", b"msg") for _ in range(5)], loop=self.loop
+        )
+        self.assertEqual(results, [b"OK"] * 5)
+        self.assertEqual(writer.attempts, 2)
+        self.assertEqual(writer._status, CONNECTED)
+        self.assertTrue(writer._reconnect_task.done())
+        await writer.close()
+
+    @run_until_complete
+    async def test_failed_attempt(self):
+        writer = FakeWriter(loop=self.loop)
+        await writer.connect()
+        writer.up = False
+        writer._conn.close()
+        with self.assertRaises(ConnectionError):
+            await writer.pub("foo", b"msg")
+        # stays closed and keeps retrying in background
+        self.assertEqual(writer._status, CLOSED)
+        self.assertFalse(writer._reconnect_task.done())
+
+        writer.up = True
+        await asyncio.wait_for(writer._reconnect_task, 5, loop=self.loop)
+        self.assertEqual(writer._status, CONNECTED)
+        self.assertEqual(await writer.pub("foo", b"msg"), b"OK")
+        await writer.close()
+        self.assertFalse(writer._is_working)
+
+    @run_until_complete
+    async def test_in_flight_fails_on_drop(self):
+        server = await FakeNsqd(self.loop, drop_on=(b"PUB",)).start()
+        writer = await create_writer(port=server.port, loop=self.loop)
+        try:
+            with self.assertRaises(ConnectionError):
+                await asyncio.wait_for(writer.pub("foo", b"msg"), 5, loop=self.loop)
+
+            # reconnected by the loss
+            server.drop_on = ()
+            resp = await asyncio.wait_for(writer.pub("foo", b"msg"), 5, loop=self.loop)
+            self.assertEqual(resp, b"OK")
+        finally:
+            await writer.close()
+            await server.close()
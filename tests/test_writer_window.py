@@ -0,0 +1,102 @@
+import asyncio
+
+from ._testutils import run_until_complete, BaseTest, FakeNsqd
+from nsqio.tcp.writer import Writer, create_writer
+
+
+class FakeConnection:
+    def __init__(self, loop):
+        self.loop = loop
+        self.closed = False
+        self.waiters = []
+
+    def execute(self, command, *args, data=None):
+        fut = self.loop.create_future()
+        self.waiters.append(fut)
+        return fut
+
+    def execute_pipelined(self, command, calls):
+        return [self.execute(command, *args, data=data) for args, data in calls]
+
+
+class WriterWindowTest(BaseTest):
+    @run_until_complete
+    async def test_window(self):
+        writer = Writer(loop=self.loop, max_outstanding=2)
+        conn = writer._conn = FakeConnection(self.loop)
+        pubs = [self.loop.create_task(writer.pub("foo", b"msg")) for _ in range(5)]
+        await asyncio.sleep(0, loop=self.loop)
+        self.assertEqual(len(conn.waiters), 2)
+        self.assertEqual(writer.window["depth"], 2)
+        self.assertEqual(writer.window["waiting"], 3)
+
+        while not all(p.done() for p in pubs):
+            for fut in conn.waiters:
+                fut.done() or fut.set_result(b"OK")
+            await asyncio.sleep(0, loop=self.loop)
+            self.assertLessEqual(writer.window["depth"], 2)
+        self.assertEqual([p.result() for p in pubs], [b"OK"] * 5)
+        self.assertEqual(writer.window["acks"], 5)
+        self.assertEqual(writer.window["waiting"], 0)
+
+    @run_until_complete
+    async def test_dpub_many_takes_a_slot_per_frame(self):
+        writer = Writer(loop=self.loop, max_outstanding=2)
+        conn = writer._conn = FakeConnection(self.loop)
+        other = self.loop.create_task(writer.pub("foo", b"msg"))
+        dpubs = self.loop.create_task(writer.dpub_many([("foo", 100, b"msg")] * 5))
+        await asyncio.sleep(0, loop=self.loop)
+        # one slot left by the pub
+        self.assertEqual(len(conn.waiters), 2)
+        self.assertEqual(writer.window["depth"], 2)
+
+        while not dpubs.done():
+            for fut in conn.waiters:
+                fut.done() or fut.set_result(b"OK")
+            await asyncio.sleep(0, loop=self.loop)
+            self.assertLessEqual(writer.window["depth"], 2)
+        self.assertEqual(dpubs.result(), [b"OK"] * 5)
+        self.assertEqual(other.result(), b"OK")
+        self.assertEqual(len(conn.waiters), 6)
+
+    async def _pubs_fail(self, writer, count):
+        pubs = [writer.pub("foo", b"msg") for _ in range(count)]
+        results = await asyncio.wait_for(
+            asyncio.gather(*pubs, loop=self.loop, return_exceptions=True),
+            5,
+            loop=self.loop,
+        )
+        for result in results:
+            self.assertIsInstance(result, ConnectionError)
+        self.assertEqual(writer.window["depth"], 0)
+
+    @run_until_complete
+    async def test_drop_releases_window(self):
+        server = await FakeNsqd(self.loop, drop_on=(b"PUB",)).start()
+        writer = await create_writer(
+            port=server.port, loop=self.loop, max_outstanding=2
+        )
+        try:
+            for _ in range(2):
+                await self._pubs_fail(writer, 2)
+            server.drop_on = ()
+            resp = await asyncio.wait_for(writer.pub("foo", b"msg"), 5, loop=self.loop)
+            self.assertEqual(resp, b"OK")
+        finally:
+            await writer.close()
+            await server.close()
+
+    @run_until_complete
+    async def test_ack_timeout_releases_window(self):
+        server = await FakeNsqd(self.loop, ignore=(b"PUB",)).start()
+        writer = await create_writer(
+            port=server.port, loop=self.loop, max_outstanding=2, ack_timeout=0.1
+        )
+        try:
+            await self._pubs_fail(writer, 2)
+            server.ignore = ()
+            resp = await asyncio.wait_for(writer.pub("foo", b"msg"), 5, loop=self.loop)
+            self.assertEqual(resp, b"OK")
+        finally:
+            await writer.close()
+            await server.close()